@@ -1,10 +1,67 @@
 import logging
-from sqlite3 import Date, IntegrityError
+import time
+from datetime import date, datetime
 
-from sqlalchemy import select
+from pydantic import BaseModel
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from SQLAlchemy_models import Base, CurrencyRate
+
+from apipull.SQLAlchemy_models import (
+    Base,
+    CurrencyRate,
+    IngestResumePoint,
+    LatestCurrencyRate,
+    MoneyStorage,
+    RatesVersion,
+)
+
+RATES_VERSION_ROW_ID = 1
+# Эпоха истории: увеличивается, когда уже загруженные строки исправлены
+# или дозагружены задним числом (кэш историй во Flask перечитает их целиком)
+HISTORY_EPOCH_ROW_ID = 2
+MONEY_STORAGE_ROW_ID = 1
+
+# В режиме хранения 'integer' курсы записываются целым числом единиц 10**-RATE_SCALE
+RATE_SCALE = 4
+
+
+class UpsertStats(BaseModel):
+    """Итог bulk_upsert_currency_rates"""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    chunks: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.total} rows in {self.chunks} chunks: {self.inserted} inserted, "
+            f"{self.updated} updated, {self.unchanged} unchanged "
+            f"({self.elapsed:.2f}s, {self.rows_per_second:,.0f} rows/s)"
+        )
+
+
+def _as_row(rate) -> tuple:
+    """CurrencyRate или кортеж -> (code, effective_date, bid, ask)"""
+    if isinstance(rate, CurrencyRate):
+        code, effective_date, bid, ask = rate.code, rate.effective_date, rate.bid, rate.ask
+    else:
+        code, effective_date, bid, ask = rate
+    if isinstance(effective_date, datetime):
+        effective_date = effective_date.date()
+    return code, effective_date, bid, ask
 
 
 class AsyncDatabaseManager:
@@ -18,37 +75,275 @@ class AsyncDatabaseManager:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
 
+        # Первый запуск после появления таблицы latest_currency_rates:
+        # заполняем ее из уже загруженной истории
+        async with self.async_session() as session:
+            has_latest = await session.scalar(select(LatestCurrencyRate.code).limit(1))
+            has_history = await session.scalar(select(CurrencyRate.code).limit(1))
+        if has_history and not has_latest:
+            await self.rebuild_latest_currency_rates()
+
     async def add_currency_rate(
-        self, effective_date: Date, currency: str, code: str, bid: float, ask: float
+        self, effective_date: date, currency: str, code: str, bid: float, ask: float
     ):
+        logging.info(f"Upserting rate for {code} on {effective_date}")
+        return await self.bulk_upsert_currency_rates([(code, effective_date, bid, ask)])
+
+    async def bulk_upsert_currency_rates(
+        self, currency_rates, chunk_size: int = 500
+    ) -> UpsertStats:
+        """Вставка/обновление курсов пачками через INSERT ... ON CONFLICT DO UPDATE.
+
+        Каждая пачка — отдельная короткая транзакция: строки с теми же bid/ask
+        пропускаются, новые и измененные записываются одним executemany.
+        Дубликаты внутри входных данных не приводят к ошибке (побеждает последний).
+        """
+        stats = UpsertStats()
+        started = time.perf_counter()
+
+        # Режим читаем при каждом вызове: его может переключить миграция Flask-приложения
+        integer_storage = await self.get_money_storage() == "integer"
+        factor = 10**RATE_SCALE
+
+        rows = {}
+        for rate in currency_rates:
+            code, effective_date, bid, ask = _as_row(rate)
+            if integer_storage:
+                bid = None if bid is None else round(bid * factor)
+                ask = None if ask is None else round(ask * factor)
+            rows[(code, effective_date)] = (code, effective_date, bid, ask)
+        rows = list(rows.values())
+
+        upsert = insert(CurrencyRate)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[CurrencyRate.code, CurrencyRate.effective_date],
+            set_={"bid": upsert.excluded.bid, "ask": upsert.excluded.ask},
+            # Повторная запись тех же значений ничего не меняет
+            where=or_(
+                CurrencyRate.bid.is_distinct_from(upsert.excluded.bid),
+                CurrencyRate.ask.is_distinct_from(upsert.excluded.ask),
+            ),
+        )
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            async with self.async_session() as session:
+                existing = await self._existing_rates(session, chunk)
+
+                to_write = []
+                for code, effective_date, bid, ask in chunk:
+                    current = existing.get((code, effective_date))
+                    if current is None:
+                        stats.inserted += 1
+                    elif current != (bid, ask):
+                        stats.updated += 1
+                    else:
+                        stats.unchanged += 1
+                        continue
+                    to_write.append(
+                        {
+                            "code": code,
+                            "effective_date": effective_date,
+                            "bid": bid,
+                            "ask": ask,
+                        }
+                    )
+
+                if to_write:
+                    latest = await self._latest_dates(
+                        session, {row["code"] for row in to_write}
+                    )
+                    # Исправленные строки и даты раньше последней загруженной
+                    # нельзя дочитать инкрементально с конца истории
+                    rewrites_history = any(
+                        (row["code"], row["effective_date"]) in existing
+                        or row["effective_date"]
+                        < latest.get(row["code"], row["effective_date"])
+                        for row in to_write
+                    )
+                    await session.execute(upsert, to_write)
+                    await self._update_latest_rates(session, chunk)
+                    await self._bump_rates_version(session)
+                    if rewrites_history:
+                        await self._bump_version(session, HISTORY_EPOCH_ROW_ID)
+                    await session.commit()
+            stats.chunks += 1
+
+        stats.elapsed = time.perf_counter() - started
+        logging.info(f"Upserted currency rates: {stats}")
+        return stats
+
+    @staticmethod
+    async def _existing_rates(session: AsyncSession, chunk) -> dict:
+        # Один запрос на пачку: коды пачки в диапазоне ее дат (по индексу code, effective_date)
+        codes = {row[0] for row in chunk}
+        dates = [row[1] for row in chunk]
+        result = await session.execute(
+            select(
+                CurrencyRate.code,
+                CurrencyRate.effective_date,
+                CurrencyRate.bid,
+                CurrencyRate.ask,
+            ).where(
+                CurrencyRate.code.in_(codes),
+                CurrencyRate.effective_date.between(min(dates), max(dates)),
+            )
+        )
+        return {
+            (code, effective_date): (bid, ask)
+            for code, effective_date, bid, ask in result.all()
+        }
+
+    @staticmethod
+    async def _latest_dates(session: AsyncSession, codes) -> dict:
+        result = await session.execute(
+            select(LatestCurrencyRate.code, LatestCurrencyRate.effective_date).where(
+                LatestCurrencyRate.code.in_(codes)
+            )
+        )
+        return {code: effective_date for code, effective_date in result.all()}
+
+    async def get_high_water_marks(self) -> dict:
+        """Последняя загруженная дата по каждому коду (из latest_currency_rates)"""
         async with self.async_session() as session:
-            existing_rate = await session.execute(
-                select(CurrencyRate).where(
-                    CurrencyRate.code == code,
-                    CurrencyRate.effective_date == effective_date,
+            result = await session.execute(
+                select(LatestCurrencyRate.code, LatestCurrencyRate.effective_date)
+            )
+            return {code: effective_date for code, effective_date in result.all()}
+
+    async def get_resume_points(self) -> dict:
+        """Незавершенные загрузки по источникам: {"currency": date, "gold": date}"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(IngestResumePoint.source, IngestResumePoint.resume_from)
+            )
+            return {source: resume_from for source, resume_from in result.all()}
+
+    async def save_resume_points(self, points: dict):
+        """Записать точки возобновления по источникам (None — удалить)"""
+        async with self.async_session() as session:
+            for source, resume_from in points.items():
+                if resume_from is None:
+                    await session.execute(
+                        delete(IngestResumePoint).where(
+                            IngestResumePoint.source == source
+                        )
+                    )
+                    continue
+                stmt = insert(IngestResumePoint).values(
+                    source=source, resume_from=resume_from
+                )
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[IngestResumePoint.source],
+                        set_={"resume_from": stmt.excluded.resume_from},
+                    )
+                )
+            await session.commit()
+
+    async def get_money_storage(self) -> str:
+        """Режим хранения денежных величин в БД ('decimal', если не задан)"""
+        async with self.async_session() as session:
+            try:
+                mode = await session.scalar(
+                    select(MoneyStorage.mode).where(
+                        MoneyStorage.id == MONEY_STORAGE_ROW_ID
+                    )
+                )
+            except OperationalError:
+                # БД создана до появления таблицы money_storage
+                return "decimal"
+            return mode or "decimal"
+
+    async def get_rates_version(self) -> int:
+        """Текущий номер поколения курсов (0, если курсы еще не записывались)"""
+        async with self.async_session() as session:
+            version = await session.scalar(
+                select(RatesVersion.version).where(
+                    RatesVersion.id == RATES_VERSION_ROW_ID
                 )
             )
-            existing_rate = existing_rate.scalar_one_or_none()
-
-            if existing_rate:
-                logging.info(f"Updating rate for {code} on {effective_date}")
-                existing_rate.currency = currency
-                existing_rate.bid = bid
-                existing_rate.ask = ask
-            else:
-                logging.info(f"Adding new rate for {code} on {effective_date}")
-                new_rate = CurrencyRate(
-                    effective_date=effective_date,
-                    currency=currency,
-                    code=code,
-                    bid=bid,
-                    ask=ask,
+            return version or 0
+
+    async def rebuild_latest_currency_rates(self):
+        """Полностью пересобрать latest_currency_rates из истории currency_rates"""
+        async with self.async_session() as session:
+            latest_dates = (
+                select(
+                    CurrencyRate.code,
+                    func.max(CurrencyRate.effective_date).label("max_date"),
                 )
-                session.add(new_rate)
+                .group_by(CurrencyRate.code)
+                .subquery()
+            )
+            latest_rows = select(
+                CurrencyRate.code,
+                CurrencyRate.effective_date,
+                CurrencyRate.bid,
+                CurrencyRate.ask,
+            ).join(
+                latest_dates,
+                (CurrencyRate.code == latest_dates.c.code)
+                & (CurrencyRate.effective_date == latest_dates.c.max_date),
+            )
 
+            await session.execute(delete(LatestCurrencyRate))
+            result = await session.execute(
+                insert(LatestCurrencyRate).from_select(
+                    ["code", "effective_date", "bid", "ask"], latest_rows
+                )
+            )
+            await self._bump_rates_version(session)
             await session.commit()
+            logging.info(f"Rebuilt latest_currency_rates: {result.rowcount} codes.")
+
+    @staticmethod
+    async def _update_latest_rates(session: AsyncSession, rows):
+        # Из пачки берем только самую свежую запись по каждому коду
+        newest = {}
+        for code, effective_date, bid, ask in rows:
+            if code not in newest or newest[code][1] < effective_date:
+                newest[code] = (code, effective_date, bid, ask)
+        if not newest:
+            return
+
+        stmt = insert(LatestCurrencyRate).values(
+            [
+                {"code": code, "effective_date": effective_date, "bid": bid, "ask": ask}
+                for code, effective_date, bid, ask in newest.values()
+            ]
+        )
+        # Более старые даты не должны затирать уже сохраненный последний курс
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[LatestCurrencyRate.code],
+                set_={
+                    "effective_date": stmt.excluded.effective_date,
+                    "bid": stmt.excluded.bid,
+                    "ask": stmt.excluded.ask,
+                },
+                where=LatestCurrencyRate.effective_date <= stmt.excluded.effective_date,
+            )
+        )
+
+    @classmethod
+    async def _bump_rates_version(cls, session: AsyncSession):
+        # Сообщаем читателям (кэш Flask), что появились новые курсы
+        await cls._bump_version(session, RATES_VERSION_ROW_ID)
 
-    async def get_currency_rate_by_date(self, code: str, date: Date):
+    @staticmethod
+    async def _bump_version(session: AsyncSession, row_id: int):
+        now = datetime.utcnow()
+        await session.execute(
+            insert(RatesVersion)
+            .values(id=row_id, version=1, updated_at=now)
+            .on_conflict_do_update(
+                index_elements=[RatesVersion.id],
+                set_={"version": RatesVersion.version + 1, "updated_at": now},
+            )
+        )
+
+    async def get_currency_rate_by_date(self, code: str, date: date):
         async with self.async_session() as session:
             result = await session.execute(
                 select(CurrencyRate).where(
@@ -57,26 +352,8 @@ class AsyncDatabaseManager:
             )
             return result.scalar_one_or_none()
 
-    async def bulk_add_currency_rates(self, currency_rates: list[CurrencyRate]):
-        async with self.async_session() as session:
-            try:
-                # Цикл для добавления объектов по одному
-                for rate in currency_rates:
-                    session.add(rate)
-                await session.commit()
-                logging.info(
-                    f"Successfully added {len(currency_rates)} currency rates to the database."
-                )
-            except IntegrityError as e:
-                # В случае ошибки откатываем транзакцию и логируем проблему
-                await session.rollback()
-                logging.error(
-                    "IntegrityError: Unable to bulk insert currency rates. Possible duplicate primary keys."
-                )
-                raise e
-
     async def get_currency_rates_in_date_range(
-        self, code: str, start_date: Date, end_date: Date
+        self, code: str, start_date: date, end_date: date
     ):
         async with self.async_session() as session:
             result = await session.execute(
@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Date, Float, Index, PrimaryKeyConstraint, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+)
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -18,3 +27,46 @@ class CurrencyRate(Base):
             "idx_currency_code_date", "code", "effective_date"
         ),  # Индекс для ускорения поиска по валюте и дате
     )
+
+
+class LatestCurrencyRate(Base):
+    """Последний курс по каждому коду, обновляется при каждой загрузке курсов"""
+
+    __tablename__ = "latest_currency_rates"
+
+    code = Column(String, primary_key=True)
+    effective_date = Column(Date, nullable=False)
+    bid = Column(Float)
+    ask = Column(Float)
+
+
+class RatesVersion(Base):
+    """Номер поколения курсов, по которому Flask-приложение обновляет свой кэш"""
+
+    __tablename__ = "currency_rates_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class IngestResumePoint(Base):
+    """Дата, с которой следующая инкрементальная загрузка источника должна начаться
+    независимо от последних сохраненных курсов: начало самого раннего окна,
+    не загруженного из-за ошибки (или прерванного запуска)"""
+
+    __tablename__ = "ingest_resume_points"
+
+    source = Column(String(16), primary_key=True)
+    resume_from = Column(Date, nullable=False)
+
+
+class MoneyStorage(Base):
+    """Режим хранения денежных величин, который задает Flask-приложение
+    (flask migrate-money-storage): 'decimal' или 'integer'"""
+
+    __tablename__ = "money_storage"
+
+    id = Column(Integer, primary_key=True)
+    mode = Column(String(16), nullable=False, default="decimal")
+    updated_at = Column(DateTime)
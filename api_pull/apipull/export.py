@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+from loguru import logger
+from sqlalchemy import select
+
+from apipull.AsyncDatabaseManager import RATE_SCALE, AsyncDatabaseManager
+from apipull.SQLAlchemy_models import CurrencyRate
+
+EXPORT_COLUMNS = ("code", "effective_date", "bid", "ask")
+
+RATE_QUANTUM = Decimal(1).scaleb(-RATE_SCALE)
+
+
+def format_rate(value, integer_storage: bool = False) -> str | None:
+    """Курс из БД -> точная десятичная строка с RATE_SCALE знаками, как в HTTP-выгрузке"""
+    if value is None:
+        return None
+    if integer_storage:
+        # Целое число единиц 10**-RATE_SCALE: сдвиг запятой без деления во float
+        return str(Decimal(round(value)).scaleb(-RATE_SCALE))
+    # REAL: repr дает кратчайшую десятичную запись сохраненного числа
+    return str(Decimal(repr(value)).quantize(RATE_QUANTUM))
+
+
+def write_ndjson(out, partition, integer_storage: bool = False):
+    for code, effective_date, bid, ask in partition:
+        out.write(
+            json.dumps(
+                {
+                    "code": code,
+                    "effective_date": effective_date.isoformat(),
+                    "bid": format_rate(bid, integer_storage),
+                    "ask": format_rate(ask, integer_storage),
+                },
+                separators=(",", ":"),
+            )
+        )
+        out.write("\n")
+
+
+def write_csv(out, partition, integer_storage: bool = False):
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerows(
+        (
+            code,
+            effective_date.isoformat(),
+            format_rate(bid, integer_storage) or "",
+            format_rate(ask, integer_storage) or "",
+        )
+        for code, effective_date, bid, ask in partition
+    )
+
+
+async def export_currency_rates(
+    db_manager: AsyncDatabaseManager,
+    out,
+    export_format: str = "ndjson",
+    codes: list[str] | None = None,
+    start_date=None,
+    end_date=None,
+    batch_size: int = 5000,
+):
+    """Потоково выгружает currency_rates в out, держа в памяти не больше batch_size строк"""
+    # В режиме 'integer' курсы хранятся целым числом единиц — переводим их в Python
+    integer_storage = await db_manager.get_money_storage() == "integer"
+
+    stmt = select(
+        CurrencyRate.code,
+        CurrencyRate.effective_date,
+        CurrencyRate.bid,
+        CurrencyRate.ask,
+    ).order_by(CurrencyRate.code, CurrencyRate.effective_date)
+    if codes:
+        stmt = stmt.where(CurrencyRate.code.in_(codes))
+    if start_date:
+        stmt = stmt.where(CurrencyRate.effective_date >= start_date)
+    if end_date:
+        stmt = stmt.where(CurrencyRate.effective_date <= end_date)
+
+    write = write_csv if export_format == "csv" else write_ndjson
+    if export_format == "csv":
+        out.write(",".join(EXPORT_COLUMNS) + "\n")
+
+    exported = 0
+    async with db_manager.async_session() as session:
+        # Серверный курсор: строки приходят порциями по batch_size
+        result = await session.stream(stmt.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            write(out, partition, integer_storage)
+            exported += len(partition)
+            logger.debug(f"Exported {exported} rows")
+
+    return exported
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Stream the currency_rates history as NDJSON or CSV"
+    )
+
+    parser.add_argument(
+        "--format", choices=("ndjson", "csv"), default="ndjson", help="Output format"
+    )
+    parser.add_argument("--codes", type=str, help="Comma separated currency codes")
+    parser.add_argument(
+        "--start_date", type=str, help="Start date in YYYY-MM-DD format"
+    )
+    parser.add_argument("--end_date", type=str, help="End date in YYYY-MM-DD format")
+    parser.add_argument(
+        "--output", type=str, help="Output file (defaults to standard output)"
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=5000, help="Rows fetched per cursor batch"
+    )
+    parser.add_argument(
+        "--db_url", type=str, default="sqlite+aiosqlite:///database.db", help="Database URL"
+    )
+
+    args = parser.parse_args()
+    for name in ("start_date", "end_date"):
+        value = getattr(args, name)
+        if value:
+            try:
+                setattr(args, name, datetime.strptime(value, "%Y-%m-%d").date())
+            except ValueError:
+                print(f"Error: Invalid {name} format. Use YYYY-MM-DD format.")
+                exit(1)
+    args.codes = (
+        [code.strip() for code in args.codes.split(",") if code.strip()]
+        if args.codes
+        else None
+    )
+
+    return args
+
+
+async def main():
+    args = parse_arguments()
+
+    db_manager = AsyncDatabaseManager(args.db_url)
+    db_manager.engine.echo = False
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        exported = await export_currency_rates(
+            db_manager,
+            out,
+            export_format=args.format,
+            codes=args.codes,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            batch_size=args.batch_size,
+        )
+    finally:
+        if args.output:
+            out.close()
+        await db_manager.engine.dispose()
+
+    logger.info(f"Exported {exported} currency rates")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import aiohttp
+from loguru import logger
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: rate запросов в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ResponseCache:
+    """Кэш ответов NBP на диске: один JSON-файл на URL"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url: str):
+        path = self._path(url)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Поврежденный файл (например, после прерванной записи) — перекачаем
+            logger.warning(f"Ignoring corrupted cache entry {path}")
+            return None
+
+    def put(self, url: str, data):
+        path = self._path(url)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+class FetchStats:
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.failures = 0
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests, {self.cache_hits} cache hits, "
+            f"{self.retries} retries, {self.failures} failures"
+        )
+
+
+class NBPFetcher:
+    """HTTP-клиент NBP с ограничением параллельности, частоты запросов и кэшем.
+
+    Окна, которые целиком лежат в прошлом, не меняются, поэтому их ответы
+    сохраняются на диск и при повторных запусках читаются локально.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        limit_per_host: int = 4,
+        rate_limit: float = 10.0,
+        burst: int | None = None,
+        cache_dir: str | None = None,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 30.0,
+    ):
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.stats = FetchStats()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Accept": "application/json"},
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    @staticmethod
+    def is_immutable(end_date: str | date | datetime) -> bool:
+        """Окно, закончившееся до сегодняшнего дня, уже не изменится"""
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+        elif isinstance(end_date, datetime):
+            end_date = end_date.date()
+        return end_date < date.today()
+
+    async def fetch(self, url: str, immutable: bool = False):
+        if immutable and self.cache:
+            cached = self.cache.get(url)
+            if cached is not None:
+                self.stats.cache_hits += 1
+                return cached
+
+        data = await self._fetch_remote(url)
+
+        if immutable and self.cache and data is not None:
+            self.cache.put(url, data)
+        return data
+
+    async def _fetch_remote(self, url: str):
+        for attempt in range(self.retries):
+            delay = self.backoff * 2**attempt
+            async with self._semaphore:
+                await self.bucket.acquire()
+                self.stats.requests += 1
+                try:
+                    async with self._session.get(url) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status == 404:
+                            # NBP отвечает 404, если за период нет опубликованных таблиц
+                            logger.debug(f"No data published for URL: {url}")
+                            return []
+                        if response.status in (429, 503):
+                            retry_after = response.headers.get("Retry-After")
+                            if retry_after and retry_after.isdigit():
+                                delay = max(delay, float(retry_after))
+                        logger.error(
+                            f"Request failed with status {response.status} for URL: {url}"
+                        )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error(f"Request error: {e!r} for URL: {url}")
+
+            if attempt + 1 < self.retries:
+                self.stats.retries += 1
+                # Случайная добавка, чтобы повторы не шли синхронной волной
+                await asyncio.sleep(delay * (1 + random.random() / 2))
+
+        self.stats.failures += 1
+        logger.error(f"Failed to fetch data from {url} after {self.retries} attempts.")
+        return None
@@ -1,13 +1,13 @@
 import argparse
 import asyncio
-from datetime import datetime, timedelta
+import os
+import signal
+from datetime import date, datetime, time, timedelta
+from functools import partial
 from typing import Optional
 
-import aiohttp
-from aiohttp import ClientSession
-from jsonschema.exceptions import ValidationError
 from loguru import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 
 class Rate(BaseModel):
@@ -36,10 +36,24 @@ class GoldRate(BaseModel):
 
 
 from apipull.AsyncDatabaseManager import AsyncDatabaseManager
-from apipull.SQLAlchemy_models import CurrencyRate
+from apipull.fetcher import NBPFetcher
+from apipull.notify import publish_rates_updated
+from apipull.pipeline import Window, run_pipeline
+from apipull.scheduler import Backoff, PublicationSchedule
 
-API_URL_RATES = "https://api.nbp.pl/api/exchangerates/tables/c/{start_date}/{end_date}"
-API_URL_GOLD = "https://api.nbp.pl/api/cenyzlota/{start_date}/{end_date}"
+# Адреса можно переопределить через окружение (например, для benchmarks.fake_nbp)
+API_URL_RATES = os.environ.get(
+    "API_URL_RATES",
+    "https://api.nbp.pl/api/exchangerates/tables/c/{start_date}/{end_date}",
+)
+API_URL_GOLD = os.environ.get(
+    "API_URL_GOLD", "https://api.nbp.pl/api/cenyzlota/{start_date}/{end_date}"
+)
+
+GOLD_CODE = "GOLD_gold"
+
+CURRENCY_FIRST_DATE = datetime(2002, 1, 2)
+GOLD_FIRST_DATE = datetime(2013, 1, 2)
 
 
 # Функция для создания интервалов по 90 дней
@@ -67,41 +81,64 @@ def generate_date_ranges(
     return date_ranges
 
 
-async def fetch_data(session: ClientSession, url: str, retries: int = 3):
-    for attempt in range(retries):
-        try:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                else:
-                    logger.error(
-                        f"Request failed with status {response.status} for URL: {url}"
-                    )
-        except aiohttp.ClientError as e:
-            logger.error(f"Request error: {e} for URL: {url}")
-
-        await asyncio.sleep(2**attempt)
+def parse_currency_payload(payload) -> list[tuple]:
+    """Быстрый разбор ответа по таблице C: [(code, effective_date, bid, ask), ...].
 
-    logger.error(f"Failed to fetch data from {url} after {retries} attempts.")
-    return None
+    Структура проверяется один раз на таблицу, дата разбирается один раз на
+    таблицу, а курсы сразу превращаются в кортежи без промежуточных моделей.
+    Повторяющиеся коды внутри таблицы схлопываются (побеждает последний),
+    как в CurrencyData.remove_duplicate_rates.
+    """
+    if not isinstance(payload, list):
+        raise ValueError(f"Expected a list of tables, got {type(payload).__name__}")
 
+    rows = []
+    for table in payload:
+        try:
+            effective_date = date.fromisoformat(table["effectiveDate"])
+            rates = {
+                rate["code"]: (float(rate["bid"]), float(rate["ask"]))
+                for rate in table["rates"]
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid exchange rate table {table!r}: {e!r}") from e
+        rows.extend(
+            (code, effective_date, bid, ask) for code, (bid, ask) in rates.items()
+        )
+    return rows
 
-async def fetch_currency_data(start_date: datetime, end_date: datetime, api_url: str):
-    date_ranges = generate_date_ranges(start_date, end_date)
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
+def parse_gold_payload(payload) -> list[tuple]:
+    """Быстрый разбор ответа по ценам золота: [(GOLD_CODE, date, rate, rate), ...]"""
+    if not isinstance(payload, list):
+        raise ValueError(f"Expected a list of prices, got {type(payload).__name__}")
 
-        for start, end in date_ranges:
-            url = api_url.format(start_date=start, end_date=end)
-            tasks.append(fetch_data(session, url))
+    rows = []
+    for item in payload:
+        try:
+            price = float(item["cena"])
+            rows.append((GOLD_CODE, date.fromisoformat(item["data"]), price, price))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid gold price {item!r}: {e!r}") from e
+    return rows
 
-        results = await asyncio.gather(*tasks)
-        return ([result for result in results if result is not None], api_url)
 
+def reformat_instruments_dicts(
+    json_data, validate_type: str = "currency", strict: bool = True
+):
+    """Разбор ответов NBP (список окон).
+
+    strict=True — проверка через pydantic-модели, результат — CurrencyData/GoldRate.
+    strict=False — быстрый режим, результат — кортежи (code, effective_date, bid, ask).
+    """
+    if not strict:
+        parse = (
+            parse_currency_payload
+            if validate_type == "currency"
+            else parse_gold_payload
+        )
+        return [row for sublist in json_data for row in parse(sublist)]
 
-def reformat_instruments_dicts(json_data, validate_type: str = "currency"):
     try:
         if validate_type == "currency":
             currencies = [
@@ -109,7 +146,7 @@ def reformat_instruments_dicts(json_data, validate_type: str = "currency"):
             ]
             for currency in currencies:
                 currency.remove_duplicate_rates()
-            print("JSON is valid.")
+            logger.debug(f"Validated {len(currencies)} exchange rate tables")
             return currencies
         else:
             golds = []
@@ -122,7 +159,50 @@ def reformat_instruments_dicts(json_data, validate_type: str = "currency"):
                     golds.append(gold)
             return golds
     except ValidationError as e:
-        print("JSON is invalid:", e.json())
+        # Как и быстрый разбор, сообщаем о некорректном ответе через ValueError
+        logger.error(f"Invalid {validate_type} payload: {e}")
+        raise ValueError(f"Invalid {validate_type} payload: {e}") from e
+
+
+def source_dates(marks: dict) -> dict:
+    """Последние загруженные даты по источникам: {"currency": date, "gold": date}"""
+    # Таблица C публикуется целиком, поэтому для всех валют берем одну (максимальную) дату
+    currency_marks = [date for code, date in marks.items() if code != GOLD_CODE]
+    return {
+        "currency": max(currency_marks) if currency_marks else None,
+        "gold": marks.get(GOLD_CODE),
+    }
+
+
+def incremental_start_dates(
+    marks: dict,
+    start_for_currency: datetime,
+    start_for_gold: datetime,
+    resume_points: Optional[dict] = None,
+):
+    """Начальные даты загрузки: следующий день после последней сохраненной даты источника.
+
+    Если у источника есть точка возобновления (окно, не загруженное в прошлый раз),
+    загрузка начинается не позже нее: последняя дата могла уйти дальше пропуска.
+    """
+    last_dates = source_dates(marks)
+    if last_dates["currency"]:
+        start_for_currency = datetime.combine(
+            last_dates["currency"] + timedelta(days=1), time()
+        )
+    if last_dates["gold"]:
+        start_for_gold = datetime.combine(last_dates["gold"] + timedelta(days=1), time())
+
+    resume_points = resume_points or {}
+    if resume_points.get("currency"):
+        start_for_currency = min(
+            start_for_currency, datetime.combine(resume_points["currency"], time())
+        )
+    if resume_points.get("gold"):
+        start_for_gold = min(
+            start_for_gold, datetime.combine(resume_points["gold"], time())
+        )
+    return start_for_currency, start_for_gold
 
 
 def parse_arguments():
@@ -133,9 +213,85 @@ def parse_arguments():
     parser.add_argument(
         "--start_date", type=str, help="Start date in YYYY-MM-DD format"
     )
-    parser.add_argument("--verbose", action="store_true", help="Enable verbose mode")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Enable verbose mode (log SQL)"
+    )
+    parser.add_argument(
+        "--db_url",
+        type=str,
+        default="sqlite+aiosqlite:///database.db",
+        help="Database URL",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Fetch only dates after the last ones already stored in the database",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=500,
+        help="Rows written per upsert transaction",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Maximum parallel requests to NBP"
+    )
+    parser.add_argument(
+        "--rate_limit", type=float, default=10.0, help="Maximum requests per second"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=".nbp_cache",
+        help="Directory for cached responses of past (immutable) date windows",
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="Do not use the response cache"
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=4,
+        help="Windows buffered between fetch, parse and write stages",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Validate NBP responses with pydantic models (slower)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and fetch new tables on the NBP publication schedule",
+    )
+    parser.add_argument(
+        "--notify_file",
+        type=str,
+        help="File rewritten after every ingestion that changed rates "
+        "(watched by the Flask app, see RATES_NOTIFY_FILE)",
+    )
+    parser.add_argument(
+        "--poll_backoff",
+        type=float,
+        default=300.0,
+        help="Daemon: first delay (seconds) before re-checking a missing table",
+    )
+    parser.add_argument(
+        "--max_backoff",
+        type=float,
+        default=3600.0,
+        help="Daemon: maximum delay (seconds) between re-checks",
+    )
+    parser.add_argument(
+        "--rebuild_latest",
+        action="store_true",
+        help="Rebuild the latest_currency_rates table from history and exit",
+    )
 
     args = parser.parse_args()
+    if (args.incremental or args.daemon) and args.start_date:
+        print("Error: --incremental/--daemon and --start_date cannot be used together.")
+        exit(1)
     if args.start_date:
         try:
             args.start_date = datetime.strptime(args.start_date, "%Y-%m-%d")
@@ -146,10 +302,81 @@ def parse_arguments():
     return args
 
 
+async def ingest_incremental(db_manager, fetcher, args, today: datetime):
+    marks = await db_manager.get_high_water_marks()
+    start_for_currency, start_for_gold = incremental_start_dates(
+        marks,
+        CURRENCY_FIRST_DATE,
+        GOLD_FIRST_DATE,
+        await db_manager.get_resume_points(),
+    )
+    logger.info(
+        f"Incremental mode: currency from {start_for_currency.date()}, "
+        f"gold from {start_for_gold.date()}"
+    )
+    return await ingest(
+        db_manager, fetcher, args, start_for_currency, start_for_gold, today
+    )
+
+
+async def publish_if_changed(db_manager, args, stats):
+    if not args.notify_file or stats is None:
+        return
+    if stats.upsert.inserted or stats.upsert.updated:
+        publish_rates_updated(args.notify_file, await db_manager.get_rates_version())
+
+
+async def run_daemon(db_manager, fetcher, args):
+    """Постоянная работа: догрузка курсов по расписанию публикаций NBP.
+
+    При старте и в каждый слот публикации выполняется инкрементальная загрузка.
+    Если ожидаемой таблицы за сегодня еще нет, проверка повторяется с растущей
+    паузой до cutoff; затем процесс спит до следующего слота.
+    """
+    schedule = PublicationSchedule()
+    backoff = Backoff(args.poll_backoff, args.max_backoff)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info("Daemon mode started")
+    while not stop.is_set():
+        try:
+            now = schedule.now().replace(tzinfo=None)
+            stats = await ingest_incremental(db_manager, fetcher, args, now)
+            await publish_if_changed(db_manager, args, stats)
+        except Exception:
+            # Сбой одной попытки не должен останавливать демон
+            logger.exception("Ingestion attempt failed")
+
+        now = schedule.now()
+        marks = await db_manager.get_high_water_marks()
+        due = schedule.due_sources(now, source_dates(marks))
+        if due:
+            delay = schedule.retry_delay(now, backoff.next())
+            logger.info(f"No new data for {', '.join(due)} yet, retry in {delay:.0f}s")
+        else:
+            backoff.reset()
+            next_slot = schedule.next_slot(now)
+            delay = (next_slot - now).total_seconds()
+            logger.info(
+                f"Rates are up to date, next check at {next_slot:%Y-%m-%d %H:%M %Z}"
+            )
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info("Daemon mode stopped")
+
+
 async def main():
     today = datetime.today()
-    start_for_currency = datetime.strptime("2002-01-02", "%Y-%m-%d")
-    start_for_gold = datetime.strptime("2013-01-02", "%Y-%m-%d")
+    start_for_currency = CURRENCY_FIRST_DATE
+    start_for_gold = GOLD_FIRST_DATE
 
     args = parse_arguments()
     if args.start_date:
@@ -163,55 +390,145 @@ async def main():
             logger.error(f"Error: start_date must be after start_for_currency")
             exit(1)
 
-    tasks = [
-        fetch_currency_data(start_for_currency, today, API_URL_RATES),
-        fetch_currency_data(start_for_gold, today, API_URL_GOLD),
-    ]
-
-    db_url = "sqlite+aiosqlite:///database.db"  # замените на ваш URL базы данных
-    db_manager = AsyncDatabaseManager(db_url)
+    db_manager = AsyncDatabaseManager(args.db_url)
+    db_manager.engine.echo = args.verbose
 
     await db_manager.init_db()
 
-    currency_data = []
-    gold_rates = []
+    if args.rebuild_latest:
+        await db_manager.rebuild_latest_currency_rates()
+        return
 
-    for task in asyncio.as_completed(tasks):
-        data = await task
-        if data[1] == API_URL_RATES:
-            currency_data = reformat_instruments_dicts(
-                data[0], validate_type="currency"
+    fetcher = NBPFetcher(
+        concurrency=args.concurrency,
+        limit_per_host=args.concurrency,
+        rate_limit=args.rate_limit,
+        cache_dir=None if args.no_cache else args.cache_dir,
+    )
+    async with fetcher:
+        if args.daemon:
+            await run_daemon(db_manager, fetcher, args)
+        elif args.incremental:
+            stats = await ingest_incremental(db_manager, fetcher, args, today)
+            await publish_if_changed(db_manager, args, stats)
+        else:
+            stats = await ingest(
+                db_manager, fetcher, args, start_for_currency, start_for_gold, today
             )
+            await publish_if_changed(db_manager, args, stats)
+    logger.info(f"NBP fetch: {fetcher.stats}")
+    if not args.daemon and stats is not None and stats.failed_windows:
+        # Ненулевой код возврата, чтобы планировщик (cron) заметил неполную загрузку
+        exit(1)
+
+
+def currency_window_rows(payload, strict: bool = False) -> list[tuple]:
+    """Ответ NBP по таблице C за одно окно -> строки для записи"""
+    if not strict:
+        return parse_currency_payload(payload)
+
+    currency_data = reformat_instruments_dicts([payload], validate_type="currency")
+
+    rows = []
+    for currency_item in currency_data or []:
+        effective_date = datetime.strptime(
+            currency_item.effectiveDate, "%Y-%m-%d"
+        ).date()
+        for rate in currency_item.rates:
+            rows.append((rate.code, effective_date, rate.bid, rate.ask))
+    return rows
+
+
+def gold_window_rows(payload, strict: bool = False) -> list[tuple]:
+    """Ответ NBP по ценам золота за одно окно -> строки для записи"""
+    if not strict:
+        return parse_gold_payload(payload)
+
+    gold_rates = reformat_instruments_dicts([payload], validate_type="gold")
+    return [
+        (GOLD_CODE, gold_item.date.date(), gold_item.rate, gold_item.rate)
+        for gold_item in gold_rates or []
+    ]
 
-            currency_data_db = []
-            for currency_item in currency_data:
-                for rate in currency_item.rates:
-                    currency_rate = CurrencyRate(
-                        code=rate.code,
-                        effective_date=datetime.strptime(
-                            currency_item.effectiveDate, "%Y-%m-%d"
-                        ).date(),
-                        bid=rate.bid,
-                        ask=rate.ask,
-                    )
-                    currency_data_db.append(currency_rate)
 
-            await db_manager.bulk_add_currency_rates(currency_data_db)
+def build_windows(
+    start_date: datetime, end_date: datetime, api_url: str, parse, source: str
+):
+    return [
+        Window(
+            url=api_url.format(start_date=start, end_date=end),
+            immutable=NBPFetcher.is_immutable(end),
+            parse=parse,
+            source=source,
+            start=date.fromisoformat(start),
+        )
+        for start, end in generate_date_ranges(start_date, end_date)
+    ]
 
-        elif data[1] == API_URL_GOLD:
-            gold_rates = reformat_instruments_dicts(data[0], validate_type="gold")
 
-            gold_rate_db = []
-            for gold_item in gold_rates:
-                currency_rate = CurrencyRate(
-                    code="GOLD_gold",
-                    effective_date=gold_item.date,
-                    bid=gold_item.rate,
-                    ask=gold_item.rate,
-                )
-                gold_rate_db.append(currency_rate)
+async def ingest(db_manager, fetcher, args, start_for_currency, start_for_gold, today):
+    windows = []
+    if start_for_currency <= today:
+        windows += build_windows(
+            start_for_currency,
+            today,
+            API_URL_RATES,
+            partial(currency_window_rows, strict=args.strict),
+            "currency",
+        )
+    if start_for_gold <= today:
+        windows += build_windows(
+            start_for_gold,
+            today,
+            API_URL_GOLD,
+            partial(gold_window_rows, strict=args.strict),
+            "gold",
+        )
+    if not windows:
+        logger.info("Currency and gold rates are already up to date.")
+        return None
+
+    # Окна пишутся не по порядку дат, поэтому до конца запуска последние даты
+    # не означают, что все более ранние окна загружены: прерванный запуск
+    # должен начаться заново с первого окна
+    run_starts = {}
+    for window in windows:
+        run_starts.setdefault(window.source, window.start)
+    previous = await db_manager.get_resume_points()
+    await db_manager.save_resume_points(
+        {
+            source: min(start, previous.get(source, start))
+            for source, start in run_starts.items()
+        }
+    )
 
-            await db_manager.bulk_add_currency_rates(gold_rate_db)
+    # Окна скачиваются, разбираются и записываются по мере поступления
+    stats = await run_pipeline(
+        db_manager,
+        fetcher,
+        windows,
+        chunk_size=args.chunk_size,
+        queue_size=args.queue_size,
+    )
+
+    # Следующий запуск начнется с самого раннего пропущенного окна источника
+    resume_points = {}
+    for source, start in run_starts.items():
+        pending = [window.start for window in stats.failed if window.source == source]
+        if source in previous and previous[source] < start:
+            pending.append(previous[source])
+        resume_points[source] = min(pending) if pending else None
+    await db_manager.save_resume_points(resume_points)
+    if stats.failed_windows:
+        logger.error(
+            f"{stats.failed_windows} windows failed; the next incremental run resumes from "
+            + ", ".join(
+                f"{source} {resume_from}"
+                for source, resume_from in resume_points.items()
+                if resume_from
+            )
+        )
+    return stats
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+
+def publish_rates_updated(path: str, version: int):
+    """Сообщить подписчикам (Flask-приложению), что записаны новые курсы.
+
+    Файл заменяется атомарно, поэтому у него меняются inode и mtime —
+    подписчик замечает это одним os.stat, не обращаясь к БД.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": version, "updated_at": datetime.utcnow().isoformat()}, f
+        )
+    os.replace(tmp_path, path)
+    logger.info(f"Published rates version {version} to {path}")
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from datetime import date
+from typing import Callable, NamedTuple
+
+from loguru import logger
+
+from apipull.AsyncDatabaseManager import AsyncDatabaseManager, UpsertStats
+from apipull.fetcher import NBPFetcher
+
+
+class Window(NamedTuple):
+    """Одно окно дат источника NBP"""
+
+    url: str
+    immutable: bool
+    # payload окна -> [(code, effective_date, bid, ask), ...]
+    parse: Callable
+    # Источник ("currency" или "gold") и первая дата окна
+    source: str
+    start: date
+
+
+class PipelineStats:
+    def __init__(self):
+        self.windows = 0
+        # Окна, пропущенные из-за ошибки скачивания или разбора
+        self.failed: list[Window] = []
+        self.rows = 0
+        self.max_in_flight = 0
+        self.upsert = UpsertStats()
+        self.elapsed = 0.0
+
+    @property
+    def failed_windows(self) -> int:
+        return len(self.failed)
+
+    def __str__(self):
+        return (
+            f"{self.windows} windows ({self.failed_windows} failed), {self.rows} rows, "
+            f"max {self.max_in_flight} windows in flight; {self.upsert}; "
+            f"total {self.elapsed:.2f}s"
+        )
+
+
+async def run_pipeline(
+    db_manager: AsyncDatabaseManager,
+    fetcher: NBPFetcher,
+    windows: list[Window],
+    chunk_size: int = 500,
+    queue_size: int = 4,
+    parse_workers: int = 2,
+) -> PipelineStats:
+    """Загрузка окон по схеме fetch -> parse -> write с ограниченными очередями.
+
+    Окна разбираются и записываются по мере получения. Окно, которое не удалось
+    скачать или разобрать, пропускается и попадает в stats.failed; остальные
+    окна загружаются. Очереди ограничены
+    queue_size, поэтому если запись в БД не успевает, скачивание
+    приостанавливается, и в памяти одновременно находится не больше
+    concurrency + parse_workers + 2 * queue_size + 1 окон.
+    """
+    stats = PipelineStats()
+    started = time.perf_counter()
+
+    pending = asyncio.Queue()
+    for window in windows:
+        pending.put_nowait(window)
+
+    payloads = asyncio.Queue(maxsize=queue_size)
+    rows_queue = asyncio.Queue(maxsize=queue_size)
+    in_flight = 0
+
+    def track(delta):
+        nonlocal in_flight
+        in_flight += delta
+        stats.max_in_flight = max(stats.max_in_flight, in_flight)
+
+    def fail(window, reason):
+        logger.warning(f"Skipping window {window.url}: {reason}")
+        stats.failed.append(window)
+        track(-1)
+
+    async def fetch_worker():
+        while True:
+            try:
+                window = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            track(1)
+            payload = await fetcher.fetch(window.url, immutable=window.immutable)
+            if payload is None:
+                fail(window, "fetch failed")
+                continue
+            await payloads.put((window, payload))
+
+    async def parse_worker():
+        while True:
+            item = await payloads.get()
+            if item is None:
+                return
+            window, payload = item
+            # Валидация — работа для CPU; в отдельном потоке она не блокирует сетевой цикл
+            try:
+                rows = await asyncio.to_thread(window.parse, payload)
+            except Exception as e:
+                fail(window, f"invalid payload: {e!r}")
+                continue
+            await rows_queue.put(rows)
+
+    async def write_worker():
+        while True:
+            rows = await rows_queue.get()
+            if rows is None:
+                return
+            if rows:
+                result = await db_manager.bulk_upsert_currency_rates(
+                    rows, chunk_size=chunk_size
+                )
+                stats.upsert.inserted += result.inserted
+                stats.upsert.updated += result.updated
+                stats.upsert.unchanged += result.unchanged
+                stats.upsert.chunks += result.chunks
+                stats.rows += len(rows)
+            stats.windows += 1
+            track(-1)
+
+    async with asyncio.TaskGroup() as group:
+        writer = group.create_task(write_worker())
+        parsers = [group.create_task(parse_worker()) for _ in range(parse_workers)]
+        fetchers = [
+            group.create_task(fetch_worker()) for _ in range(fetcher.concurrency)
+        ]
+
+        # Завершаем стадии по очереди: скачивание -> разбор -> запись
+        await asyncio.gather(*fetchers)
+        for _ in parsers:
+            await payloads.put(None)
+        await asyncio.gather(*parsers)
+        await rows_queue.put(None)
+        await writer
+
+    stats.elapsed = time.perf_counter() - started
+    stats.upsert.elapsed = stats.elapsed
+    logger.info(f"Pipeline: {stats}")
+    return stats
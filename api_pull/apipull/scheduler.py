@@ -0,0 +1,72 @@
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+WARSAW = ZoneInfo("Europe/Warsaw")
+
+
+class PublicationSchedule:
+    """Расписание публикаций NBP по рабочим дням (время Варшавы).
+
+    Таблица C выходит между 7:45 и 8:15, цена золота — около 12:00.
+    В праздники NBP ничего не публикует: после cutoff ожидание данных
+    за текущий день прекращается до следующего рабочего дня.
+    """
+
+    def __init__(
+        self,
+        slots: dict[str, time] | None = None,
+        cutoff: time = time(16, 0),
+        tz: ZoneInfo = WARSAW,
+    ):
+        self.slots = slots or {"currency": time(8, 15), "gold": time(12, 15)}
+        self.cutoff = cutoff
+        self.tz = tz
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def due_sources(self, now: datetime, last_dates: dict[str, date]) -> list[str]:
+        """Источники, чья публикация за сегодня уже должна была выйти, но еще не загружена"""
+        today = now.date()
+        if today.weekday() >= 5 or now.time() >= self.cutoff:
+            return []
+        return [
+            source
+            for source, published_at in self.slots.items()
+            if now.time() >= published_at
+            and (last_dates.get(source) is None or last_dates[source] < today)
+        ]
+
+    def next_slot(self, now: datetime) -> datetime:
+        """Ближайшее будущее время публикации"""
+        day = now.date()
+        while True:
+            if day.weekday() < 5:
+                for published_at in sorted(self.slots.values()):
+                    slot = datetime.combine(day, published_at, tzinfo=self.tz)
+                    if slot > now:
+                        return slot
+            day += timedelta(days=1)
+
+    def retry_delay(self, now: datetime, backoff: float) -> float:
+        """Пауза перед повторной проверкой: не дольше, чем до cutoff или следующего слота"""
+        cutoff = datetime.combine(now.date(), self.cutoff, tzinfo=self.tz)
+        limit = min(cutoff, self.next_slot(now)) - now
+        return max(1.0, min(backoff, limit.total_seconds()))
+
+
+class Backoff:
+    """Экспоненциально растущая пауза между проверками новой таблицы"""
+
+    def __init__(self, initial: float = 300.0, maximum: float = 3600.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.current = initial
+
+    def next(self) -> float:
+        delay = self.current
+        self.current = min(self.current * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self.current = self.initial
@@ -0,0 +1,137 @@
+# Бенчмарк загрузки apipull.main против локального benchmarks.fake_nbp.
+#
+# Каждый сценарий запускает apipull.main отдельным процессом и измеряет
+# время, строки в секунду, пиковую память процесса и число запросов к серверу.
+#
+# Запуск из каталога api_pull:
+#     python -m benchmarks.bench_ingest --latency 0.05 --error_rate 0.01
+import argparse
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from aiohttp import web
+
+from benchmarks.fake_nbp import add_server_arguments, build_server
+
+API_PULL_DIR = Path(__file__).resolve().parents[1]
+
+
+def count_rows(db_path: Path) -> int:
+    if not db_path.exists():
+        return 0
+    with sqlite3.connect(db_path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM currency_rates").fetchone()[0]
+
+
+def forget_recent_days(db_path: Path, days: int):
+    """Удалить последние days дней истории, чтобы --incremental было что догружать"""
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+    with sqlite3.connect(db_path) as connection:
+        connection.execute("DELETE FROM currency_rates WHERE effective_date > ?", (cutoff,))
+        # Пустую latest_currency_rates init_db пересоберет из оставшейся истории
+        connection.execute("DELETE FROM latest_currency_rates")
+
+
+def run_ingest(args: list[str], env: dict) -> tuple[float, int, int]:
+    """Запустить apipull.main; вернуть (секунды, код возврата, пиковый RSS в КиБ)"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "apipull.main", *args],
+        cwd=API_PULL_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    # wait4 отдает rusage именно этого процесса, а не всех потомков сразу
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return time.perf_counter() - started, process.returncode, usage.ru_maxrss
+
+
+async def run_scenario(name, server, ingest_args, env, db_path):
+    server.stats.clear()
+    rows_before = count_rows(db_path)
+    elapsed, returncode, max_rss = await asyncio.to_thread(run_ingest, ingest_args, env)
+    rows = count_rows(db_path) - rows_before
+    stats = dict(server.stats)
+    print(
+        f"{name:<12} {elapsed:8.2f} s  {rows:>9,} rows  {rows / elapsed:10,.0f} rows/s  "
+        f"{max_rss / 1024:7.1f} MiB  {stats.get('requests', 0):>5} requests "
+        f"({stats.get('429', 0)} x 429, {stats.get('500', 0)} x 500)"
+        + ("" if returncode == 0 else f"  FAILED (exit {returncode})")
+    )
+    return returncode == 0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingestion benchmark")
+    add_server_arguments(parser)
+    parser.add_argument(
+        "--start_date",
+        type=str,
+        help="Start of the full load (default: from the first NBP table)",
+    )
+    parser.add_argument(
+        "--incremental_days",
+        type=int,
+        default=30,
+        help="Days removed before the incremental run",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate_limit", type=float, default=1000.0)
+    parser.add_argument("--chunk_size", type=int, default=500)
+    parser.add_argument("--queue_size", type=int, default=4)
+    parser.add_argument("--strict", action="store_true", help="Use pydantic parsing")
+    args = parser.parse_args()
+
+    server = build_server(args)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    base = f"http://{host}:{port}/api"
+
+    env = dict(os.environ)
+    env["API_URL_RATES"] = f"{base}/exchangerates/tables/c/{{start_date}}/{{end_date}}"
+    env["API_URL_GOLD"] = f"{base}/cenyzlota/{{start_date}}/{{end_date}}"
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = Path(directory) / "bench.db"
+            common = [
+                "--db_url", f"sqlite+aiosqlite:///{db_path}",
+                "--no_cache",
+                "--concurrency", str(args.concurrency),
+                "--rate_limit", str(args.rate_limit),
+                "--chunk_size", str(args.chunk_size),
+                "--queue_size", str(args.queue_size),
+            ]
+            if args.strict:
+                common.append("--strict")
+
+            print(f"Fake NBP at {base}, latency {args.latency}s, "
+                  f"errors {args.error_rate:.0%}, 429s {args.throttle_rate:.0%}")
+            full = [*common, "--start_date", args.start_date] if args.start_date else common
+            if not await run_scenario("full", server, full, env, db_path):
+                return
+            forget_recent_days(db_path, args.incremental_days)
+            await run_scenario(
+                "incremental", server, [*common, "--incremental"], env, db_path
+            )
+            await run_scenario(
+                "up-to-date", server, [*common, "--incremental"], env, db_path
+            )
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# Микробенчмарк разбора ответов NBP: pydantic (--strict) против быстрого режима.
+#
+# Запуск из каталога api_pull:
+#     python -m benchmarks.bench_parse --windows 95 --repeat 5
+import argparse
+import contextlib
+import io
+import time
+from datetime import date, timedelta
+
+from apipull.main import currency_window_rows, gold_window_rows
+
+# Состав таблицы C NBP
+CODES = [
+    "USD", "AUD", "CAD", "EUR", "HUF", "CHF", "GBP",
+    "JPY", "CZK", "DKK", "NOK", "SEK", "XDR",
+]
+
+
+def make_currency_window(start: date, days: int = 91):
+    tables = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        tables.append(
+            {
+                "table": "C",
+                "no": f"{offset:03d}/C/NBP/{day.year}",
+                "tradingDate": (day - timedelta(days=1)).isoformat(),
+                "effectiveDate": day.isoformat(),
+                "rates": [
+                    {
+                        "currency": code.lower(),
+                        "code": code,
+                        "bid": round(1 + i * 0.37 + offset * 0.001, 4),
+                        "ask": round(1.02 + i * 0.37 + offset * 0.001, 4),
+                    }
+                    for i, code in enumerate(CODES)
+                ],
+            }
+        )
+    return tables
+
+
+def make_gold_window(start: date, days: int = 91):
+    return [
+        {"data": (start + timedelta(days=offset)).isoformat(), "cena": 250.12 + offset}
+        for offset in range(days)
+        if (start + timedelta(days=offset)).weekday() < 5
+    ]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def parse_all(parse, windows, strict):
+    # Строгий режим печатает "JSON is valid." на каждое окно — в замер не пускаем
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [row for window in windows for row in parse(window, strict=strict)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NBP payload parsing micro-benchmark")
+    parser.add_argument(
+        "--windows", type=int, default=95, help="91-day windows (95 is a full backfill)"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per case (best is reported)"
+    )
+    args = parser.parse_args()
+
+    start = date(2002, 1, 2)
+    currency_windows = [
+        make_currency_window(start + timedelta(days=91 * i)) for i in range(args.windows)
+    ]
+    gold_windows = [
+        make_gold_window(start + timedelta(days=91 * i)) for i in range(args.windows)
+    ]
+
+    cases = [
+        ("currency", currency_window_rows, currency_windows),
+        ("gold", gold_window_rows, gold_windows),
+    ]
+    print(f"{args.windows} windows, best of {args.repeat}")
+    for name, parse, windows in cases:
+        results = {}
+        for strict in (True, False):
+            mode = "strict (pydantic)" if strict else "fast"
+            elapsed, rows = best_of(
+                args.repeat, lambda: parse_all(parse, windows, strict)
+            )
+            results[strict] = rows
+            print(
+                f"{name:<9} {mode:<18} {elapsed * 1000:9.1f} ms  "
+                f"{len(rows) / elapsed:12,.0f} rows/s  {len(rows):>8,} rows"
+            )
+        # Оба режима обязаны давать одинаковые строки
+        assert results[True] == results[False]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# Локальная замена api.nbp.pl для бенчмарков и ручной проверки загрузки.
+#
+# Запуск из каталога api_pull:
+#     python -m benchmarks.fake_nbp --port 8099 --latency 0.05 --error_rate 0.02
+# и затем в другом терминале:
+#     API_URL_RATES=http://127.0.0.1:8099/api/exchangerates/tables/c/{start_date}/{end_date} \
+#     API_URL_GOLD=http://127.0.0.1:8099/api/cenyzlota/{start_date}/{end_date} \
+#     python -m apipull.main --db_url sqlite+aiosqlite:///fake.db --no_cache
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+from aiohttp import web
+from loguru import logger
+
+# Состав таблицы C NBP
+CODES = [
+    "USD", "AUD", "CAD", "EUR", "HUF", "CHF", "GBP",
+    "JPY", "CZK", "DKK", "NOK", "SEK", "XDR",
+]
+CURRENCY_FIRST_DATE = date(2002, 1, 2)
+GOLD_FIRST_DATE = date(2013, 1, 2)
+
+# NBP отклоняет запросы за период длиннее 93 дней
+MAX_RANGE_DAYS = 93
+
+
+def generate_tables(first_date: date, last_date: date) -> dict:
+    """Детерминированные таблицы C по рабочим дням: {date: table}"""
+    tables = {}
+    day = first_date
+    number = 0
+    while day <= last_date:
+        if day.weekday() < 5:
+            number += 1
+            # Курс медленно «дрейфует», чтобы данные не были одинаковыми
+            drift = (day - first_date).days * 0.0001
+            tables[day] = {
+                "table": "C",
+                "no": f"{number:03d}/C/NBP/{day.year}",
+                "tradingDate": (day - timedelta(days=1)).isoformat(),
+                "effectiveDate": day.isoformat(),
+                "rates": [
+                    {
+                        "currency": code.lower(),
+                        "code": code,
+                        "bid": round(1 + i * 0.37 + drift, 4),
+                        "ask": round(1.02 + i * 0.37 + drift, 4),
+                    }
+                    for i, code in enumerate(CODES)
+                ],
+            }
+        day += timedelta(days=1)
+    return tables
+
+
+def generate_gold(first_date: date, last_date: date) -> dict:
+    """Детерминированные цены золота по рабочим дням: {date: item}"""
+    prices = {}
+    day = first_date
+    while day <= last_date:
+        if day.weekday() < 5:
+            price = round(120 + (day - first_date).days * 0.05, 2)
+            prices[day] = {"data": day.isoformat(), "cena": price}
+        day += timedelta(days=1)
+    return prices
+
+
+def load_fixtures(directory: str) -> tuple[dict, dict]:
+    """Записанные ответы NBP (например, каталог .nbp_cache): все *.json, разложенные по датам"""
+    tables, gold = {}, {}
+    for path in sorted(Path(directory).glob("*.json")):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        for item in payload:
+            if "effectiveDate" in item:
+                tables[date.fromisoformat(item["effectiveDate"])] = item
+            elif "data" in item:
+                gold[date.fromisoformat(item["data"])] = item
+    logger.info(f"Loaded {len(tables)} tables and {len(gold)} gold prices from {directory}")
+    return tables, gold
+
+
+class FakeNBP:
+    """Сервер с ответами в формате NBP, задержкой и сбоями"""
+
+    def __init__(
+        self,
+        tables: dict,
+        gold: dict,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int | None = None,
+    ):
+        self.tables = tables
+        self.gold = gold
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = Counter()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(
+            "/api/exchangerates/tables/c/{start_date}/{end_date}", self.handle_tables
+        )
+        app.router.add_get("/api/cenyzlota/{start_date}/{end_date}", self.handle_gold)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_stats/reset", self.handle_reset)
+        return app
+
+    async def handle_tables(self, request):
+        return await self._serve(request, self.tables)
+
+    async def handle_gold(self, request):
+        return await self._serve(request, self.gold)
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    async def handle_reset(self, request):
+        self.stats.clear()
+        return web.json_response({})
+
+    async def _serve(self, request, source: dict):
+        self.stats["requests"] += 1
+        if self.latency:
+            delay = self.latency * (1 + self.random.uniform(-self.jitter, self.jitter))
+            await asyncio.sleep(max(0.0, delay))
+
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return self._respond(
+                web.Response(
+                    status=429,
+                    text="Too Many Requests",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            )
+        if roll < self.throttle_rate + self.error_rate:
+            return self._respond(web.Response(status=500, text="Internal Server Error"))
+
+        try:
+            start_date = date.fromisoformat(request.match_info["start_date"])
+            end_date = date.fromisoformat(request.match_info["end_date"])
+        except ValueError:
+            return self._respond(web.Response(status=400, text="Bad Request"))
+        if end_date < start_date or (end_date - start_date).days > MAX_RANGE_DAYS:
+            return self._respond(
+                web.Response(status=400, text=f"Przekroczony limit {MAX_RANGE_DAYS} dni")
+            )
+
+        items = []
+        day = start_date
+        while day <= end_date:
+            if day in source:
+                items.append(source[day])
+            day += timedelta(days=1)
+        if not items:
+            return self._respond(web.Response(status=404, text="404 NotFound - Brak danych"))
+        return self._respond(web.json_response(items))
+
+    def _respond(self, response: web.Response) -> web.Response:
+        self.stats[str(response.status)] += 1
+        return response
+
+
+def build_server(args, today: date | None = None) -> FakeNBP:
+    today = today or date.today()
+    if args.fixtures:
+        tables, gold = load_fixtures(args.fixtures)
+    else:
+        tables = generate_tables(CURRENCY_FIRST_DATE, today)
+        gold = generate_gold(GOLD_FIRST_DATE, today)
+    return FakeNBP(
+        tables,
+        gold,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--fixtures",
+        type=str,
+        help="Directory with recorded NBP responses (*.json) instead of generated data",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Response delay in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Relative latency jitter (0..1)"
+    )
+    parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="Share of responses with 500"
+    )
+    parser.add_argument(
+        "--throttle_rate",
+        type=float,
+        default=0.0,
+        help="Share of responses with 429 Too Many Requests",
+    )
+    parser.add_argument(
+        "--retry_after", type=int, default=1, help="Retry-After value for 429, seconds"
+    )
+    parser.add_argument("--seed", type=int, help="Random seed for latency and failures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for api.nbp.pl")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = build_server(args)
+    base = f"http://{args.host}:{args.port}/api"
+    print(f"API_URL_RATES={base}/exchangerates/tables/c/{{start_date}}/{{end_date}}")
+    print(f"API_URL_GOLD={base}/cenyzlota/{{start_date}}/{{end_date}}")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
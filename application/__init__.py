@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 
 from flask import Flask
@@ -13,31 +14,68 @@ def create_app():
     app = Flask(__name__)
 
     # Конфигурация базы данных
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
     app.config["JWT_SECRET_KEY"] = "SECRET_KEY"  # Задай свой секретный ключ
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(weeks=1)
 
+    # Как часто (в секундах) снимок последних курсов сверяет номер поколения с БД
+    app.config['RATE_CACHE_CHECK_INTERVAL'] = 1.0
+
+    # Файл-уведомление загрузчика курсов (python -m apipull.main --daemon --notify_file ...).
+    # Если задан, снимок курсов обновляется сразу после загрузки новых данных,
+    # и RATE_CACHE_CHECK_INTERVAL можно заметно увеличить
+    app.config['RATES_NOTIFY_FILE'] = os.environ.get('RATES_NOTIFY_FILE')
+    app.config['RATES_NOTIFY_POLL_INTERVAL'] = 0.5
+
+    # Политика хранения истории курсов (см. currency/retention.py, DEFAULT_POLICY)
+    app.config['CURRENCY_RETENTION'] = {}
+
     jwt = JWTManager(app)
 
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    # Link и X-Next-Cursor — пагинация истории транзакций
+    CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['Link', 'X-Next-Cursor'])
 
     # Инициализация базы данных
     db.init_app(app)
 
     from user.models import User
-    from currency.models import CurrencyRate
-    from transaction.models import Transaction
+    from currency.models import CurrencyRate, CurrencyRatesVersion, LatestCurrencyRate
+    from transaction.models import LimitOrder, PriceAlert, Transaction
 
-    from user.models import Wallet
+    from user.models import LedgerEntry, LedgerState, Wallet, WalletVersion
     from user.models import UserFavoriteCurrency
 
+    # Режим хранения денежных величин записан в самой БД (flask migrate-money-storage)
+    from application.money import init_money_storage
+    init_money_storage(app)
+
     # Регистрация Blueprint
     app.register_blueprint(user_bp, url_prefix='/api/user')
     app.register_blueprint(currency_bp, url_prefix='/api/currency')
     app.register_blueprint(transaction_bp, url_prefix='/api/transactions')
 
+    # CLI-команды обслуживания (flask --app application:create_app <команда>)
+    from currency.commands import rebuild_latest_rates_command, compact_currency_rates_command
+    app.cli.add_command(rebuild_latest_rates_command)
+    app.cli.add_command(compact_currency_rates_command)
+    from application.commands import create_indexes_command, fold_ledger_command, migrate_money_storage_command
+    app.cli.add_command(migrate_money_storage_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(fold_ledger_command)
+
+    from currency.rates_watcher import init_rates_watcher
+    init_rates_watcher(app)
+
+    # Журнал балансов с групповым commit: WALLET_LEDGER=1 (см. user/ledger.py)
+    from user.ledger import init_ledger
+    init_ledger(app)
+
+    # Лимитные ордера и оповещения о курсе: фоновая проверка при PRICE_TRIGGERS=1 (см. transaction/price_triggers.py)
+    from transaction.price_triggers import init_price_triggers
+    init_price_triggers(app)
+
     return app
 
 from application.extension import db
@@ -0,0 +1,102 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+
+from application.extension import db
+from application.money import STORAGES, money_columns, read_db_storage, set_storage, write_db_storage
+from currency.rate_cache import bump_history_epoch, bump_rates_version, latest_rate_cache
+
+
+def migrate_money_storage(target):
+    """Пересчитать все столбцы FixedPoint в режим target одной транзакцией.
+
+    Возвращает {таблица: число строк}. Транзакция одна на всю миграцию:
+    БД, прерванная на середине, была бы записана в двух режимах сразу.
+    """
+    existing = set(inspect(db.engine).get_table_names())
+    columns = {}
+    for table, column, scale in money_columns():
+        if table in existing:
+            columns.setdefault(table, []).append((column, scale))
+
+    migrated = {}
+    for table, table_columns in columns.items():
+        if target == 'integer':
+            # ROUND убирает погрешность REAL (4.01229999… -> 40123)
+            assignments = [f"{column} = CAST(ROUND({column} * {10 ** scale}) AS INTEGER)"
+                           for column, scale in table_columns]
+        else:
+            assignments = [f"{column} = {column} / {10 ** scale}.0" for column, scale in table_columns]
+        result = db.session.execute(text(f"UPDATE {table} SET {', '.join(assignments)}"))
+        migrated[table] = result.rowcount
+
+    write_db_storage(target)
+    bump_rates_version()
+    # Значения курсов в истории переписаны: кэши историй перечитают их целиком
+    bump_history_epoch()
+    db.session.commit()
+    set_storage(target)
+    return migrated
+
+
+@click.command('migrate-money-storage')
+@click.option('--to', 'target', type=click.Choice(STORAGES), required=True,
+              help="Store money as Numeric ('decimal') or as scaled integers ('integer').")
+@click.option('--no-vacuum', is_flag=True, help='Skip VACUUM afterwards.')
+@with_appcontext
+def migrate_money_storage_command(target, no_vacuum):
+    """Перевести суммы и курсы в БД в другой режим хранения (приложение и загрузчик должны быть остановлены)"""
+    current = read_db_storage()
+    if current == target:
+        click.echo(f"Money is already stored as '{target}'.")
+        return
+
+    started = time.monotonic()
+    migrated = migrate_money_storage(target)
+    for table, rows in migrated.items():
+        click.echo(f"{table}: {rows} rows")
+
+    if not no_vacuum:
+        # Целые числа занимают меньше места, чем REAL, но файл уменьшится только после VACUUM
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM')
+
+    latest_rate_cache.invalidate()
+    click.echo(f"Money storage switched from '{current}' to '{target}' in {time.monotonic() - started:.2f}s. "
+               f"Restart running app and api_pull processes.")
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Создать индексы моделей, которых еще нет в существующей БД (db.create_all их не добавляет)"""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+
+    if created:
+        # Свежая статистика, чтобы планировщик SQLite сразу выбрал новые индексы
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('ANALYZE')
+            connection.commit()
+    click.echo(f"Created {len(created)} indexes{': ' + ', '.join(created) if created else '.'}")
+
+
+@click.command('fold-ledger')
+@with_appcontext
+def fold_ledger_command():
+    """Свернуть несвернутые записи журнала балансов в wallets.balance (режим WALLET_LEDGER)"""
+    from user.ledger import fold_ledger
+
+    started = time.monotonic()
+    entries = fold_ledger()
+    click.echo(f"Folded {entries} ledger entries in {time.monotonic() - started:.2f}s.")
@@ -0,0 +1,173 @@
+"""Денежные величины в виде целых чисел с фиксированной точкой (необязательный режим).
+
+По умолчанию суммы и курсы хранятся как Numeric (режим 'decimal'). В режиме
+'integer' в БД лежат целые числа единиц: суммы — в 10**-AMOUNT_SCALE,
+курсы — в 10**-RATE_SCALE. Модели в обоих режимах отдают Decimal, поэтому
+формат API не меняется. Режим записан в самой БД (таблица money_storage)
+и переключается командой flask migrate-money-storage.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import inspect
+from sqlalchemy.types import Numeric, TypeDecorator
+
+from application.extension import db
+
+# Совпадают со scale столбцов Numeric(…, 4), поэтому миграция не теряет точность
+AMOUNT_SCALE = 4
+RATE_SCALE = 4
+
+STORAGES = ('decimal', 'integer')
+MONEY_STORAGE_ROW_ID = 1
+
+_storage = 'decimal'
+
+
+def set_storage(name):
+    """Выбрать режим хранения ('decimal' или 'integer') для текущего процесса"""
+    global _storage
+    if name not in STORAGES:
+        raise ValueError(f"Unknown money storage: {name}. Available: {', '.join(STORAGES)}")
+    _storage = name
+
+
+def get_storage():
+    return _storage
+
+
+def integer_storage():
+    return _storage == 'integer'
+
+
+def to_units(value, scale=AMOUNT_SCALE, exact=False):
+    """Число (int, str, Decimal, float) -> целое число единиц 10**-scale.
+
+    exact=True — лишние знаки после запятой считаются ошибкой (данные из запроса),
+    иначе значение округляется half-up.
+    """
+    if type(value) is int:
+        return value * 10 ** scale
+    try:
+        value = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("Invalid amount format")
+    if not value.is_finite():
+        raise ValueError("Invalid amount format")
+
+    scaled = value.scaleb(scale)
+    units = scaled.to_integral_value(rounding=ROUND_HALF_UP)
+    if exact and units != scaled:
+        raise ValueError(f"Amount must have at most {scale} decimal places")
+    return int(units)
+
+
+def from_units(units, scale=AMOUNT_SCALE):
+    """Целое число единиц -> Decimal ровно со scale знаками (как у Numeric(…, scale))"""
+    return Decimal(units).scaleb(-scale)
+
+
+def units_str(units, scale=AMOUNT_SCALE):
+    """То же, что str(from_units(units, scale)), но без Decimal"""
+    whole, fraction = divmod(abs(units), 10 ** scale)
+    return f"{'-' if units < 0 else ''}{whole}.{fraction:0{scale}d}"
+
+
+def round_amount(value, scale=AMOUNT_SCALE):
+    """Decimal, округленный half-up ровно до scale знаков (как значения из столбцов Numeric(…, scale))"""
+    return from_units(to_units(value, scale), scale)
+
+
+def mul_units(amount_units, rate_units, rate_scale=RATE_SCALE):
+    """amount * rate в единицах amount с округлением half-up"""
+    divisor = 10 ** rate_scale
+    product = amount_units * rate_units
+    if product >= 0:
+        return (product + divisor // 2) // divisor
+    return -((-product + divisor // 2) // divisor)
+
+
+def parse_amount(value):
+    """Сумма из запроса -> Decimal.
+
+    В режиме 'integer' сумма должна точно представляться в единицах
+    (не больше AMOUNT_SCALE знаков после запятой).
+    """
+    if _storage == 'integer':
+        return from_units(to_units(value, AMOUNT_SCALE, exact=True), AMOUNT_SCALE)
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("Invalid amount format")
+
+
+def multiply(amount, price, price_scale=RATE_SCALE):
+    """Стоимость amount по цене price.
+
+    В режиме 'integer' — целочисленное умножение с округлением half-up до
+    AMOUNT_SCALE знаков; в режиме 'decimal' — прежнее умножение Decimal.
+    """
+    if _storage == 'integer':
+        units = mul_units(to_units(amount, AMOUNT_SCALE), to_units(price, price_scale), price_scale)
+        return from_units(units, AMOUNT_SCALE)
+    return Decimal(amount) * Decimal(price)
+
+
+class FixedPoint(TypeDecorator):
+    """Numeric(precision, scale), который в режиме 'integer' хранит целое число единиц"""
+    impl = Numeric
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or _storage != 'integer':
+            return value
+        return to_units(value, self.impl.scale)
+
+    def process_result_value(self, value, dialect):
+        if value is None or _storage != 'integer':
+            return value
+        return from_units(int(value), self.impl.scale)
+
+
+class MoneyStorage(db.Model):
+    """Режим, в котором в БД записаны денежные величины (одна строка)"""
+    __tablename__ = 'money_storage'
+
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(16), nullable=False, default='decimal')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def read_db_storage():
+    """Режим хранения, записанный в БД ('decimal', если таблицы или строки еще нет)"""
+    if not inspect(db.engine).has_table(MoneyStorage.__tablename__):
+        return 'decimal'
+    mode = db.session.query(MoneyStorage.mode).filter(MoneyStorage.id == MONEY_STORAGE_ROW_ID).scalar()
+    return mode or 'decimal'
+
+
+def write_db_storage(mode):
+    """Записать режим хранения (вызывать в той же транзакции, что и пересчет значений)"""
+    row = db.session.get(MoneyStorage, MONEY_STORAGE_ROW_ID)
+    if row is None:
+        row = MoneyStorage(id=MONEY_STORAGE_ROW_ID)
+        db.session.add(row)
+    row.mode = mode
+    row.updated_at = datetime.utcnow()
+
+
+def money_columns():
+    """Все столбцы FixedPoint: [(таблица, столбец, scale)]"""
+    return [
+        (table.name, column.name, column.type.impl.scale)
+        for table in db.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, FixedPoint)
+    ]
+
+
+def init_money_storage(app):
+    """Прочитать режим хранения из БД приложения и включить его в процессе"""
+    with app.app_context():
+        set_storage(read_db_storage())
+        db.session.remove()
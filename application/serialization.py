@@ -0,0 +1,116 @@
+"""Быстрая сериализация строк запросов в JSON без marshmallow.
+
+Используется на горячих эндпоинтах чтения. Если установлен orjson, он
+используется автоматически; иначе — стандартный json (C-энкодер).
+Формат вывода совпадает с jsonify: ключи отсортированы, Decimal -> строка.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from operator import attrgetter
+
+from flask import Response
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # orjson — необязательная зависимость
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return http_date(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps_json(obj):
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _dumps_orjson(obj):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+BACKENDS = {'json': _dumps_json}
+if orjson is not None:
+    BACKENDS['orjson'] = _dumps_orjson
+
+_backend = 'orjson' if orjson is not None else 'json'
+
+
+def set_backend(name):
+    """Выбрать реализацию JSON ('json' или 'orjson')"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}. Available: {', '.join(BACKENDS)}")
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def dumps(obj):
+    """Объект -> JSON bytes текущим бэкендом"""
+    return BACKENDS[_backend](obj)
+
+
+def json_response(body, status=200):
+    """Ответ из готовых JSON bytes (аналог jsonify без повторной сериализации)"""
+    return Response(body, status=status, mimetype='application/json')
+
+
+# Преобразователи значений: совпадают с тем, что выдавали jsonify и marshmallow
+def decimal_str(value):
+    return None if value is None else str(value)
+
+
+def iso_date(value):
+    return None if value is None else value.isoformat()
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_datetime(value):
+    """Тот же формат, что у werkzeug.http.http_date, но без email.utils (наивное время — UTC)"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        return http_date(value)
+    return (
+        f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+        f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT"
+    )
+
+
+class RowSerializer:
+    """Сериализатор строк запроса (ORM-объектов, Row или namedtuple) в список словарей/JSON.
+
+    fields — последовательность (ключ в ответе, атрибут строки, преобразователь или None).
+    """
+
+    def __init__(self, fields):
+        self.fields = [
+            (key, attrgetter(attribute), converter)
+            for key, attribute, converter in sorted(fields, key=lambda field: field[0])
+        ]
+
+    def row(self, row):
+        return {
+            key: converter(getter(row)) if converter else getter(row)
+            for key, getter, converter in self.fields
+        }
+
+    def rows(self, rows):
+        row = self.row
+        return [row(item) for item in rows]
+
+    def dumps(self, rows):
+        return dumps(self.rows(rows))
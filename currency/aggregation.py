@@ -0,0 +1,121 @@
+import numpy as np
+
+# Поддерживаемые интервалы агрегации истории курсов
+INTERVALS = ('week', 'month', 'quarter', 'year')
+
+# Минимальное число точек, с которым имеет смысл LTTB (первая, последняя и хотя бы одна между ними)
+MIN_POINTS = 3
+
+
+def to_arrays(rows):
+    """Строки (effective_date, bid, ask) -> массивы numpy (даты, bid, ask)"""
+    count = len(rows)
+    dates = np.fromiter((row[0].toordinal() for row in rows), dtype=np.int64, count=count)
+    bid = np.fromiter((row[1] for row in rows), dtype=np.float64, count=count)
+    ask = np.fromiter((row[2] for row in rows), dtype=np.float64, count=count)
+
+    # Ординалы Python -> datetime64[D] (0001-01-01 имеет ординал 1)
+    dates = (dates - 1).astype('timedelta64[D]') + np.datetime64('0001-01-01', 'D')
+    return dates, bid, ask
+
+
+def _bucket_starts(dates, interval):
+    """Дата начала периода (datetime64[D]) для каждой даты"""
+    if interval == 'week':
+        # 1970-01-01 — четверг, смещение на 3 дня дает недели с понедельника
+        days = dates.astype(np.int64)
+        return ((days + 3) // 7 * 7 - 3).astype('datetime64[D]')
+    if interval == 'month':
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    if interval == 'quarter':
+        months = dates.astype('datetime64[M]').astype(np.int64)
+        return (months // 3 * 3).astype('datetime64[M]').astype('datetime64[D]')
+    if interval == 'year':
+        return dates.astype('datetime64[Y]').astype('datetime64[D]')
+    raise ValueError(f"Unknown interval: {interval}")
+
+
+def _format(values):
+    return np.char.mod('%.4f', values).tolist()
+
+
+def _ohlc(values, starts, ends, counts):
+    return {
+        'open': _format(values[starts]),
+        'high': _format(np.maximum.reduceat(values, starts)),
+        'low': _format(np.minimum.reduceat(values, starts)),
+        'close': _format(values[ends]),
+        'mean': _format(np.add.reduceat(values, starts) / counts),
+    }
+
+
+def aggregate_ohlc(code, dates, bid, ask, interval):
+    """OHLC-агрегаты bid/ask по периодам. Даты должны быть отсортированы по возрастанию."""
+    if len(dates) == 0:
+        return []
+
+    periods = _bucket_starts(dates, interval)
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    ends = np.r_[starts[1:], len(dates)] - 1
+    counts = ends - starts + 1
+
+    bid_ohlc = _ohlc(bid, starts, ends, counts)
+    ask_ohlc = _ohlc(ask, starts, ends, counts)
+    period_start = np.datetime_as_string(periods[starts]).tolist()
+    first_date = np.datetime_as_string(dates[starts]).tolist()
+    last_date = np.datetime_as_string(dates[ends]).tolist()
+
+    return [
+        {
+            'code': code,
+            'period_start': period_start[i],
+            'first_date': first_date[i],
+            'last_date': last_date[i],
+            'count': int(counts[i]),
+            'bid': {key: values[i] for key, values in bid_ohlc.items()},
+            'ask': {key: values[i] for key, values in ask_ohlc.items()},
+        }
+        for i in range(len(starts))
+    ]
+
+
+def lttb_indices(x, y, threshold):
+    """Индексы точек, отобранных алгоритмом Largest-Triangle-Three-Buckets"""
+    length = len(x)
+    if threshold >= length or threshold < MIN_POINTS:
+        return np.arange(length)
+
+    # Первая и последняя точки сохраняются, остальные делятся на threshold - 2 корзины
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Вершина C — среднее следующей корзины (для последней — последняя точка)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        # Площадь треугольника (A, B, C) для всех кандидатов B текущей корзины сразу
+        area = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample(dates, bid, ask, max_points):
+    """Индексы не более чем max_points строк, сохраняющих форму графика среднего курса"""
+    x = dates.astype(np.int64).astype(np.float64)
+    mid = (bid + ask) / 2
+    return lttb_indices(x, mid, max_points)
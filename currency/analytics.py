@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from application.extension import db
+from currency.aggregation import to_arrays
+from currency.models import CurrencyRate
+from currency.rate_cache import latest_rate_cache, read_history_epoch
+
+# Поддерживаемые метрики скользящего окна
+METRICS = ('sma', 'volatility', 'min', 'max', 'change')
+
+# По какой цене считать статистику
+PRICES = ('bid', 'ask', 'mid')
+
+MAX_WINDOW = 1000
+
+
+class RateHistoryCache:
+    """История курсов по валютам в виде массивов numpy, дополняемая инкрементально.
+
+    При первом обращении история валюты загружается целиком, а после каждой
+    новой загрузки курсов (смены поколения) дочитываются только строки
+    с effective_date позже последней известной даты. Если загрузчик исправил
+    или дозагрузил задним числом старые строки (сменилась эпоха истории),
+    история перечитывается целиком. В кэше хранятся не более max_codes валют,
+    давно не запрошенные вытесняются первыми.
+    """
+
+    def __init__(self, max_codes=256):
+        self._lock = threading.Lock()
+        self.max_codes = max_codes
+        # code -> (поколение, эпоха истории, даты, bid, ask), порядок — от давно запрошенных к недавним
+        self._series = OrderedDict()
+        self.full_loads = 0
+        self.incremental_loads = 0
+
+    def get(self, currency_code):
+        generation = latest_rate_cache.generation
+        with self._lock:
+            cached = self._series.get(currency_code)
+            if cached is not None and cached[0] == generation:
+                self._series.move_to_end(currency_code)
+                return cached[2:]
+
+            # Коды, которых нет среди последних курсов, не кэшируем: иначе
+            # произвольные запросы заполнили бы кэш пустыми историями
+            if latest_rate_cache.get(currency_code) is None:
+                return to_arrays([])
+
+            epoch = read_history_epoch()
+            if cached is None or cached[1] != epoch:
+                series = self._load(currency_code)
+                self.full_loads += 1
+            else:
+                series = self._extend(currency_code, *cached[2:])
+                self.incremental_loads += 1
+
+            self._series[currency_code] = (generation, epoch, *series)
+            self._series.move_to_end(currency_code)
+            while len(self._series) > self.max_codes:
+                self._series.popitem(last=False)
+            return series
+
+    def clear(self):
+        """Сбросить кэш текущего процесса"""
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def _query(currency_code, after=None):
+        query = db.session.query(
+            CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+        ).filter(
+            CurrencyRate.code == currency_code,
+            CurrencyRate.bid.isnot(None),
+            CurrencyRate.ask.isnot(None),
+        )
+        if after is not None:
+            query = query.filter(CurrencyRate.effective_date > after)
+        return to_arrays(query.order_by(CurrencyRate.effective_date.asc()).all())
+
+    def _load(self, currency_code):
+        return self._query(currency_code)
+
+    def _extend(self, currency_code, dates, bid, ask):
+        if len(dates) == 0:
+            return self._query(currency_code)
+
+        last_date = dates[-1].astype(object)
+        new_dates, new_bid, new_ask = self._query(currency_code, after=last_date)
+        if len(new_dates) == 0:
+            return dates, bid, ask
+        return (
+            np.concatenate([dates, new_dates]),
+            np.concatenate([bid, new_bid]),
+            np.concatenate([ask, new_ask]),
+        )
+
+
+rate_history_cache = RateHistoryCache()
+
+
+def _rolling_sum(values, window):
+    """Сумма по скользящему окну через накопленную сумму: O(n) независимо от окна"""
+    cumsum = np.cumsum(np.r_[0.0, values])
+    return cumsum[window:] - cumsum[:-window]
+
+
+def _pad(values, length):
+    """Дополнить результат скользящего окна NaN слева до исходной длины"""
+    return np.r_[np.full(length - len(values), np.nan), values]
+
+
+def rolling_statistics(dates, prices, window, metrics, start_date=None, end_date=None):
+    """Скользящие статистики для дат из [start_date, end_date].
+
+    Для расчета берется только хвост истории: точки диапазона плюс window
+    предыдущих точек, поэтому стоимость не зависит от длины всей истории.
+    """
+    lo = 0 if start_date is None else int(np.searchsorted(dates, np.datetime64(start_date, 'D'), side='left'))
+    hi = len(dates) if end_date is None else int(np.searchsorted(dates, np.datetime64(end_date, 'D'), side='right'))
+
+    offset = max(lo - window, 0)
+    values = prices[offset:hi]
+    length = len(values)
+    skip = lo - offset
+
+    result = {
+        'dates': np.datetime_as_string(dates[lo:hi]).tolist(),
+        'value': values[skip:],
+    }
+
+    if 'sma' in metrics:
+        sma = _rolling_sum(values, window) / window if length >= window else np.array([])
+        result['sma'] = _pad(sma, length)[skip:]
+
+    if 'volatility' in metrics:
+        # Стандартное отклонение дневных логарифмических доходностей в окне
+        returns = np.diff(np.log(values)) if length > 1 else np.array([])
+        if len(returns) >= window:
+            mean = _rolling_sum(returns, window) / window
+            mean_sq = _rolling_sum(returns ** 2, window) / window
+            volatility = np.sqrt(np.maximum(mean_sq - mean ** 2, 0.0))
+        else:
+            volatility = np.array([])
+        result['volatility'] = _pad(volatility, length)[skip:]
+
+    if 'min' in metrics or 'max' in metrics:
+        windows = sliding_window_view(values, window) if length >= window else np.empty((0, window))
+        if 'min' in metrics:
+            result['min'] = _pad(windows.min(axis=1), length)[skip:]
+        if 'max' in metrics:
+            result['max'] = _pad(windows.max(axis=1), length)[skip:]
+
+    if 'change' in metrics:
+        change = np.diff(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_pct = change / values[:-1] * 100
+        result['change'] = _pad(change, length)[skip:]
+        result['change_pct'] = _pad(change_pct, length)[skip:]
+
+    return {
+        key: values if key == 'dates' else _to_list(values)
+        for key, values in result.items()
+    }
+
+
+def _to_list(values):
+    """Массив -> список чисел для JSON (NaN -> None)"""
+    rounded = np.round(values, 6)
+    return [None if np.isnan(value) else value for value in rounded.tolist()]
@@ -0,0 +1,51 @@
+import click
+from flask.cli import with_appcontext
+
+from application.extension import db
+from currency.currency_service import rebuild_latest_currency_rates
+from currency.rate_cache import bump_rates_version, latest_rate_cache
+from currency.retention import SAMPLES, RetentionPolicy, run_retention
+
+
+@click.command('rebuild-latest-rates')
+@with_appcontext
+def rebuild_latest_rates_command():
+    """Пересобрать таблицу latest_currency_rates из истории курсов"""
+    count = rebuild_latest_currency_rates()
+    bump_rates_version()
+    db.session.commit()
+    latest_rate_cache.invalidate()
+    click.echo(f"Rebuilt latest_currency_rates: {count} codes.")
+
+
+@click.command('compact-currency-rates')
+@click.option('--keep-daily-days', type=int, help='Keep every daily rate for this many days; older rates are thinned per --sample (default: keep all).')
+@click.option('--sample', type=click.Choice(SAMPLES), help="What to keep beyond that: last day of each week/month, or nothing (default: 'none').")
+@click.option('--drop-delisted-after-days', type=int, help='Drop codes with no new rate for this many days.')
+@click.option('--batch-size', type=int, help='Rows deleted per short transaction.')
+@click.option('--no-vacuum', is_flag=True, help='Skip VACUUM/ANALYZE afterwards.')
+@with_appcontext
+def compact_currency_rates_command(keep_daily_days, sample, drop_delisted_after_days, batch_size, no_vacuum):
+    """Прорядить историю курсов по политике хранения"""
+    overrides = {
+        'keep_daily_days': keep_daily_days,
+        'sample': sample,
+        'drop_delisted_after_days': drop_delisted_after_days,
+        'batch_size': batch_size,
+    }
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    if no_vacuum:
+        overrides['vacuum'] = False
+
+    try:
+        policy = RetentionPolicy.from_config(overrides)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    summary = run_retention(policy, progress=click.echo)
+    latest_rate_cache.invalidate()
+    click.echo(
+        f"Deleted {summary['deleted']} rows "
+        f"({summary['deleted_sampled']} sampled out, {summary['deleted_delisted']} delisted) "
+        f"in {summary['elapsed_seconds']}s."
+    )
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import func
+
+from application.extension import db
+from currency.models import CurrencyRate
+from currency.rate_cache import latest_rate_cache
+
+# Базовая валюта, в которой котируются все курсы currency_rates
+BASE_CURRENCY = 'PLN'
+
+# Не валюты: цена золота (api_pull GOLD_CODE) в кросс-курсы не входит
+NON_CURRENCY_CODES = ('GOLD_gold',)
+
+# Сколько матриц (по разным датам) держать в памяти
+CROSS_RATE_CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class CrossRateMatrix:
+    """Матрица кросс-курсов N×N: bid[i][j] / ask[i][j] — сколько единиц j за 1 единицу i"""
+
+    def __init__(self, codes, effective_dates, bid, ask):
+        self.codes = codes
+        self.effective_dates = effective_dates
+        self.bid = bid
+        self.ask = ask
+        self.index = {code: i for i, code in enumerate(codes)}
+
+    @classmethod
+    def from_pln_rates(cls, rates):
+        """Построить матрицу из курсов к PLN: [(code, effective_date, bid, ask), ...]"""
+        rates = [rate for rate in rates
+                 if rate[2] is not None and rate[3] is not None and rate[0] not in NON_CURRENCY_CODES]
+        codes = [BASE_CURRENCY] + [rate[0] for rate in rates]
+        effective_dates = {rate[0]: rate[1].isoformat() for rate in rates}
+
+        bid = np.fromiter((rate[2] for rate in rates), dtype=np.float64, count=len(rates))
+        ask = np.fromiter((rate[3] for rate in rates), dtype=np.float64, count=len(rates))
+        bid = np.r_[1.0, bid]
+        ask = np.r_[1.0, ask]
+
+        # Продаем i за PLN по bid_i и покупаем j за PLN по ask_j (и наоборот) —
+        # вся матрица считается одним внешним делением
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_bid = np.divide.outer(bid, ask)
+            cross_ask = np.divide.outer(ask, bid)
+        # Нулевой или отрицательный курс дал бы inf/nan (невалидный JSON): такие пары отдаются как null
+        valid = (bid > 0) & (ask > 0)
+        invalid = ~np.logical_and.outer(valid, valid)
+        cross_bid[invalid] = np.nan
+        cross_ask[invalid] = np.nan
+        np.fill_diagonal(cross_bid, 1.0)
+        np.fill_diagonal(cross_ask, 1.0)
+
+        return cls(codes, effective_dates, cross_bid, cross_ask)
+
+    def to_dict(self, codes=None):
+        """Вся матрица или ее подмножество по списку кодов"""
+        if codes:
+            selected = [self.index[code] for code in codes]
+            bid = self.bid[np.ix_(selected, selected)]
+            ask = self.ask[np.ix_(selected, selected)]
+        else:
+            codes = self.codes
+            bid, ask = self.bid, self.ask
+
+        return {
+            'base': BASE_CURRENCY,
+            'codes': codes,
+            'effective_dates': {code: self.effective_dates.get(code) for code in codes if code != BASE_CURRENCY},
+            'bid': _nullable(bid),
+            'ask': _nullable(ask),
+        }
+
+
+def _nullable(matrix):
+    # nan -> None: jsonify записал бы NaN, которого нет в JSON
+    return np.where(np.isnan(matrix), None, np.round(matrix, 6)).tolist()
+
+
+def _rates_as_of(as_of_date):
+    """Последний курс каждой валюты на дату as_of_date (включительно)"""
+    subquery = db.session.query(
+        CurrencyRate.code,
+        func.max(CurrencyRate.effective_date).label('max_date')
+    ).filter(CurrencyRate.effective_date <= as_of_date) \
+        .group_by(CurrencyRate.code) \
+        .subquery()
+
+    return db.session.query(
+        CurrencyRate.code, CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+    ).join(
+        subquery,
+        (CurrencyRate.code == subquery.c.code) &
+        (CurrencyRate.effective_date == subquery.c.max_date)
+    ).order_by(CurrencyRate.code).all()
+
+
+def get_cross_rate_matrix(as_of_date=None):
+    """Матрица кросс-курсов на дату (или по последним курсам), кэшируется по дате и поколению курсов"""
+    generation, latest = latest_rate_cache.snapshot()
+    key = (as_of_date, generation)
+
+    with _cache_lock:
+        matrix = _cache.get(key)
+        if matrix is not None:
+            _cache.move_to_end(key)
+            return matrix
+
+    if as_of_date is None:
+        rates = [latest[code] for code in sorted(latest)]
+    else:
+        rates = _rates_as_of(as_of_date)
+    matrix = CrossRateMatrix.from_pln_rates(rates)
+
+    with _cache_lock:
+        _cache[key] = matrix
+        while len(_cache) > CROSS_RATE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return matrix
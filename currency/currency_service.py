@@ -1,30 +1,71 @@
-from sqlalchemy import func
+from sqlalchemy import func, insert
 from application.extension import db
-from currency.models import CurrencyRate
+from currency.models import CurrencyRate, LatestCurrencyRate
 from marshmallow import ValidationError
 from flask import jsonify
 
+from currency.rate_cache import latest_rate_cache, RateSnapshot
 from currency.schemas import CurrencySchema
 
 
 def get_latest_currency_by_code(currency_code):
-    """Получить курс валюты по коду с самой свежей датой, используя подзапрос"""
+    """Получить курс валюты по коду с самой свежей датой из снимка последних курсов"""
 
-    # Создаем подзапрос для получения самой свежей даты для данной валюты
-    subquery = db.session.query(
-        CurrencyRate.code,
-        func.max(CurrencyRate.effective_date).label('max_date')
-    ).filter(CurrencyRate.code == currency_code) \
-        .group_by(CurrencyRate.code) \
-        .subquery()
+    latest_currency = latest_rate_cache.get(currency_code)
 
-    # Получаем валюту с самой свежей датой
-    latest_currency = db.session.query(CurrencyRate) \
-        .join(subquery, (CurrencyRate.code == subquery.c.code) & (CurrencyRate.effective_date == subquery.c.max_date)) \
-        .first()  # Получаем только один самый последний результат
+    if not latest_currency:
+        # Курс мог появиться между проверками поколения — ищем по первичному ключу
+        row = db.session.get(LatestCurrencyRate, currency_code)
+        if row:
+            latest_currency = RateSnapshot(row.code, row.effective_date, row.bid, row.ask)
 
     if not latest_currency:
         raise ValidationError(f"Валюта с кодом {currency_code} не найдена.")
 
     # Возвращаем результат
-    return latest_currency
\ No newline at end of file
+    return latest_currency
+
+
+def get_latest_currencies_by_codes(currency_codes):
+    """Последние курсы сразу для нескольких кодов: {code: RateSnapshot}.
+
+    Неизвестные коды в результат не попадают. Коды, которых нет в снимке,
+    дочитываются одним запросом.
+    """
+    rates = latest_rate_cache.all()
+    found = {code: rates[code] for code in currency_codes if code in rates}
+
+    missing = [code for code in currency_codes if code not in found]
+    if missing:
+        rows = db.session.query(
+            LatestCurrencyRate.code,
+            LatestCurrencyRate.effective_date,
+            LatestCurrencyRate.bid,
+            LatestCurrencyRate.ask
+        ).filter(LatestCurrencyRate.code.in_(missing)).all()
+        found.update((row.code, RateSnapshot(*row)) for row in rows)
+
+    return found
+
+
+def rebuild_latest_currency_rates():
+    """Пересобрать таблицу latest_currency_rates из истории currency_rates (без commit)"""
+
+    subquery = db.session.query(
+        CurrencyRate.code,
+        func.max(CurrencyRate.effective_date).label('max_date')
+    ).group_by(CurrencyRate.code).subquery()
+
+    latest_rows = db.select(
+        CurrencyRate.code, CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+    ).join(
+        subquery,
+        (CurrencyRate.code == subquery.c.code) &
+        (CurrencyRate.effective_date == subquery.c.max_date)
+    )
+
+    db.session.query(LatestCurrencyRate).delete(synchronize_session=False)
+    result = db.session.execute(
+        insert(LatestCurrencyRate).from_select(['code', 'effective_date', 'bid', 'ask'], latest_rows)
+    )
+    return result.rowcount
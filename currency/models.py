@@ -1,4 +1,7 @@
+from datetime import datetime
+
 from application.extension import db
+from application.money import FixedPoint
 
 class CurrencyRate(db.Model):
     """Store currency exchange rates"""
@@ -6,8 +9,25 @@ class CurrencyRate(db.Model):
 
     code = db.Column(db.String(9), primary_key=True)  # ISO 4217 код (USD, EUR)
     effective_date = db.Column(db.Date, primary_key=True)
-    bid = db.Column(db.Numeric(precision=20, scale=4))
-    ask = db.Column(db.Numeric(precision=20, scale=4))
+    bid = db.Column(FixedPoint(precision=20, scale=4))
+    ask = db.Column(FixedPoint(precision=20, scale=4))
 
     # Relationship for favorite currencies
-    favored_by = db.relationship('UserFavoriteCurrency', back_populates='currency')
\ No newline at end of file
+    favored_by = db.relationship('UserFavoriteCurrency', back_populates='currency')
+
+class LatestCurrencyRate(db.Model):
+    """Последний курс по каждой валюте (одна строка на код), поддерживается при загрузке курсов"""
+    __tablename__ = "latest_currency_rates"
+
+    code = db.Column(db.String(9), primary_key=True)
+    effective_date = db.Column(db.Date, nullable=False)
+    bid = db.Column(FixedPoint(precision=20, scale=4))
+    ask = db.Column(FixedPoint(precision=20, scale=4))
+
+class CurrencyRatesVersion(db.Model):
+    """Номер поколения курсов: увеличивается при каждой записи новых курсов"""
+    __tablename__ = "currency_rates_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+
+from application.extension import db
+from currency.models import CurrencyRatesVersion, LatestCurrencyRate
+
+# Неизменяемая запись снимка: те же атрибуты, что и у CurrencyRate
+RateSnapshot = namedtuple("RateSnapshot", ["code", "effective_date", "bid", "ask"])
+
+RATES_VERSION_ROW_ID = 1
+# Эпоха истории: меняется, когда уже загруженные строки currency_rates исправлены,
+# удалены или дозагружены задним числом, и дочитывать историю только с конца нельзя
+HISTORY_EPOCH_ROW_ID = 2
+
+
+def _read_version(row_id):
+    version = db.session.query(CurrencyRatesVersion.version) \
+        .filter(CurrencyRatesVersion.id == row_id) \
+        .scalar()
+    return version or 0
+
+
+def _bump_version(row_id):
+    row = db.session.get(CurrencyRatesVersion, row_id)
+    if row is None:
+        row = CurrencyRatesVersion(id=row_id, version=0)
+        db.session.add(row)
+    row.version = (row.version or 0) + 1
+    row.updated_at = datetime.utcnow()
+    return row.version
+
+
+def read_rates_version():
+    """Текущий номер поколения курсов из БД (0, если курсы еще не записывались)"""
+    return _read_version(RATES_VERSION_ROW_ID)
+
+
+def bump_rates_version():
+    """Увеличить номер поколения курсов (вызывать в той же транзакции, что и запись курсов)"""
+    return _bump_version(RATES_VERSION_ROW_ID)
+
+
+def read_history_epoch():
+    """Текущая эпоха истории курсов (0, если история не переписывалась)"""
+    return _read_version(HISTORY_EPOCH_ROW_ID)
+
+
+def bump_history_epoch():
+    """Увеличить эпоху истории (вместе с bump_rates_version, в той же транзакции)"""
+    return _bump_version(HISTORY_EPOCH_ROW_ID)
+
+
+class LatestRateCache:
+    """Снимок последних курсов (bid/ask) по каждому коду валюты в памяти процесса.
+
+    Снимок перечитывается только тогда, когда меняется номер поколения
+    в таблице currency_rates_version. Сам номер проверяется не чаще,
+    чем раз в RATE_CACHE_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (поколение, {code: RateSnapshot}) — заменяется целиком одним присваиванием
+        self._snapshot = (None, {})
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.version_checks = 0
+
+    @property
+    def generation(self):
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """Согласованная пара (поколение, {code: RateSnapshot})"""
+        self._ensure_fresh()
+        return self._snapshot
+
+    def get(self, currency_code):
+        """Последний курс по коду или None, если такой валюты нет"""
+        return self.snapshot()[1].get(currency_code)
+
+    def all(self):
+        """Все последние курсы: {code: RateSnapshot}"""
+        return self.snapshot()[1]
+
+    def invalidate(self):
+        """Принудительно проверить поколение при следующем обращении"""
+        self._checked_at = 0.0
+
+    def stats(self):
+        return {
+            "generation": self._snapshot[0],
+            "size": len(self._snapshot[1]),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "version_checks": self.version_checks,
+        }
+
+    def _ensure_fresh(self):
+        interval = current_app.config.get("RATE_CACHE_CHECK_INTERVAL", 1.0)
+        if self._snapshot[0] is not None and time.monotonic() - self._checked_at < interval:
+            self.hits += 1
+            return
+
+        with self._lock:
+            # Другой поток мог уже обновить снимок, пока мы ждали блокировку
+            if self._snapshot[0] is not None and time.monotonic() - self._checked_at < interval:
+                self.hits += 1
+                return
+
+            self.version_checks += 1
+            version = read_rates_version()
+            if version == self._snapshot[0]:
+                self._checked_at = time.monotonic()
+                self.hits += 1
+                return
+
+            self.misses += 1
+            self._snapshot = (version, self._load())
+            self._checked_at = time.monotonic()
+            self.reloads += 1
+
+    @staticmethod
+    def _load():
+        # Таблица latest_currency_rates содержит одну строку на код, поэтому
+        # стоимость перезагрузки не зависит от длины истории курсов
+        rows = db.session.query(
+            LatestCurrencyRate.code,
+            LatestCurrencyRate.effective_date,
+            LatestCurrencyRate.bid,
+            LatestCurrencyRate.ask
+        ).all()
+
+        return {row.code: RateSnapshot(*row) for row in rows}
+
+
+latest_rate_cache = LatestRateCache()
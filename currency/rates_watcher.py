@@ -0,0 +1,67 @@
+import os
+import threading
+
+from currency.rate_cache import latest_rate_cache
+
+
+class RatesUpdateWatcher(threading.Thread):
+    """Фоновый поток: следит за файлом-уведомлением загрузчика курсов (api_pull --notify_file).
+
+    Загрузчик атомарно перезаписывает файл после каждой записи новых курсов.
+    Поток замечает это по os.stat и сразу обновляет снимок последних курсов,
+    не дожидаясь RATE_CACHE_CHECK_INTERVAL.
+    """
+
+    def __init__(self, app, path, interval):
+        super().__init__(name='rates-update-watcher', daemon=True)
+        self.app = app
+        self.path = path
+        self.interval = interval
+        self.notifications = 0
+        self._stop_event = threading.Event()
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            self.notifications += 1
+            self.refresh()
+
+    def refresh(self):
+        latest_rate_cache.invalidate()
+        try:
+            with self.app.app_context():
+                latest_rate_cache.snapshot()
+        except Exception:
+            # Не страшно: снимок перечитается при следующем запросе
+            self.app.logger.exception("Failed to refresh latest rates after notification")
+            return
+
+        # Новые курсы могли задеть лимитные ордера и оповещения — проверяем их сразу
+        trigger_watcher = self.app.extensions.get('price_trigger_watcher')
+        if trigger_watcher is not None:
+            trigger_watcher.wake()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def init_rates_watcher(app):
+    """Запустить наблюдение за RATES_NOTIFY_FILE, если он задан в конфигурации"""
+    path = app.config.get('RATES_NOTIFY_FILE')
+    if not path:
+        return None
+    watcher = RatesUpdateWatcher(app, path, app.config.get('RATES_NOTIFY_POLL_INTERVAL', 0.5))
+    watcher.start()
+    app.extensions['rates_watcher'] = watcher
+    return watcher
@@ -0,0 +1,171 @@
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from application.extension import db
+from currency.models import CurrencyRate, LatestCurrencyRate
+from currency.rate_cache import bump_history_epoch, bump_rates_version
+
+# Как прореживать историю старше keep_daily_days
+SAMPLES = ('weekly', 'monthly', 'none')
+
+# Ограничение числа параметров в одном DELETE ... IN (...) для SQLite
+MAX_BATCH_SIZE = 900
+
+# По умолчанию ничего не удаляется: прореживание включается явно через
+# app.config['CURRENCY_RETENTION'] или параметры compact-currency-rates
+DEFAULT_POLICY = {
+    'keep_daily_days': None,  # Сколько дней хранить все ежедневные курсы (None — хранить все)
+    'sample': 'none',  # Что хранить старше: последний день недели/месяца или ничего
+    'drop_delisted_after_days': None,  # Удалять валюты без новых курсов дольше N дней (None — не удалять)
+    'batch_size': 500,  # Сколько строк удалять в одной короткой транзакции
+    'vacuum': True,  # Выполнить VACUUM/ANALYZE после удаления
+}
+
+
+class RetentionPolicy:
+    """Политика хранения истории курсов"""
+
+    def __init__(self, keep_daily_days, sample, drop_delisted_after_days, batch_size, vacuum):
+        if keep_daily_days is not None and keep_daily_days < 0:
+            raise ValueError("keep_daily_days must be non-negative")
+        if sample not in SAMPLES:
+            raise ValueError(f"sample must be one of: {', '.join(SAMPLES)}")
+        if drop_delisted_after_days is not None and drop_delisted_after_days < 0:
+            raise ValueError("drop_delisted_after_days must be non-negative")
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+
+        self.keep_daily_days = keep_daily_days
+        self.sample = sample
+        self.drop_delisted_after_days = drop_delisted_after_days
+        self.batch_size = batch_size
+        self.vacuum = vacuum
+
+    @classmethod
+    def from_config(cls, overrides=None):
+        """Политика из app.config['CURRENCY_RETENTION'] с необязательными переопределениями (только для CLI)"""
+        options = dict(DEFAULT_POLICY)
+        options.update(current_app.config.get('CURRENCY_RETENTION') or {})
+        options.update({key: value for key, value in (overrides or {}).items() if key in DEFAULT_POLICY})
+        return cls(**options)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in DEFAULT_POLICY}
+
+
+def _period_key(effective_date, sample):
+    if sample == 'weekly':
+        return effective_date.isocalendar()[:2]
+    return effective_date.year, effective_date.month
+
+
+def _delete_in_batches(code, dates, batch_size, report):
+    """Удалить строки валюты по списку дат короткими транзакциями"""
+    deleted = 0
+    for start in range(0, len(dates), batch_size):
+        chunk = dates[start:start + batch_size]
+        result = db.session.execute(
+            CurrencyRate.__table__.delete().where(
+                CurrencyRate.code == code,
+                CurrencyRate.effective_date.in_(chunk)
+            )
+        )
+        db.session.commit()
+        deleted += result.rowcount
+        report(code, deleted, len(dates))
+    return deleted
+
+
+def run_retention(policy, today=None, progress=None):
+    """Применить политику хранения к currency_rates.
+
+    Удаление идет пачками по batch_size строк с commit после каждой пачки,
+    поэтому запись курсов другими процессами блокируется лишь на короткое время.
+    progress(сообщение) вызывается после каждой пачки.
+    """
+    started = time.monotonic()
+    today = today or datetime.utcnow().date()
+    summary = {
+        'policy': policy.to_dict(), 'delisted_codes': [], 'emptied_codes': [], 'deleted_delisted': 0, 'deleted_sampled': 0
+    }
+
+    # Становится True после первой закоммиченной пачки удаления
+    changed = False
+
+    def report(code, done, total):
+        nonlocal changed
+        changed = True
+        message = f"{code}: deleted {done}/{total}"
+        current_app.logger.info(f"Retention: {message}")
+        if progress:
+            progress(message)
+
+    try:
+        # 1. Валюты, по которым давно нет новых курсов, удаляем целиком
+        if policy.drop_delisted_after_days is not None:
+            cutoff = today - timedelta(days=policy.drop_delisted_after_days)
+            delisted = [
+                code for (code,) in db.session.query(LatestCurrencyRate.code)
+                .filter(LatestCurrencyRate.effective_date < cutoff)
+                .order_by(LatestCurrencyRate.code)
+            ]
+            for code in delisted:
+                dates = [d for (d,) in db.session.query(CurrencyRate.effective_date).filter(CurrencyRate.code == code)]
+                summary['deleted_delisted'] += _delete_in_batches(code, dates, policy.batch_size, report)
+                LatestCurrencyRate.query.filter_by(code=code).delete(synchronize_session=False)
+                db.session.commit()
+            summary['delisted_codes'] = delisted
+
+        # 2. Историю старше keep_daily_days прореживаем до одной точки на неделю/месяц
+        if policy.keep_daily_days is not None:
+            daily_cutoff = today - timedelta(days=policy.keep_daily_days)
+            codes = [code for (code,) in db.session.query(CurrencyRate.code).distinct().order_by(CurrencyRate.code)]
+            for code in codes:
+                dates = [
+                    d for (d,) in db.session.query(CurrencyRate.effective_date)
+                    .filter(CurrencyRate.code == code, CurrencyRate.effective_date < daily_cutoff)
+                    .order_by(CurrencyRate.effective_date)
+                ]
+                if policy.sample == 'none':
+                    to_delete = dates
+                else:
+                    # В каждом периоде оставляем последний день с курсом
+                    keep = {}
+                    for effective_date in dates:
+                        keep[_period_key(effective_date, policy.sample)] = effective_date
+                    kept = set(keep.values())
+                    to_delete = [d for d in dates if d not in kept]
+
+                if to_delete:
+                    summary['deleted_sampled'] += _delete_in_batches(code, to_delete, policy.batch_size, report)
+                    # sample='none' может удалить всю историю валюты без свежих курсов:
+                    # тогда, как и для delisted, убираем ее последний курс
+                    if db.session.query(CurrencyRate.code).filter(CurrencyRate.code == code).first() is None:
+                        LatestCurrencyRate.query.filter_by(code=code).delete(synchronize_session=False)
+                        db.session.commit()
+                        summary['emptied_codes'].append(code)
+    finally:
+        if changed:
+            # Пачки коммитятся по одной, поэтому сообщаем об удалении и при ошибке в середине.
+            # Эпоха истории заставит кэши историй всех процессов перечитать ее целиком
+            db.session.rollback()
+            bump_rates_version()
+            bump_history_epoch()
+            db.session.commit()
+
+    deleted = summary['deleted_delisted'] + summary['deleted_sampled']
+
+    # 3. VACUUM возвращает место на диске, ANALYZE обновляет статистику планировщика
+    if policy.vacuum and deleted:
+        if progress:
+            progress("Running VACUUM/ANALYZE")
+        with db.engine.connect() as connection:
+            connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            connection.exec_driver_sql('VACUUM')
+            connection.exec_driver_sql('ANALYZE')
+
+    summary['deleted'] = deleted
+    summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    return summary
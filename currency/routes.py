@@ -1,106 +1,340 @@
+import csv
+import hashlib
+import io
+import json
 from datetime import datetime, timedelta
 
-from flask import jsonify, Blueprint, request
-from sqlalchemy import func
-from sqlalchemy.orm import aliased
+from flask import jsonify, Blueprint, current_app, request, Response, stream_with_context
 from werkzeug.exceptions import BadRequest
 
+from currency.aggregation import INTERVALS, MIN_POINTS, aggregate_ohlc, downsample, to_arrays
+from currency.analytics import MAX_WINDOW, METRICS, PRICES, rate_history_cache, rolling_statistics
+from currency.cross_rates import get_cross_rate_matrix
 from currency.models import CurrencyRate
+from currency.rate_cache import latest_rate_cache
+from currency.retention import RetentionPolicy, run_retention
 from application import db
+from application.serialization import dumps, json_response
 from marshmallow import ValidationError
 
-from currency.schemas import CurrencySchema
+from currency.schemas import CurrencySchema, currency_rate_serializer
 
 currency_bp = Blueprint('currency', __name__)
 user_schema = CurrencySchema()  # Создаем экземпляр схемы
 
+# Готовое JSON-тело ответа /currency-rates для текущего поколения курсов
+_latest_rates_response = None
+
+
+def _render_latest_rates():
+    """Тело и ETag ответа /currency-rates; сериализация выполняется один раз на поколение"""
+    global _latest_rates_response
+
+    generation, rates = latest_rate_cache.snapshot()
+    cached = _latest_rates_response
+    if cached is not None and cached['generation'] == generation:
+        return cached
+
+    # Сериализуем данные в словарь с кодами валют в качестве ключей
+    result_dict = {code: currency_rate_serializer.row(rate) for code, rate in rates.items()}
+    body = dumps(result_dict)
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    cached = {'generation': generation, 'body': body, 'etag': f'{generation}-{digest}'}
+    _latest_rates_response = cached
+    return cached
+
+
 @currency_bp.route('/currency-rates', methods=['GET'])
 def get_all_currency_rates():
-    # Создаем алиас для валютных курсов, чтобы получить последние значения для каждой валюты
-    subquery = db.session.query(
-        CurrencyRate.code,
-        func.max(CurrencyRate.effective_date).label('max_date')
-    ).group_by(CurrencyRate.code).subquery()
-
-    # Основной запрос для получения данных с последними датами для каждой валюты
-    latest_rates = db.session.query(CurrencyRate).join(
-        subquery,
-        (CurrencyRate.code == subquery.c.code) &
-        (CurrencyRate.effective_date == subquery.c.max_date)
-    ).all()
+    # Последние курсы по каждой валюте берем из готового снимка в памяти
+    rendered = _render_latest_rates()
 
-    # Сериализуем данные
-    schema = CurrencySchema(many=True)
-    result = schema.dump(latest_rates)
+    if request.if_none_match.contains(rendered['etag']):
+        response = Response(status=304)
+    else:
+        response = Response(rendered['body'], status=200, mimetype='application/json')
+
+    response.set_etag(rendered['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-    # Преобразуем список в словарь с кодами валют в качестве ключей
-    result_dict = {rate['code']: rate for rate in result}
 
-    return jsonify(result_dict), 200
+@currency_bp.route('/cache-stats', methods=['GET'])
+def get_rate_cache_stats():
+    """Счетчики попаданий/промахов снимка последних курсов"""
+    stats = latest_rate_cache.stats()
+    watcher = current_app.extensions.get('rates_watcher')
+    stats['notifications'] = watcher.notifications if watcher else None
+    return jsonify(stats), 200
 
 
 @currency_bp.route('/delete-old-currency-rates', methods=['DELETE'])
 def delete_old_currency_rates():
-    target_date = datetime(2025, 2, 4)
+    """Очистка истории курсов по политике хранения (app.config['CURRENCY_RETENTION'])"""
+    # Политика задается только конфигурацией приложения, тело запроса не читается
     try:
-        # Создаем алиас для модели CurrencyRate
-        CurrencyRateAlias = aliased(CurrencyRate)
-
-        # Подзапрос для проверки существования записи с target_date для каждого code
-        subquery = db.session.query(CurrencyRateAlias.code).filter(
-            CurrencyRateAlias.code == CurrencyRate.code,
-            CurrencyRateAlias.effective_date == target_date
-        )
-
-        # Удаляем все записи, где нет соответствующей записи с target_date
-        deleted_count = CurrencyRate.query.filter(~subquery.exists()).delete(
-            synchronize_session=False
-        )
-        db.session.commit()
-
-        return jsonify({
-            "message": f"Удалено {deleted_count} старых курсов валют без записи на {target_date.date()}"
-        }), 200
+        policy = RetentionPolicy.from_config()
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Некорректная политика хранения: {str(e)}"}), 400
 
+    try:
+        summary = run_retention(policy)
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"Ошибка при удалении: {str(e)}"}), 500
+    finally:
+        latest_rate_cache.invalidate()
 
+    return jsonify({
+        "message": f"Удалено {summary['deleted']} старых курсов валют",
+        **summary
+    }), 200
 
-@currency_bp.route('/currency-rates/<string:currency_code>', methods=['GET'])
-def get_currency_by_code(currency_code):
-    # Получаем параметры запроса (дата начала и дата конца)
-    start_date = request.args.get('start_date')  # Начальная дата (например, '2025-01-01')
-    end_date = request.args.get('end_date')  # Конечная дата (например, '2025-01-07')
 
-    # Проверка на корректность даты
-    def parse_date(date_str):
-        try:
-            return datetime.strptime(date_str, "%Y-%m-%d").date()
-        except ValueError:
-            raise BadRequest(f"Некорректная дата: {date_str}. Ожидаемый формат: yyyy-mm-dd.")
+def parse_date(date_str):
+    """Проверка на корректность даты"""
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        raise BadRequest(f"Некорректная дата: {date_str}. Ожидаемый формат: yyyy-mm-dd.")
+
 
-    query = CurrencyRate.query.filter(CurrencyRate.code == currency_code)
+def date_range_filters(start_date, end_date):
+    """Условия фильтрации по effective_date из строковых параметров start_date/end_date"""
+    filters = []
 
     if start_date:
-        start_date = parse_date(start_date)
-        query = query.filter(CurrencyRate.effective_date >= start_date)
+        filters.append(CurrencyRate.effective_date >= parse_date(start_date))
 
     if end_date:
-        end_date = parse_date(end_date)
-        query = query.filter(CurrencyRate.effective_date <= end_date)
+        filters.append(CurrencyRate.effective_date <= parse_date(end_date))
 
     # Если нет start_date и end_date, то возвращаем данные за неделю
     if not start_date and not end_date:
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=7)
-        query = query.filter(CurrencyRate.effective_date >= start_date, CurrencyRate.effective_date <= end_date)
+        filters.extend([CurrencyRate.effective_date >= start_date, CurrencyRate.effective_date <= end_date])
 
-    # Получаем результат
-    currencies = query.order_by(CurrencyRate.effective_date.asc()).all()
+    return filters
 
-    # Сериализуем данные
-    schema = CurrencySchema(many=True)
-    result = schema.dump(currencies)
+
+# Сколько валют можно запросить одним батч-запросом
+MAX_BATCH_CODES = 50
+
+
+@currency_bp.route('/currency-rates/history', methods=['GET'])
+def get_currencies_history():
+    """История нескольких валют одним запросом в колоночном формате"""
+    # Коды валют: ?codes=USD,EUR или ?codes=USD&codes=EUR
+    codes = [
+        code.strip()
+        for value in request.args.getlist('codes')
+        for code in value.split(',')
+        if code.strip()
+    ]
+    codes = list(dict.fromkeys(codes))  # Убираем дубликаты, сохраняя порядок
+
+    if not codes:
+        raise BadRequest("Параметр codes обязателен (например, codes=USD,EUR).")
+    if len(codes) > MAX_BATCH_CODES:
+        raise BadRequest(f"Можно запросить не более {MAX_BATCH_CODES} валют за раз.")
+
+    filters = date_range_filters(request.args.get('start_date'), request.args.get('end_date'))
+
+    # Один запрос IN (...) по диапазону дат вместо запроса на каждую валюту
+    rows = db.session.query(
+        CurrencyRate.code, CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+    ).filter(
+        CurrencyRate.code.in_(codes), *filters
+    ).order_by(
+        CurrencyRate.code, CurrencyRate.effective_date
+    ).all()
+
+    result = {code: {'dates': [], 'bid': [], 'ask': []} for code in codes}
+    for code, effective_date, bid, ask in rows:
+        series = result[code]
+        series['dates'].append(effective_date.isoformat())
+        series['bid'].append(None if bid is None else str(bid))
+        series['ask'].append(None if ask is None else str(ask))
 
     return jsonify(result), 200
+
+
+@currency_bp.route('/currency-rates/cross', methods=['GET'])
+def get_cross_rates():
+    """Матрица кросс-курсов (bid/ask) между всеми валютами или их подмножеством"""
+    as_of_date = request.args.get('date')
+    as_of_date = parse_date(as_of_date) if as_of_date else None
+
+    matrix = get_cross_rate_matrix(as_of_date)
+
+    codes = [code.strip() for code in request.args.get('codes', '').split(',') if code.strip()]
+    codes = list(dict.fromkeys(codes))
+    unknown = [code for code in codes if code not in matrix.index]
+    if unknown:
+        return jsonify({"error": f"Курсы для валют не найдены: {', '.join(unknown)}"}), 404
+
+    return jsonify(matrix.to_dict(codes or None)), 200
+
+
+@currency_bp.route('/currency-rates/<string:currency_code>/analytics', methods=['GET'])
+def get_currency_analytics(currency_code):
+    """Скользящие статистики (SMA, волатильность, min/max, дневное изменение) по истории валюты"""
+    try:
+        window = int(request.args.get('window', 20))
+    except ValueError:
+        window = 0
+    if not 2 <= window <= MAX_WINDOW:
+        raise BadRequest(f"window должен быть целым числом от 2 до {MAX_WINDOW}.")
+
+    price = request.args.get('price', 'mid')
+    if price not in PRICES:
+        raise BadRequest(f"Некорректный price: {price}. Допустимые значения: {', '.join(PRICES)}.")
+
+    metrics = [m.strip() for m in request.args.get('metrics', ','.join(METRICS)).split(',') if m.strip()]
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown or not metrics:
+        raise BadRequest(f"Некорректные metrics: {', '.join(unknown)}. Допустимые значения: {', '.join(METRICS)}.")
+
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    start_date = parse_date(start_date) if start_date else None
+    end_date = parse_date(end_date) if end_date else None
+
+    # По умолчанию — последние 90 дней
+    if not start_date and not end_date:
+        end_date = datetime.now().date()
+        start_date = end_date - timedelta(days=90)
+
+    dates, bid, ask = rate_history_cache.get(currency_code)
+    if len(dates) == 0:
+        return jsonify({"error": f"Валюта с кодом {currency_code} не найдена."}), 404
+
+    prices = {'bid': bid, 'ask': ask}.get(price)
+    if prices is None:
+        prices = (bid + ask) / 2
+
+    result = rolling_statistics(dates, prices, window, metrics, start_date, end_date)
+    result.update({'code': currency_code, 'window': window, 'price': price})
+
+    return jsonify(result), 200
+
+
+# Сколько строк читать из курсора за один раз при выгрузке истории
+EXPORT_BATCH_SIZE = 2000
+
+EXPORT_COLUMNS = ('code', 'effective_date', 'bid', 'ask')
+
+
+def _export_ndjson(partition):
+    return ''.join(
+        json.dumps({
+            'code': code,
+            'effective_date': effective_date.isoformat(),
+            'bid': None if bid is None else str(bid),
+            'ask': None if ask is None else str(ask),
+        }, separators=(',', ':')) + '\n'
+        for code, effective_date, bid, ask in partition
+    )
+
+
+def _export_csv(partition):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerows(
+        (code, effective_date.isoformat(), '' if bid is None else bid, '' if ask is None else ask)
+        for code, effective_date, bid, ask in partition
+    )
+    return buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', _export_ndjson),
+    'csv': ('text/csv', _export_csv),
+}
+
+
+@currency_bp.route('/currency-rates/export', methods=['GET'])
+def export_currency_rates():
+    """Потоковая выгрузка всей истории курсов в NDJSON или CSV"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise BadRequest(f"Некорректный format: {export_format}. Допустимые значения: {', '.join(EXPORT_FORMATS)}.")
+    mimetype, render = EXPORT_FORMATS[export_format]
+
+    stmt = db.select(
+        CurrencyRate.code, CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+    ).order_by(CurrencyRate.code, CurrencyRate.effective_date)
+
+    codes = [code.strip() for code in request.args.get('codes', '').split(',') if code.strip()]
+    if codes:
+        stmt = stmt.where(CurrencyRate.code.in_(codes))
+
+    # В отличие от /currency-rates/<code>, без дат выгружается вся история
+    if request.args.get('start_date'):
+        stmt = stmt.where(CurrencyRate.effective_date >= parse_date(request.args['start_date']))
+    if request.args.get('end_date'):
+        stmt = stmt.where(CurrencyRate.effective_date <= parse_date(request.args['end_date']))
+
+    def generate():
+        if export_format == 'csv':
+            yield ','.join(EXPORT_COLUMNS) + '\n'
+
+        # yield_per: строки читаются с курсора порциями, память не растет с объемом истории
+        result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            yield render(partition)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=currency_rates.{export_format}'},
+    )
+
+
+@currency_bp.route('/currency-rates/<string:currency_code>', methods=['GET'])
+def get_currency_by_code(currency_code):
+    # Получаем параметры запроса (дата начала и дата конца)
+    start_date = request.args.get('start_date')  # Начальная дата (например, '2025-01-01')
+    end_date = request.args.get('end_date')  # Конечная дата (например, '2025-01-07')
+    interval = request.args.get('interval')  # Агрегация по периодам: week/month/quarter/year
+    max_points = request.args.get('max_points')  # Ограничение числа точек (LTTB)
+
+    if interval and max_points:
+        raise BadRequest("Параметры interval и max_points нельзя использовать одновременно.")
+
+    if interval and interval not in INTERVALS:
+        raise BadRequest(f"Некорректный interval: {interval}. Допустимые значения: {', '.join(INTERVALS)}.")
+
+    if max_points:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            max_points = 0
+        if max_points < MIN_POINTS:
+            raise BadRequest(f"max_points должен быть целым числом не меньше {MIN_POINTS}.")
+
+    query = CurrencyRate.query.filter(CurrencyRate.code == currency_code, *date_range_filters(start_date, end_date))
+    query = query.order_by(CurrencyRate.effective_date.asc())
+
+    if interval or max_points:
+        # Для вычислений нужны только числовые значения
+        query = query.filter(CurrencyRate.bid.isnot(None), CurrencyRate.ask.isnot(None))
+
+    if interval:
+        # Агрегируем без создания ORM-объектов: только три колонки -> массивы numpy
+        rows = query.with_entities(CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask).all()
+        dates, bid, ask = to_arrays(rows)
+        return jsonify(aggregate_ohlc(currency_code, dates, bid, ask, interval)), 200
+
+    # Получаем результат (строки колонок, без создания ORM-объектов)
+    currencies = query.with_entities(
+        CurrencyRate.code, CurrencyRate.effective_date, CurrencyRate.bid, CurrencyRate.ask
+    ).all()
+
+    if max_points and len(currencies) > max_points:
+        dates, bid, ask = to_arrays([(c.effective_date, c.bid, c.ask) for c in currencies])
+        currencies = [currencies[i] for i in downsample(dates, bid, ask, max_points)]
+
+    # Сериализуем данные
+    return json_response(currency_rate_serializer.dumps(currencies))
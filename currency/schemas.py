@@ -1,5 +1,6 @@
 from marshmallow import Schema, fields
 from application.extension import ma
+from application.serialization import RowSerializer, decimal_str, iso_date
 from currency.models import CurrencyRate
 
 
@@ -30,5 +31,13 @@ class CurrencySchema(ma.SQLAlchemySchema):
                 "Buying Price": result["bid"]
             }
 
+# Быстрый путь для горячих эндпоинтов: те же ключи и форматы, что и у CurrencySchema.dump
+currency_rate_serializer = RowSerializer([
+    ("code", "code", None),
+    ("effective_date", "effective_date", iso_date),
+    ("bid", "bid", decimal_str),
+    ("ask", "ask", decimal_str),
+])
+
 class FavoriteCurrencySchema(Schema):
     currency_code = fields.Str(required=True)
\ No newline at end of file
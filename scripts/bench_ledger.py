@@ -0,0 +1,191 @@
+# Нагрузочный бенчмарк записи балансов: commit на каждый запрос против
+# журнала с групповым commit (user/ledger.py, WALLET_LEDGER=1).
+#
+# Потоки одного процесса шлют через тестовый клиент Flask смесь пополнений,
+# снятий, покупок и продаж. Считаются операции в секунду, задержка ответа и
+# число commit (событие 'commit' движка), а в конце балансы кошельков
+# сверяются с начальными, подтвержденными пополнениями/снятиями и журналом
+# транзакций: расхождение — потерянное или лишнее изменение.
+#
+# Запуск из корня проекта (база создается во временном каталоге):
+#     python -m scripts.bench_ledger --threads 16 --requests 200 --users 8
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+MODES = ('commit', 'ledger')
+OPERATIONS = ('deposit', 'withdraw', 'buy', 'sell')
+CODES = {'USD': (Decimal('3.9512'), Decimal('4.0311')), 'EUR': (Decimal('4.2507'), Decimal('4.3366'))}
+INITIAL_PLN = Decimal('100000')
+INITIAL_CURRENCY = Decimal('1000')
+
+
+def setup(mode, users, directory):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, f'{mode}.db')}"
+    os.environ['WALLET_LEDGER'] = '1' if mode == 'ledger' else '0'
+
+    from application import create_app
+    from application.extension import db
+    from currency.models import LatestCurrencyRate
+    from currency.rate_cache import bump_rates_version
+    from user.models import User, Wallet
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        for user_id in range(1, users + 1):
+            db.session.add(User(id=user_id, firstname='Bench', lastname=str(user_id), phone='0',
+                                email=f'bench{user_id}@example.com', password_hash='-'))
+            db.session.add(Wallet(user_id=user_id, currency_code='PLN', balance=INITIAL_PLN))
+            for code in CODES:
+                db.session.add(Wallet(user_id=user_id, currency_code=code, balance=INITIAL_CURRENCY))
+        for code, (bid, ask) in CODES.items():
+            db.session.add(LatestCurrencyRate(code=code, effective_date=date.today(), bid=bid, ask=ask))
+        bump_rates_version()
+        db.session.commit()
+    return app
+
+
+def request(client, headers, operation, currency_code, amount):
+    if operation in ('deposit', 'withdraw'):
+        url = f'/api/user/{operation}'
+        payload = {'currency_code': currency_code, 'amount': float(amount)}
+    else:
+        url = f'/api/transactions/transaction/{operation}'
+        payload = {'currency_code': currency_code, 'amount': str(amount)}
+    return client.post(url, json=payload, headers=headers).status_code
+
+
+def worker(app, seed, requests, users, tokens, results):
+    client = app.test_client()
+    generator = random.Random(seed)
+    counts = defaultdict(int)
+    # Подтвержденные пополнения/снятия: (user_id, code) -> сумма
+    moved = defaultdict(Decimal)
+    latencies = []
+    for _ in range(requests):
+        user_id = generator.randint(1, users)
+        operation = generator.choice(OPERATIONS)
+        if operation in ('deposit', 'withdraw'):
+            currency_code = generator.choice(('PLN', *CODES))
+        else:
+            currency_code = generator.choice(list(CODES))
+        amount = Decimal(generator.randint(1, 500)) / 100
+
+        started = time.perf_counter()
+        status = request(client, {'Authorization': f'Bearer {tokens[user_id]}'}, operation, currency_code, amount)
+        latencies.append(time.perf_counter() - started)
+
+        if status == 200:
+            counts['ok'] += 1
+            if operation == 'deposit':
+                moved[(user_id, currency_code)] += amount
+            elif operation == 'withdraw':
+                moved[(user_id, currency_code)] -= amount
+        elif status < 500:
+            counts['rejected'] += 1
+        else:
+            counts['errors'] += 1
+    results.append((counts, moved, latencies))
+
+
+def count_anomalies(app, moved):
+    """Сколько кошельков не сходятся с начальными балансами, пополнениями/снятиями и транзакциями"""
+    from application.extension import db
+    from application.money import multiply
+    from transaction.models import Transaction
+    from user.models import Wallet
+    from user.wallet_service import wallet_balance
+
+    # В режиме decimal SQLite хранит REAL, поэтому допускаем погрешность округления
+    tolerance = Decimal('0.001')
+    with app.app_context():
+        expected = defaultdict(lambda: INITIAL_CURRENCY)
+        for user_id, in db.session.query(Wallet.user_id).filter(Wallet.currency_code == 'PLN'):
+            expected[(user_id, 'PLN')] = INITIAL_PLN
+        for key, amount in moved.items():
+            expected[key] += amount
+        for user_id, code, side, amount, price in db.session.query(
+            Transaction.user_id, Transaction.currency_code, Transaction.transaction_type,
+            Transaction.amount, Transaction.price
+        ):
+            sign = 1 if side == 'buy' else -1
+            expected[(user_id, code)] += sign * amount
+            expected[(user_id, 'PLN')] -= sign * multiply(amount, price)
+
+        anomalies = 0
+        for user_id, code, balance in db.session.query(Wallet.user_id, Wallet.currency_code, wallet_balance):
+            if balance < 0 or abs(balance - expected[(user_id, code)]) > tolerance:
+                anomalies += 1
+    return anomalies
+
+
+def run(mode, args, directory):
+    from sqlalchemy import event
+
+    from application.extension import db
+    from auth.jwt import generate_jwt
+
+    app = setup(mode, args.users, directory)
+    commits = [0]
+    with app.app_context():
+        tokens = {user_id: generate_jwt(user_id=user_id) for user_id in range(1, args.users + 1)}
+        event.listen(db.engine, 'commit', lambda connection: commits.__setitem__(0, commits[0] + 1))
+    results = []
+    threads = [
+        threading.Thread(target=worker, args=(app, args.seed + number, args.requests, args.users, tokens, results))
+        for number in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    totals = defaultdict(int)
+    moved = defaultdict(Decimal)
+    latencies = []
+    for counts, thread_moved, thread_latencies in results:
+        for key, value in counts.items():
+            totals[key] += value
+        for key, value in thread_moved.items():
+            moved[key] += value
+        latencies.extend(thread_latencies)
+    latencies.sort()
+    writes = commits[0]
+
+    writer = app.extensions.get('ledger_writer')
+    if writer is not None:
+        writer.stop()
+    anomalies = count_anomalies(app, moved)
+    done = totals['ok'] + totals['rejected']
+    print(f"{mode:<7} {elapsed:6.2f} s  {done / elapsed:7,.0f} requests/s  "
+          f"p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms  p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms  "
+          f"{totals['ok']:>5} ok  {totals['rejected']:>4} rejected  {totals['errors']:>4} errors  "
+          f"{writes:>5} commits  {anomalies:>2} balance anomalies")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request commit vs group-committed wallet ledger")
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent client threads")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per thread")
+    parser.add_argument("--users", type=int, default=8, help="Users the requests are spread across")
+    parser.add_argument("--mode", choices=MODES, action="append", help="Mode(s) to run (default: both)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.requests} requests over {args.users} users")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.mode or MODES:
+            run(mode, args, directory)
+
+
+if __name__ == "__main__":
+    main()
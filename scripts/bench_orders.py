@@ -0,0 +1,202 @@
+# Нагрузочный бенчмарк исполнения ордеров: несколько процессов одновременно
+# покупают и продают валюту у небольшого числа пользователей.
+#
+# Сравнивает прежний путь (чтение кошельков, проверка в Python, commit) с
+# transaction.order_service (условные UPDATE ... RETURNING), а также пакетное
+# исполнение execute_batch (--batch_size ордеров на один commit), и сверяет
+# балансы кошельков с журналом транзакций: расхождение — потерянное обновление.
+#
+# Запуск из корня проекта (база создается во временном каталоге):
+#     python -m scripts.bench_orders --workers 8 --orders 300 --users 4 --batch_size 20
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+ENGINES = ('legacy', 'atomic', 'batch')
+CODES = {'USD': (Decimal('3.9512'), Decimal('4.0311')), 'EUR': (Decimal('4.2507'), Decimal('4.3366'))}
+INITIAL_PLN = Decimal('1000000')
+INITIAL_CURRENCY = Decimal('1000')
+
+
+def setup_database(users, integer):
+    from application import create_app
+    from application.commands import migrate_money_storage
+    from application.extension import db
+    from currency.models import LatestCurrencyRate
+    from currency.rate_cache import bump_rates_version
+    from user.models import User, Wallet
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if integer:
+            migrate_money_storage('integer')
+        for user_id in range(1, users + 1):
+            db.session.add(User(id=user_id, firstname='Bench', lastname=str(user_id), phone='0',
+                                email=f'bench{user_id}@example.com', password_hash='-'))
+            db.session.add(Wallet(user_id=user_id, currency_code='PLN', balance=INITIAL_PLN))
+            for code in CODES:
+                db.session.add(Wallet(user_id=user_id, currency_code=code, balance=INITIAL_CURRENCY))
+        for code, (bid, ask) in CODES.items():
+            db.session.add(LatestCurrencyRate(code=code, effective_date=date.today(), bid=bid, ask=ask))
+        bump_rates_version()
+        db.session.commit()
+
+
+def legacy_order(user_id, side, currency_code, amount):
+    # Так buy_currency/sell_currency исполняли ордер до order_service
+    from application.extension import db
+    from application.money import multiply
+    from currency.currency_service import get_latest_currency_by_code
+    from transaction.models import Transaction
+    from transaction.order_service import OrderError
+    from user.models import Wallet
+
+    rate = get_latest_currency_by_code(currency_code)
+    pln_wallet = Wallet.query.filter_by(user_id=user_id, currency_code='PLN').first()
+    currency_wallet = Wallet.query.filter_by(user_id=user_id, currency_code=currency_code).first()
+    price = rate.ask if side == 'buy' else rate.bid
+    total = multiply(amount, price)
+    if side == 'buy':
+        if pln_wallet.balance < total:
+            raise OrderError("Insufficient PLN balance")
+        pln_wallet.balance -= total
+        currency_wallet.balance += amount
+    else:
+        if currency_wallet.balance < amount:
+            raise OrderError("Insufficient currency balance")
+        currency_wallet.balance -= amount
+        pln_wallet.balance += total
+    db.session.add(Transaction(
+        user_id=user_id, currency_code=currency_code, amount=amount, transaction_type=side, price=price,
+        final_pln_balance=pln_wallet.balance, final_currency_balance=currency_wallet.balance
+    ))
+    db.session.commit()
+
+
+def worker(engine, seed, orders, users, batch_size):
+    from sqlalchemy.exc import OperationalError
+
+    from application import create_app
+    from application.extension import db
+    from transaction.order_service import OrderError, execute_batch, execute_order
+
+    app = create_app()
+    generator = random.Random(seed)
+    counts = defaultdict(int)
+    with app.app_context():
+        started = time.perf_counter()
+        basket = []
+        for number in range(orders):
+            user_id = generator.randint(1, users)
+            side = generator.choice(('buy', 'sell'))
+            currency_code = generator.choice(list(CODES))
+            amount = Decimal(generator.randint(1, 500)) / 100
+            try:
+                if engine == 'batch':
+                    # Копим batch_size ног и исполняем их одной корзиной (от имени последнего пользователя)
+                    basket.append({'side': side, 'currency_code': currency_code, 'amount': amount})
+                    if len(basket) < batch_size and number < orders - 1:
+                        continue
+                    executed = len(execute_batch(user_id, basket))
+                    basket = []
+                elif engine == 'atomic':
+                    execute_order(user_id, side, currency_code, amount)
+                    executed = 1
+                else:
+                    legacy_order(user_id, side, currency_code, amount)
+                    executed = 1
+                counts['executed'] += executed
+            except OrderError:
+                db.session.rollback()
+                counts['rejected'] += len(basket) or 1
+                basket = []
+            except OperationalError:
+                # Обычно "database is locked" — запись не дождалась блокировки
+                db.session.rollback()
+                counts['errors'] += len(basket) or 1
+                basket = []
+        counts['elapsed'] = time.perf_counter() - started
+    return dict(counts)
+
+
+def count_anomalies(integer):
+    """Сколько кошельков не сходятся с журналом транзакций (или ушли в минус)"""
+    from application import create_app
+    from application.extension import db
+    from application.money import multiply
+    from transaction.models import Transaction
+    from user.models import Wallet
+
+    # В режиме decimal SQLite хранит REAL, поэтому допускаем погрешность округления
+    tolerance = Decimal(0) if integer else Decimal('0.001')
+    app = create_app()
+    with app.app_context():
+        expected = defaultdict(lambda: INITIAL_CURRENCY)
+        for user_id, in db.session.query(Wallet.user_id).filter(Wallet.currency_code == 'PLN'):
+            expected[(user_id, 'PLN')] = INITIAL_PLN
+
+        for user_id, code, side, amount, price in db.session.query(
+            Transaction.user_id, Transaction.currency_code, Transaction.transaction_type,
+            Transaction.amount, Transaction.price
+        ):
+            sign = 1 if side == 'buy' else -1
+            expected[(user_id, code)] += sign * amount
+            expected[(user_id, 'PLN')] -= sign * multiply(amount, price)
+
+        anomalies = 0
+        for user_id, code, balance in db.session.query(Wallet.user_id, Wallet.currency_code, Wallet.balance):
+            if balance < 0 or abs(balance - expected[(user_id, code)]) > tolerance:
+                anomalies += 1
+        transactions = db.session.query(Transaction.id).count()
+    return anomalies, transactions
+
+
+def run(engine, args, directory):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, f'{engine}.db')}"
+    setup_database(args.users, args.integer)
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers) as pool:
+        results = pool.starmap(worker, [
+            (engine, args.seed + number, args.orders, args.users, args.batch_size) for number in range(args.workers)
+        ])
+
+    totals = defaultdict(int)
+    for counts in results:
+        for key, value in counts.items():
+            totals[key] += value
+    # Время запуска процессов не считаем: от первого до последнего ордера самого медленного воркера
+    elapsed = max(counts['elapsed'] for counts in results)
+    anomalies, transactions = count_anomalies(args.integer)
+    print(f"{engine:<8} {elapsed:7.2f} s  {totals['executed'] / elapsed:8,.0f} orders/s  "
+          f"{totals['executed']:>6} executed  {totals['rejected']:>5} rejected  {totals['errors']:>5} errors  "
+          f"{transactions:>6} transactions  {anomalies:>3} balance anomalies")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent order execution benchmark")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel worker processes")
+    parser.add_argument("--orders", type=int, default=300, help="Orders per worker")
+    parser.add_argument("--users", type=int, default=4, help="Users the orders are spread across")
+    parser.add_argument("--engine", choices=ENGINES, action="append", help="Engine(s) to run (default: both)")
+    parser.add_argument("--batch_size", type=int, default=20, help="Orders per request for the batch engine")
+    parser.add_argument("--integer", action="store_true", help="Use integer money storage")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.orders} orders over {args.users} users, "
+          f"{'integer' if args.integer else 'decimal'} money storage")
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in args.engine or ENGINES:
+            run(engine, args, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Бенчмарк поиска сработавших лимитных ордеров при новом курсе:
+# отсортированный список цен (transaction.price_triggers.PriceLevels,
+# двоичный поиск и один срез) против проверки каждого ордера.
+#
+# Запуск из корня проекта:
+#     python -m scripts.bench_price_triggers --orders 100000 --updates 200
+import argparse
+import random
+import time
+from decimal import Decimal
+
+
+def main():
+    import application  # noqa: F401 — пакет приложения импортируется раньше его модулей
+    from transaction.price_triggers import PriceLevels
+
+    parser = argparse.ArgumentParser(description="Sorted price index vs full scan for triggered limit orders")
+    parser.add_argument("--orders", type=int, default=100000, help="Pending buy orders of one currency")
+    parser.add_argument("--updates", type=int, default=200, help="Rate updates to evaluate")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    orders = [(Decimal(generator.randint(35000, 40000)) / 10000, order_id) for order_id in range(1, args.orders + 1)]
+    # Курс ask медленно снижается: каждое обновление задевает небольшую часть ордеров
+    asks = [Decimal(40000 - step * 5000 // args.updates) / 10000 for step in range(args.updates)]
+
+    started = time.perf_counter()
+    levels = PriceLevels()
+    for limit_price, order_id in sorted(orders):
+        levels.add(limit_price, order_id)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [levels.pop_at_least(ask) for ask in asks]
+    index_time = time.perf_counter() - started
+
+    pending = dict((order_id, limit_price) for limit_price, order_id in orders)
+    started = time.perf_counter()
+    scanned = []
+    for ask in asks:
+        triggered = [order_id for order_id, limit_price in pending.items() if limit_price >= ask]
+        for order_id in triggered:
+            del pending[order_id]
+        scanned.append(triggered)
+    scan_time = time.perf_counter() - started
+
+    assert [sorted(ids) for ids in indexed] == [sorted(ids) for ids in scanned]
+    print(f"{args.orders} pending orders, {args.updates} rate updates, "
+          f"{sum(map(len, indexed))} triggered (index built in {build * 1000:.0f} ms)")
+    print(f"sorted index {index_time / args.updates * 1000:8.3f} ms per update")
+    print(f"full scan    {scan_time / args.updates * 1000:8.3f} ms per update")
+
+
+if __name__ == "__main__":
+    main()
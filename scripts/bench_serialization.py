@@ -0,0 +1,117 @@
+# Микробенчмарк: marshmallow (CurrencySchema + jsonify) против RowSerializer.
+#
+# Запуск из корня проекта:
+#     python -m scripts.bench_serialization --rows 20000 --repeat 5
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from application import create_app
+from application.serialization import BACKENDS, get_backend, set_backend
+from currency.rate_cache import RateSnapshot
+from currency.schemas import CurrencySchema, currency_rate_serializer
+from transaction.routes import transaction_serializer
+
+
+class TransactionRow:
+    __slots__ = (
+        "id", "currency_code", "amount", "transaction_type", "timestamp",
+        "price", "final_pln_balance", "final_currency_balance",
+    )
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+def make_rates(count):
+    start = date(2002, 1, 2)
+    return [
+        RateSnapshot("USD", start + timedelta(days=i), Decimal("4.0123") + i % 97, Decimal("4.1234") + i % 89)
+        for i in range(count)
+    ]
+
+
+def make_transactions(count):
+    start = datetime(2024, 1, 1)
+    return [
+        TransactionRow(
+            id=i,
+            currency_code="EUR",
+            amount=Decimal("10.5000"),
+            transaction_type="buy" if i % 2 else "sell",
+            timestamp=start + timedelta(minutes=i),
+            price=Decimal("4.3012"),
+            final_pln_balance=Decimal("1000.0000") + i,
+            final_currency_balance=Decimal("10.5000") * i,
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_transactions(app, transactions):
+    # Так get_transactions собирал ответ до перехода на RowSerializer
+    return app.json.dumps([
+        {
+            "id": txn.id,
+            "currency_code": txn.currency_code,
+            "amount": str(txn.amount),
+            "transaction_type": txn.transaction_type,
+            "timestamp": txn.timestamp,
+            "price": txn.price,
+            "final_pln_balance": str(txn.final_pln_balance),
+            "final_currency_balance": str(txn.final_currency_balance)
+        } for txn in transactions
+    ], separators=(",", ":")).encode("utf-8")
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization micro-benchmark")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows per payload")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case (best is reported)")
+    args = parser.parse_args()
+
+    app = create_app()
+    rates = make_rates(args.rows)
+    transactions = make_transactions(args.rows)
+    schema = CurrencySchema(many=True)
+
+    with app.app_context():
+        cases = [
+            ("currency rates / marshmallow + jsonify",
+             lambda: app.json.dumps(schema.dump(rates), separators=(",", ":")).encode("utf-8")),
+            ("transactions / dict + jsonify",
+             lambda: legacy_transactions(app, transactions)),
+        ]
+        for backend in BACKENDS:
+            cases.append((f"currency rates / RowSerializer [{backend}]",
+                          lambda backend=backend: set_backend(backend) or currency_rate_serializer.dumps(rates)))
+            cases.append((f"transactions / RowSerializer [{backend}]",
+                          lambda backend=backend: set_backend(backend) or transaction_serializer.dumps(transactions)))
+
+        default_backend = get_backend()
+        print(f"{args.rows} rows, best of {args.repeat}")
+        results = {}
+        for name, func in cases:
+            elapsed, body = best_of(args.repeat, func)
+            results[name] = body
+            print(f"{name:<48} {elapsed * 1000:9.1f} ms  {args.rows / elapsed:12,.0f} rows/s  {len(body):>10,} bytes")
+        set_backend(default_backend)
+
+        # Быстрый путь обязан выдавать те же байты, что и прежний
+        assert results["currency rates / RowSerializer [json]"] == results["currency rates / marshmallow + jsonify"]
+        assert results["transactions / RowSerializer [json]"] == results["transactions / dict + jsonify"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import application  # noqa: F401 — пакет приложения импортируется раньше его модулей
+from application import create_app
+from application.extension import db
+from auth.jwt import generate_jwt
+from currency.analytics import rate_history_cache
+from currency.models import LatestCurrencyRate
+from currency.rate_cache import bump_rates_version, latest_rate_cache
+from user.models import User, Wallet
+
+USER_ID = 1
+USD_BID = Decimal('3.9000')
+USD_ASK = Decimal('4.0000')
+
+
+@pytest.fixture(params=['commit'])
+def app(request, tmp_path, monkeypatch):
+    """Приложение на отдельной SQLite-базе; param 'ledger' включает WALLET_LEDGER"""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('WALLET_LEDGER', '1' if request.param == 'ledger' else '0')
+    monkeypatch.delenv('PRICE_TRIGGERS', raising=False)
+    monkeypatch.delenv('RATES_NOTIFY_FILE', raising=False)
+
+    # Кэши живут на уровне модулей, а номера поколений в новой базе начинаются заново
+    latest_rate_cache.__init__()
+    rate_history_cache.clear()
+
+    app = create_app()
+    app.config['RATE_CACHE_CHECK_INTERVAL'] = 0
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=USER_ID, firstname='Test', lastname='User', phone='+48123456789',
+                            email='test@example.com', password_hash='-'))
+        db.session.add(Wallet(user_id=USER_ID, currency_code='PLN', balance=Decimal('100')))
+        db.session.add(LatestCurrencyRate(code='USD', effective_date=date.today(), bid=USD_BID, ask=USD_ASK))
+        bump_rates_version()
+        db.session.commit()
+
+    yield app
+
+    writer = app.extensions.get('ledger_writer')
+    if writer is not None:
+        writer.stop()
+        writer.join()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(app):
+    return {'Authorization': f'Bearer {generate_jwt(user_id=USER_ID)}'}
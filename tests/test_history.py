@@ -0,0 +1,54 @@
+TRANSACTIONS_URL = '/api/transactions/transactions'
+
+
+def buy_batch(client, auth, count):
+    # Все транзакции пакета получают одинаковый timestamp: порядок страниц держится на id
+    response = client.post('/api/transactions/transaction/batch', headers=auth, json={
+        'orders': [{'side': 'buy', 'currency_code': 'USD', 'amount': '0.1'}] * count
+    })
+    assert response.status_code == 200
+    return [order['transaction_id'] for order in response.json['orders']]
+
+
+def test_without_limit_the_whole_history_is_returned(client, auth):
+    ids = buy_batch(client, auth, 30)
+
+    response = client.get(TRANSACTIONS_URL, headers=auth)
+
+    assert [row['id'] for row in response.json] == sorted(ids, reverse=True)
+    assert 'X-Next-Cursor' not in response.headers
+
+
+def test_cursor_pages_are_stable_while_new_transactions_arrive(client, auth):
+    ids = buy_batch(client, auth, 25)
+
+    seen = []
+    response = client.get(f'{TRANSACTIONS_URL}?limit=10', headers=auth)
+    while True:
+        assert response.status_code == 200
+        seen += [row['id'] for row in response.json]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        # Новые транзакции появляются перед уже отданными страницами и не сдвигают следующие
+        buy_batch(client, auth, 3)
+        response = client.get(f'{TRANSACTIONS_URL}?limit=10&cursor={cursor}', headers=auth)
+
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_link_header_points_to_the_next_page(client, auth):
+    buy_batch(client, auth, 3)
+
+    first = client.get(f'{TRANSACTIONS_URL}?limit=2', headers=auth)
+    link = first.headers['Link']
+    second = client.get(link[1:link.index('>')], headers=auth)
+
+    assert len(first.json) == 2
+    assert len(second.json) == 1
+    assert 'Link' not in second.headers
+
+
+def test_invalid_cursor_and_limit_are_rejected(client, auth):
+    assert client.get(f'{TRANSACTIONS_URL}?cursor=not-a-cursor', headers=auth).status_code == 400
+    assert client.get(f'{TRANSACTIONS_URL}?limit=0', headers=auth).status_code == 400
@@ -0,0 +1,32 @@
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+from application.extension import db
+from tests.conftest import USER_ID
+from user.ledger import fold_ledger
+from user.models import LedgerEntry, Wallet
+
+
+def test_fold_without_tail_does_not_take_the_write_lock(app, tmp_path):
+    # Другой процесс держит блокировку записи (например, LedgerWriter в режиме WALLET_LEDGER)
+    other = sqlite3.connect(tmp_path / 'test.db', timeout=0)
+    other.execute('BEGIN IMMEDIATE')
+    try:
+        with app.app_context():
+            assert fold_ledger() == 0
+    finally:
+        other.rollback()
+        other.close()
+
+
+def test_fold_moves_the_tail_into_wallet_balances(app):
+    with app.app_context():
+        db.session.add(LedgerEntry(user_id=USER_ID, currency_code='PLN', delta=Decimal('25'), kind='deposit',
+                                   created_at=datetime.utcnow()))
+        db.session.commit()
+
+        assert fold_ledger() == 1
+        assert fold_ledger() == 0
+        balance = db.session.query(Wallet.balance).filter_by(user_id=USER_ID, currency_code='PLN').scalar()
+    assert balance == Decimal('125')
@@ -0,0 +1,62 @@
+import pytest
+
+BATCH_URL = '/api/transactions/transaction/batch'
+
+
+def wallet(client, auth):
+    return client.get('/api/user/wallet', headers=auth).json
+
+
+def transactions(client, auth):
+    return client.get('/api/transactions/transactions', headers=auth).json
+
+
+@pytest.mark.parametrize('app', ['commit', 'ledger'], indirect=True)
+def test_batch_within_balance_is_executed(client, auth):
+    response = client.post(BATCH_URL, headers=auth, json={'orders': [
+        {'side': 'buy', 'currency_code': 'USD', 'amount': '10'},
+        {'side': 'sell', 'currency_code': 'USD', 'amount': '4'},
+    ]})
+
+    assert response.status_code == 200
+    assert [order['amount'] for order in response.json['orders']] == ['10.0000', '4.0000']
+    assert wallet(client, auth) == {'PLN': '75.6000', 'USD': '6.0000'}
+
+
+@pytest.mark.parametrize('app', ['commit', 'ledger'], indirect=True)
+def test_batch_overdraft_rejects_the_whole_batch(client, auth):
+    # 10 USD по 4.0 = 40 PLN проходят, еще 20 USD = 80 PLN уже не хватает
+    response = client.post(BATCH_URL, headers=auth, json={'orders': [
+        {'side': 'buy', 'currency_code': 'USD', 'amount': '10'},
+        {'side': 'buy', 'currency_code': 'USD', 'amount': '20'},
+    ]})
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Order 2: Insufficient PLN balance'
+    assert wallet(client, auth) == {'PLN': '100.0000'}
+    assert transactions(client, auth) == []
+
+
+@pytest.mark.parametrize('app', ['commit', 'ledger'], indirect=True)
+def test_batch_cannot_sell_currency_bought_later(client, auth):
+    response = client.post(BATCH_URL, headers=auth, json={'orders': [
+        {'side': 'sell', 'currency_code': 'USD', 'amount': '5'},
+        {'side': 'buy', 'currency_code': 'USD', 'amount': '5'},
+    ]})
+
+    assert response.status_code == 404
+    assert response.json['error'] == 'Order 1: USD wallet not found'
+    assert wallet(client, auth) == {'PLN': '100.0000'}
+
+
+@pytest.mark.parametrize('app', ['commit', 'ledger'], indirect=True)
+def test_overdraft_of_single_orders_is_rejected(client, auth):
+    buy = client.post('/api/transactions/transaction/buy', headers=auth,
+                      json={'currency_code': 'USD', 'amount': '26'})
+    withdraw = client.post('/api/user/withdraw', headers=auth, json={'currency_code': 'PLN', 'amount': 101})
+
+    assert buy.status_code == 400
+    assert withdraw.status_code == 400
+    assert wallet(client, auth) == {'PLN': '100.0000'}
+    assert transactions(client, auth) == []
+
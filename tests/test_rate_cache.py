@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from application.extension import db
+from currency.currency_service import get_latest_currency_by_code
+from currency.models import LatestCurrencyRate
+from currency.rate_cache import bump_rates_version, latest_rate_cache
+from tests.conftest import USD_BID
+
+
+def update_usd_bid(app, bid, bump=True):
+    # Отдельный контекст приложения — отдельная сессия, как у загрузчика курсов
+    with app.app_context():
+        db.session.get(LatestCurrencyRate, 'USD').bid = Decimal(bid)
+        if bump:
+            bump_rates_version()
+        db.session.commit()
+
+
+def test_snapshot_is_loaded_once_and_then_hit(app):
+    with app.app_context():
+        first = get_latest_currency_by_code('USD')
+        second = get_latest_currency_by_code('USD')
+
+    assert first.bid == second.bid == USD_BID
+    stats = latest_rate_cache.stats()
+    assert (stats['misses'], stats['reloads'], stats['hits']) == (1, 1, 1)
+
+
+def test_snapshot_is_reloaded_after_rates_version_bump(app):
+    with app.app_context():
+        get_latest_currency_by_code('USD')
+        generation = latest_rate_cache.generation
+
+    # Без нового поколения снимок не перечитывается
+    update_usd_bid(app, '3.9500', bump=False)
+    with app.app_context():
+        assert get_latest_currency_by_code('USD').bid == USD_BID
+
+    update_usd_bid(app, '3.9600')
+    with app.app_context():
+        assert get_latest_currency_by_code('USD').bid == Decimal('3.9600')
+        assert latest_rate_cache.generation == generation + 1
+    assert latest_rate_cache.stats()['reloads'] == 2
+
+
+def test_cache_stats_reports_counters(app, client):
+    with app.app_context():
+        for _ in range(3):
+            get_latest_currency_by_code('USD')
+
+    response = client.get('/api/currency/cache-stats')
+
+    assert response.status_code == 200
+    assert response.json == {
+        'generation': 1,
+        'size': 1,
+        'hits': 2,
+        'misses': 1,
+        'reloads': 1,
+        'version_checks': 3,
+        'notifications': None,
+    }
@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+import pytest
+
+from application.extension import db
+from currency.models import CurrencyRate, LatestCurrencyRate
+from currency.rate_cache import bump_rates_version, read_history_epoch
+from currency.retention import DEFAULT_POLICY, RetentionPolicy, run_retention
+from tests.conftest import USD_ASK, USD_BID
+
+RETENTION_URL = '/api/currency/delete-old-currency-rates'
+
+
+@pytest.fixture
+def usd_history(app):
+    """Ежедневные курсы USD за 1000 дней до сегодняшнего"""
+    today = date.today()
+    with app.app_context():
+        db.session.add_all(
+            CurrencyRate(code='USD', effective_date=today - timedelta(days=days), bid=USD_BID, ask=USD_ASK)
+            for days in range(1000)
+        )
+        bump_rates_version()
+        db.session.commit()
+    return today
+
+
+def rate_count(app):
+    with app.app_context():
+        return CurrencyRate.query.count()
+
+
+def test_default_policy_keeps_everything(app, usd_history):
+    with app.app_context():
+        policy = RetentionPolicy.from_config()
+        summary = run_retention(policy)
+        epoch = read_history_epoch()
+
+    assert policy.to_dict() == DEFAULT_POLICY
+    assert summary['deleted'] == 0
+    assert rate_count(app) == 1000
+    assert epoch == 0
+
+
+def test_route_ignores_policy_in_request_body(app, client, usd_history):
+    response = client.delete(RETENTION_URL, json={'keep_daily_days': 0, 'sample': 'none'})
+
+    assert response.status_code == 200
+    assert response.json['deleted'] == 0
+    assert rate_count(app) == 1000
+
+
+def test_configured_sampling_thins_old_history(app, client, usd_history):
+    app.config['CURRENCY_RETENTION'] = {'keep_daily_days': 730, 'sample': 'monthly', 'vacuum': False}
+
+    response = client.delete(RETENTION_URL)
+
+    assert response.status_code == 200
+    with app.app_context():
+        old_dates = [
+            d for (d,) in db.session.query(CurrencyRate.effective_date)
+            .filter(CurrencyRate.effective_date < usd_history - timedelta(days=730))
+        ]
+        epoch = read_history_epoch()
+    # Старше 730 дней остается по одному дню на месяц
+    assert len(old_dates) == len({(d.year, d.month) for d in old_dates})
+    assert rate_count(app) == 1000 - response.json['deleted']
+    # Кэши историй других процессов перечитают историю целиком
+    assert epoch == 1
+
+
+def test_code_without_remaining_history_loses_its_latest_rate(app, client, usd_history):
+    stale = usd_history - timedelta(days=900)
+    with app.app_context():
+        db.session.add(CurrencyRate(code='EUR', effective_date=stale, bid=USD_BID, ask=USD_ASK))
+        db.session.add(LatestCurrencyRate(code='EUR', effective_date=stale, bid=USD_BID, ask=USD_ASK))
+        bump_rates_version()
+        db.session.commit()
+    app.config['CURRENCY_RETENTION'] = {'keep_daily_days': 730, 'sample': 'none', 'vacuum': False}
+
+    response = client.delete(RETENTION_URL)
+
+    assert response.status_code == 200
+    assert response.json['emptied_codes'] == ['EUR']
+    with app.app_context():
+        assert [code for (code,) in db.session.query(LatestCurrencyRate.code)] == ['USD']
+    assert rate_count(app) == 731
@@ -0,0 +1,81 @@
+"""История транзакций пользователя с курсорной (keyset) пагинацией.
+
+Страницы идут от новых к старым по (timestamp, id). Курсор — непрозрачная
+строка с (timestamp, id) последней отданной строки: следующая страница
+начинается строго после нее, поэтому страница N стоит столько же, сколько
+первая (поиск по индексу idx_transactions_user_timestamp, без OFFSET).
+"""
+import base64
+import binascii
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, tuple_
+
+from application.extension import db
+from transaction.models import Transaction
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+HISTORY_COLUMNS = (
+    Transaction.id,
+    Transaction.currency_code,
+    Transaction.amount,
+    Transaction.transaction_type,
+    Transaction.timestamp,
+    Transaction.price,
+    Transaction.final_pln_balance,
+    Transaction.final_currency_balance,
+)
+
+
+def encode_cursor(timestamp, transaction_id):
+    """(timestamp, id) -> непрозрачная строка для параметра cursor"""
+    raw = f"{timestamp.isoformat()}|{transaction_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor):
+    """Строка курсора -> (timestamp, id); ValueError, если курсор поврежден"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, transaction_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def transaction_page(user_id, limit=DEFAULT_PAGE_SIZE, cursor=None, currency_code=None, transaction_type=None,
+                     start_date=None, end_date=None):
+    """Одна страница истории: (строки, курсор следующей страницы или None).
+
+    start_date/end_date — даты (включительно), фильтр по timestamp.
+    limit=None — вся история без пагинации (курсор не возвращается).
+    """
+    stmt = select(*HISTORY_COLUMNS).where(Transaction.user_id == user_id)
+
+    if currency_code:
+        stmt = stmt.where(Transaction.currency_code == currency_code)
+    if transaction_type:
+        stmt = stmt.where(Transaction.transaction_type == transaction_type)
+    if start_date:
+        stmt = stmt.where(Transaction.timestamp >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        stmt = stmt.where(Transaction.timestamp < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    if cursor:
+        # Сравнение row value: SQLite продолжает обход индекса с позиции курсора
+        stmt = stmt.where(tuple_(Transaction.timestamp, Transaction.id) < tuple_(*decode_cursor(cursor)))
+
+    stmt = stmt.order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+    if limit is None:
+        return db.session.execute(stmt).all(), None
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = db.session.execute(
+        stmt.limit(limit + 1)
+    ).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
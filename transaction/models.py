@@ -1,4 +1,5 @@
 from application.extension import db
+from application.money import FixedPoint
 from datetime import datetime
 from decimal import Decimal
 
@@ -9,12 +10,59 @@ class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     currency_code = db.Column(db.String(3), nullable=False)
-    amount = db.Column(db.Numeric(20, 4), nullable=False)  # Используем Decimal
+    amount = db.Column(FixedPoint(20, 4), nullable=False)  # Используем Decimal
     transaction_type = db.Column(db.String(20))  # deposit, withdrawal, transfer
-    price = db.Column(db.Numeric(12, 4), nullable=True)  # Сколько тратили злотых за 1 валюту
+    price = db.Column(FixedPoint(12, 4), nullable=True)  # Сколько тратили злотых за 1 валюту
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    final_pln_balance = db.Column(db.Numeric(20, 4), nullable=False)  # Баланс PLN после транзакции
-    final_currency_balance = db.Column(db.Numeric(20, 4), nullable=False)  # Баланс валюты после транзакции
+    final_pln_balance = db.Column(FixedPoint(20, 4), nullable=False)  # Баланс PLN после транзакции
+    final_currency_balance = db.Column(FixedPoint(20, 4), nullable=False)  # Баланс валюты после транзакции
 
     # Связи
     user = db.relationship('User', back_populates='transactions')
+
+    __table_args__ = (
+        # Курсорная пагинация истории: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+        db.Index('idx_transactions_user_timestamp', 'user_id', 'timestamp', 'id'),
+        # То же с фильтром по валюте
+        db.Index('idx_transactions_user_currency_timestamp', 'user_id', 'currency_code', 'timestamp', 'id'),
+    )
+
+class LimitOrder(db.Model):
+    """Лимитный ордер: покупка, когда ask <= limit_price, или продажа, когда bid >= limit_price"""
+    __tablename__ = "limit_orders"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    currency_code = db.Column(db.String(9), nullable=False)
+    side = db.Column(db.String(4), nullable=False)  # buy, sell
+    amount = db.Column(FixedPoint(20, 4), nullable=False)
+    limit_price = db.Column(FixedPoint(12, 4), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, executed, rejected, cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    executed_at = db.Column(db.DateTime, nullable=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=True)
+    error = db.Column(db.String(255), nullable=True)  # Почему ордер не исполнился (rejected)
+
+    __table_args__ = (
+        # Ордера пользователя по статусу: WHERE user_id = ? AND status = ? ORDER BY id DESC
+        db.Index('idx_limit_orders_user_status', 'user_id', 'status', 'id'),
+    )
+
+class PriceAlert(db.Model):
+    """Оповещение: срабатывает один раз, когда курс (bid или ask) пересекает target"""
+    __tablename__ = "price_alerts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    currency_code = db.Column(db.String(9), nullable=False)
+    price_type = db.Column(db.String(3), nullable=False, default='bid')  # bid, ask
+    direction = db.Column(db.String(5), nullable=False)  # above (курс >= target), below (курс <= target)
+    target = db.Column(FixedPoint(12, 4), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='active')  # active, triggered, cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    triggered_at = db.Column(db.DateTime, nullable=True)
+    triggered_price = db.Column(FixedPoint(12, 4), nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_price_alerts_user_status', 'user_id', 'status', 'id'),
+    )
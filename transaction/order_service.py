@@ -0,0 +1,298 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from marshmallow import ValidationError
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from application.extension import db
+from application.money import multiply, parse_amount, round_amount
+from currency.currency_service import get_latest_currencies_by_codes, get_latest_currency_by_code
+from transaction.models import Transaction
+from user.models import Wallet
+from user.wallet_service import bump_wallet_version
+
+BASE_CURRENCY = 'PLN'
+SIDES = ('buy', 'sell')
+MAX_BATCH_ORDERS = 100
+
+# Итог исполненного ордера: цена и балансы обоих кошельков после него
+OrderResult = namedtuple('OrderResult', [
+    'transaction_id', 'side', 'currency_code', 'amount', 'price', 'final_pln_balance', 'final_currency_balance'
+])
+
+
+class OrderError(Exception):
+    """Ордер не может быть исполнен; status — HTTP-код ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Запросы строятся один раз: на каждый ордер остается только подстановка параметров
+_wallet_row = (Wallet.user_id == bindparam('owner')) & (Wallet.currency_code == bindparam('code'))
+
+_DEBIT = update(Wallet) \
+    .where(_wallet_row, Wallet.balance >= bindparam('amount', type_=Wallet.balance.type)) \
+    .values(balance=Wallet.balance - bindparam('amount', type_=Wallet.balance.type)) \
+    .returning(Wallet.balance)
+
+_CREDIT = update(Wallet) \
+    .where(_wallet_row) \
+    .values(balance=Wallet.balance + bindparam('amount', type_=Wallet.balance.type)) \
+    .returning(Wallet.balance)
+
+# Пакет: изменение на delta, если баланс не меньше required (нужный запас для всех ног пакета)
+_ADJUST = update(Wallet) \
+    .where(_wallet_row, Wallet.balance >= bindparam('required', type_=Wallet.balance.type)) \
+    .values(balance=Wallet.balance + bindparam('delta', type_=Wallet.balance.type)) \
+    .returning(Wallet.balance)
+
+_upsert = sqlite_insert(Wallet).values(
+    user_id=bindparam('owner'), currency_code=bindparam('code'),
+    balance=bindparam('amount', type_=Wallet.balance.type)
+)
+_CREDIT_OR_CREATE = _upsert.on_conflict_do_update(
+    index_elements=[Wallet.user_id, Wallet.currency_code],
+    set_={'balance': Wallet.balance + _upsert.excluded.balance}
+).returning(Wallet.balance)
+
+# sort_by_parameter_order: id в RETURNING идут в порядке переданных строк (для пакетов)
+_INSERT_TRANSACTION = insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True)
+
+
+def _execute(stmt, params):
+    # Через соединение сессии, минуя ORM-обработку UPDATE/INSERT (synchronize_session и т.п.)
+    return db.session.connection().execute(stmt, params).scalar()
+
+
+def _debit(user_id, currency_code, amount):
+    """Списать amount, только если его хватает; вернуть новый баланс или None"""
+    return _execute(_DEBIT, {'owner': user_id, 'code': currency_code, 'amount': amount})
+
+
+def _credit(user_id, currency_code, amount, create=False):
+    """Зачислить amount; create=True — создать кошелек, если его нет. Вернуть новый баланс или None"""
+    stmt = _CREDIT_OR_CREATE if create else _CREDIT
+    return _execute(stmt, {'owner': user_id, 'code': currency_code, 'amount': amount})
+
+
+def _transaction_row(user_id, side, currency_code, quantity, price, pln_balance, currency_balance, timestamp):
+    return {
+        'user_id': user_id,
+        'currency_code': currency_code,
+        'amount': quantity,
+        'transaction_type': side,
+        'price': price,
+        'timestamp': timestamp,
+        'final_pln_balance': pln_balance,
+        'final_currency_balance': currency_balance
+    }
+
+
+def _wallet_exists(user_id, currency_code):
+    return db.session.execute(
+        select(Wallet.currency_code).where(Wallet.user_id == user_id, Wallet.currency_code == currency_code)
+    ).first() is not None
+
+
+def _insufficient(user_id, currency_code, message):
+    # Условное списание не нашло строку: кошелька нет или не хватает средств
+    if not _wallet_exists(user_id, currency_code):
+        return OrderError(f"{currency_code} wallet not found", 404)
+    return OrderError(message)
+
+
+def prepare_order(side, currency_code, amount, rate=None):
+    """Проверить ордер и посчитать цену и сумму в PLN (без обращения к кошелькам)"""
+    if side not in SIDES:
+        raise OrderError(f"Order side must be one of: {', '.join(SIDES)}")
+    if not currency_code or currency_code == BASE_CURRENCY:
+        raise OrderError("Invalid currency code")
+    try:
+        quantity = parse_amount(amount)
+    except ValueError as e:
+        raise OrderError(str(e))
+    if quantity <= 0:
+        raise OrderError("Amount must be positive")
+
+    if rate is None:
+        try:
+            rate = get_latest_currency_by_code(currency_code)
+        except ValidationError as e:
+            raise OrderError(e.messages[0])
+
+    # Покупаем по ask, продаем по bid
+    price = rate.ask if side == 'buy' else rate.bid
+    return quantity, price, multiply(quantity, price)
+
+
+def apply_order(user_id, side, currency_code, quantity, price, total, timestamp=None):
+    """Исполнить подготовленный ордер в текущей транзакции (без commit).
+
+    Каждое изменение баланса — один условный UPDATE ... RETURNING, поэтому
+    параллельные ордера не теряют обновлений и не уводят баланс в минус.
+    """
+    if side == 'buy':
+        pln_balance = _debit(user_id, BASE_CURRENCY, total)
+        if pln_balance is None:
+            raise _insufficient(user_id, BASE_CURRENCY, f"Insufficient {BASE_CURRENCY} balance")
+        currency_balance = _credit(user_id, currency_code, quantity, create=True)
+    else:
+        currency_balance = _debit(user_id, currency_code, quantity)
+        if currency_balance is None:
+            raise _insufficient(user_id, currency_code, "Insufficient currency balance")
+        pln_balance = _credit(user_id, BASE_CURRENCY, total)
+        if pln_balance is None:
+            raise OrderError(f"{BASE_CURRENCY} wallet not found", 404)
+
+    bump_wallet_version(user_id)
+    transaction_id = _execute(_INSERT_TRANSACTION, _transaction_row(
+        user_id, side, currency_code, quantity, price, pln_balance, currency_balance, timestamp or datetime.utcnow()
+    ))
+
+    return OrderResult(transaction_id, side, currency_code, quantity, price, pln_balance, currency_balance)
+
+
+def execute_order(user_id, side, currency_code, amount):
+    """Исполнить покупку/продажу одной короткой транзакцией"""
+    quantity, price, total = prepare_order(side, currency_code, amount)
+    try:
+        result = apply_order(user_id, side, currency_code, quantity, price, total)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result
+
+
+def _order_error(number, error):
+    # Номер ноги в сообщении, чтобы клиент видел, какой ордер пакета не прошел
+    return OrderError(f"Order {number}: {error}", error.status)
+
+
+def prepare_batch(orders):
+    """Проверить пакет ордеров [{side, currency_code, amount}] и посчитать ноги
+    [(side, currency_code, quantity, price, total)] по курсам из одного снимка"""
+    if not isinstance(orders, list) or not orders:
+        raise OrderError("Orders must be a non-empty list")
+    if len(orders) > MAX_BATCH_ORDERS:
+        raise OrderError(f"Batch is limited to {MAX_BATCH_ORDERS} orders")
+    for number, order in enumerate(orders, 1):
+        if not isinstance(order, dict) or not order.get('side') or not order.get('currency_code') \
+                or not order.get('amount'):
+            raise OrderError(f"Order {number}: Missing required fields")
+
+    rates = get_latest_currencies_by_codes({order['currency_code'] for order in orders})
+    legs = []
+    for number, order in enumerate(orders, 1):
+        try:
+            legs.append((order['side'], order['currency_code'], *prepare_order(
+                order['side'], order['currency_code'], order['amount'], rates.get(order['currency_code'])
+            )))
+        except OrderError as e:
+            raise _order_error(number, e)
+    return legs
+
+
+def plan_batch(legs, balances, numbered=True):
+    """Проверить ноги по очереди на балансах {code: balance} (в памяти, без записи).
+
+    Возвращает (delta, low, steps): суммарное изменение каждого кошелька,
+    самую глубокую просадку по ходу пакета и (изменение PLN, изменение валюты)
+    после каждой ноги. numbered=False — ошибка без номера ноги (одиночный ордер).
+    """
+    balances = dict(balances)
+    delta = defaultdict(int)
+    low = defaultdict(int)
+    steps = []
+    for number, (side, currency_code, quantity, price, total) in enumerate(legs, 1):
+        try:
+            if BASE_CURRENCY not in balances:
+                raise OrderError(f"{BASE_CURRENCY} wallet not found", 404)
+            if side == 'buy':
+                if balances[BASE_CURRENCY] < total:
+                    raise OrderError(f"Insufficient {BASE_CURRENCY} balance")
+                changes = ((BASE_CURRENCY, -total), (currency_code, quantity))
+            else:
+                if currency_code not in balances:
+                    raise OrderError(f"{currency_code} wallet not found", 404)
+                if balances[currency_code] < quantity:
+                    raise OrderError("Insufficient currency balance")
+                changes = ((currency_code, -quantity), (BASE_CURRENCY, total))
+        except OrderError as e:
+            raise _order_error(number, e) if numbered else e
+
+        for code, change in changes:
+            balances[code] = balances.get(code, 0) + change
+            delta[code] += change
+            low[code] = min(low[code], delta[code])
+        steps.append((delta[BASE_CURRENCY], delta[currency_code]))
+    return delta, low, steps
+
+
+def apply_batch(user_id, legs, numbered=True):
+    """Исполнить подготовленные ноги пакета в текущей транзакции (без commit).
+
+    Кошельки читаются один раз, весь пакет проверяется по балансам до записи.
+    Затем на каждый затронутый кошелек — один условный UPDATE на суммарное
+    изменение, все транзакции — одним вызовом INSERT. При OrderError часть
+    изменений уже может быть записана: вызывающий откатывает транзакцию.
+    numbered=False — ошибка без номера ноги, как в plan_batch.
+    """
+    balances = dict(db.session.execute(
+        select(Wallet.currency_code, Wallet.balance).where(Wallet.user_id == user_id)
+    ).all())
+    existing = set(balances)
+
+    # UPDATE пройдет, только если в БД баланс не меньше -low (запас на всю просадку пакета)
+    delta, low, steps = plan_batch(legs, balances, numbered)
+
+    # Фактический баланс до пакета: в БД он мог измениться после чтения
+    start = {}
+    for code in sorted(delta):
+        if code in existing:
+            balance = _execute(_ADJUST, {
+                'owner': user_id, 'code': code, 'delta': delta[code], 'required': -low[code]
+            })
+            if balance is None:
+                raise OrderError(f"Insufficient {code} balance")
+        else:
+            balance = _credit(user_id, code, delta[code], create=True)
+        start[code] = balance - delta[code]
+    bump_wallet_version(user_id)
+
+    timestamp = datetime.utcnow()
+    rows = []
+    for (side, currency_code, quantity, price, total), (pln_delta, currency_delta) in zip(legs, steps):
+        rows.append(_transaction_row(
+            user_id, side, currency_code, quantity, price,
+            # Баланс, посчитанный в Python, приводим к scale столбца, как у значений из БД
+            round_amount(start[BASE_CURRENCY] + pln_delta),
+            round_amount(start[currency_code] + currency_delta),
+            timestamp
+        ))
+    transaction_ids = list(db.session.connection().execute(_INSERT_TRANSACTION, rows).scalars())
+
+    # Сумму из запроса отдаем так же, как ее хранит Transaction.amount (AMOUNT_SCALE знаков)
+    return [
+        OrderResult(transaction_id, row['transaction_type'], row['currency_code'], round_amount(row['amount']),
+                    row['price'], row['final_pln_balance'], row['final_currency_balance'])
+        for transaction_id, row in zip(transaction_ids, rows)
+    ]
+
+
+def execute_batch(user_id, orders):
+    """Исполнить пакет ордеров [{side, currency_code, amount}] одной транзакцией: все или ничего.
+
+    Курсы берутся из одного снимка, дальше — apply_batch и один commit.
+    """
+    legs = prepare_batch(orders)
+    try:
+        results = apply_batch(user_id, legs)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return results
@@ -0,0 +1,432 @@
+"""Лимитные ордера и оповещения о курсе, проверяемые пакетом при новых курсах.
+
+Ожидающие ордера и активные оповещения лежат в памяти процесса в
+отсортированных по цене списках, по одному на (валюта, сторона). Новые
+курсы дают для каждого списка одну границу: все сработавшие заявки
+находятся двоичным поиском и снимаются одним срезом, без перебора всех
+заявок и без опроса /currency-rates клиентами.
+
+Сработавшие ордера исполняются так же, как ордера из API: в режиме
+WALLET_LEDGER — одной группой журнала (user.ledger.run_batch), без него —
+каждый своей короткой транзакцией через order_service.apply_batch.
+Ордер, которому не хватило средств, отклоняется, не мешая остальным.
+Индекс дочитывает новые заявки из БД по id, поэтому видит и созданные
+другими процессами; повторное исполнение исключено проверкой статуса
+pending в той же транзакции.
+
+Фоновая проверка выключена по умолчанию: ее включает PRICE_TRIGGERS=1
+в процессе, который обслуживает запросы (не в CLI-командах и бенчмарках).
+"""
+import bisect
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from marshmallow import ValidationError
+from sqlalchemy import bindparam, inspect, select, update
+
+from application.extension import db
+from application.money import parse_amount
+from currency.currency_service import get_latest_currency_by_code
+from currency.rate_cache import latest_rate_cache
+from transaction.models import LimitOrder, PriceAlert
+from transaction.order_service import SIDES, OrderError, apply_batch, prepare_order
+from user.ledger import _orders, run_batch
+
+PRICE_TYPES = ('bid', 'ask')
+DIRECTIONS = ('above', 'below')
+
+# Ожидающих ордеров и активных оповещений на пользователя, не больше
+MAX_PENDING_PER_USER = 100
+
+_FINISH_ORDER = update(LimitOrder).where(
+    LimitOrder.id == bindparam('order_id'), LimitOrder.status == 'pending'
+).values(
+    status=bindparam('outcome'),
+    executed_at=bindparam('finished_at'),
+    transaction_id=bindparam('transaction'),
+    error=bindparam('message')
+)
+
+_TRIGGER_ALERT = update(PriceAlert).where(
+    PriceAlert.id == bindparam('alert_id'), PriceAlert.status == 'active'
+).values(
+    status='triggered',
+    triggered_at=bindparam('triggered'),
+    triggered_price=bindparam('price', type_=PriceAlert.triggered_price.type)
+)
+
+
+class PriceLevels:
+    """Заявки одного списка, отсортированные по цене (при равной цене — в порядке добавления)"""
+
+    def __init__(self):
+        self.prices = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, price, entry_id):
+        position = bisect.bisect_right(self.prices, price)
+        self.prices.insert(position, price)
+        self.ids.insert(position, entry_id)
+
+    def discard(self, price, entry_id):
+        position = bisect.bisect_left(self.prices, price)
+        while position < len(self.prices) and self.prices[position] == price:
+            if self.ids[position] == entry_id:
+                del self.prices[position], self.ids[position]
+                return True
+            position += 1
+        return False
+
+    def pop_at_most(self, price):
+        """Снять все заявки с ценой <= price"""
+        position = bisect.bisect_right(self.prices, price)
+        ids = self.ids[:position]
+        del self.prices[:position], self.ids[:position]
+        return ids
+
+    def pop_at_least(self, price):
+        """Снять все заявки с ценой >= price"""
+        position = bisect.bisect_left(self.prices, price)
+        ids = self.ids[position:]
+        del self.prices[position:], self.ids[position:]
+        return ids
+
+
+def _order_key(currency_code, side):
+    return ('order', currency_code, side)
+
+
+def _alert_key(currency_code, price_type, direction):
+    return ('alert', currency_code, price_type, direction)
+
+
+class TriggerIndex:
+    """Ожидающие лимитные ордера и активные оповещения всех пользователей, по спискам цен"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels = defaultdict(PriceLevels)
+        # Самый большой id, уже прочитанный из БД: дальше дочитываются только новые заявки
+        self._loaded = {'order': 0, 'alert': 0}
+        self._ready = False
+
+    def load(self):
+        """Дочитать заявки, созданные после прошлой загрузки"""
+        if not self._ready:
+            # База может быть еще не создана (db.create_all после create_app)
+            if not inspect(db.engine).has_table(LimitOrder.__tablename__):
+                return
+            self._ready = True
+
+        orders = db.session.execute(
+            select(LimitOrder.id, LimitOrder.currency_code, LimitOrder.side, LimitOrder.limit_price)
+            .where(LimitOrder.id > self._loaded['order'], LimitOrder.status == 'pending')
+            .order_by(LimitOrder.id)
+        ).all()
+        alerts = db.session.execute(
+            select(PriceAlert.id, PriceAlert.currency_code, PriceAlert.price_type, PriceAlert.direction,
+                   PriceAlert.target)
+            .where(PriceAlert.id > self._loaded['alert'], PriceAlert.status == 'active')
+            .order_by(PriceAlert.id)
+        ).all()
+        # Чтение закончено: не держим транзакцию сессии открытой в фоновом потоке
+        db.session.rollback()
+
+        with self._lock:
+            for order_id, code, side, limit_price in orders:
+                if order_id > self._loaded['order']:
+                    self._levels[_order_key(code, side)].add(limit_price, order_id)
+                    self._loaded['order'] = order_id
+            for alert_id, code, price_type, direction, target in alerts:
+                if alert_id > self._loaded['alert']:
+                    self._levels[_alert_key(code, price_type, direction)].add(target, alert_id)
+                    self._loaded['alert'] = alert_id
+
+    def reset(self):
+        """Забыть все заявки: следующая загрузка прочитает ожидающие заново"""
+        with self._lock:
+            self._levels = defaultdict(PriceLevels)
+            self._loaded = {'order': 0, 'alert': 0}
+
+    def discard_order(self, order):
+        with self._lock:
+            self._levels[_order_key(order.currency_code, order.side)].discard(order.limit_price, order.id)
+
+    def discard_alert(self, alert):
+        with self._lock:
+            self._levels[_alert_key(alert.currency_code, alert.price_type, alert.direction)] \
+                .discard(alert.target, alert.id)
+
+    def pop_triggered(self, rates):
+        """Снять сработавшие заявки по курсам {code: RateSnapshot}.
+
+        Возвращает (id ордеров по возрастанию, [(id оповещения, цена срабатывания)]).
+        """
+        order_ids, alerts = [], []
+        with self._lock:
+            for key, levels in self._levels.items():
+                rate = rates.get(key[1])
+                if not levels or rate is None:
+                    continue
+                if key[0] == 'order':
+                    # Покупка — при ask <= limit_price, продажа — при bid >= limit_price
+                    if key[2] == 'buy':
+                        order_ids += levels.pop_at_least(rate.ask)
+                    else:
+                        order_ids += levels.pop_at_most(rate.bid)
+                else:
+                    price = rate.bid if key[2] == 'bid' else rate.ask
+                    if key[3] == 'above':
+                        triggered = levels.pop_at_most(price)
+                    else:
+                        triggered = levels.pop_at_least(price)
+                    alerts += [(alert_id, price) for alert_id in triggered]
+        return sorted(order_ids), alerts
+
+
+trigger_index = TriggerIndex()
+
+
+def _pending_orders(connection, order_ids):
+    return connection.execute(
+        select(LimitOrder.id, LimitOrder.user_id, LimitOrder.side, LimitOrder.currency_code, LimitOrder.amount)
+        .where(LimitOrder.id.in_(order_ids), LimitOrder.status == 'pending')
+        .order_by(LimitOrder.id)
+    ).all()
+
+
+def _execute_triggered(batch, order_ids, rates):
+    # Операция для run_batch: ордера исполняются по очереди id, каждый отдельно проверяется по балансам
+    rows = _pending_orders(batch.connection, order_ids)
+
+    outcomes = []
+    for order_id, user_id, side, currency_code, amount in rows:
+        try:
+            legs = [(side, currency_code, *prepare_order(side, currency_code, amount, rates.get(currency_code)))]
+            outcomes.append((order_id, 'executed', _orders(batch, user_id, legs, False)[0], None))
+        except OrderError as e:
+            outcomes.append((order_id, 'rejected', None, str(e)))
+
+    def finish(connection):
+        if outcomes:
+            connection.execute(_FINISH_ORDER, [
+                {
+                    'order_id': order_id, 'outcome': outcome, 'finished_at': batch.timestamp,
+                    'transaction': transaction and transaction['id'], 'message': message
+                }
+                for order_id, outcome, transaction, message in outcomes
+            ])
+
+    batch.after_flush.append(finish)
+    return outcomes
+
+
+def _execute_triggered_orders(order_ids, rates):
+    """Исполнить сработавшие ордера без журнала: каждый своей транзакцией через order_service"""
+    rows = _pending_orders(db.session.connection(), order_ids)
+    db.session.rollback()
+
+    outcomes = []
+    for order_id, user_id, side, currency_code, amount in rows:
+        try:
+            legs = [(side, currency_code, *prepare_order(side, currency_code, amount, rates.get(currency_code)))]
+            result = apply_batch(user_id, legs, False)[0]
+            outcome = (order_id, 'executed', result.transaction_id, None)
+        except OrderError as e:
+            db.session.rollback()
+            outcome = (order_id, 'rejected', None, str(e))
+
+        # Статус меняется в той же транзакции, что и балансы: ордер, который уже
+        # исполнил другой процесс, не пройдет проверку pending и откатится целиком
+        finished = db.session.connection().execute(_FINISH_ORDER, {
+            'order_id': order_id, 'outcome': outcome[1], 'finished_at': datetime.utcnow(),
+            'transaction': outcome[2], 'message': outcome[3]
+        }).rowcount
+        if finished:
+            db.session.commit()
+            outcomes.append(outcome)
+        else:
+            db.session.rollback()
+    return outcomes
+
+
+def evaluate_triggers(index=trigger_index):
+    """Проверить заявки по текущему снимку курсов и исполнить сработавшие.
+
+    Возвращает (исполнено ордеров, отклонено ордеров, сработало оповещений).
+    """
+    index.load()
+    rates = latest_rate_cache.all()
+    order_ids, alerts = index.pop_triggered(rates)
+
+    try:
+        if alerts:
+            triggered = datetime.utcnow()
+            db.session.connection().execute(_TRIGGER_ALERT, [
+                {'alert_id': alert_id, 'triggered': triggered, 'price': price} for alert_id, price in alerts
+            ])
+            db.session.commit()
+
+        if not order_ids:
+            outcomes = []
+        elif current_app.config.get('WALLET_LEDGER'):
+            outcomes = run_batch(_execute_triggered, order_ids, rates)
+        else:
+            outcomes = _execute_triggered_orders(order_ids, rates)
+    except Exception:
+        # Снятые из индекса заявки остались в БД необработанными: перечитаем их при следующей проверке
+        db.session.rollback()
+        index.reset()
+        raise
+
+    executed = sum(1 for outcome in outcomes if outcome[1] == 'executed')
+    return executed, len(outcomes) - executed, len(alerts)
+
+
+class PriceTriggerWatcher(threading.Thread):
+    """Фоновый поток: проверяет заявки раз в interval секунд и сразу после wake().
+
+    wake() вызывают RatesUpdateWatcher после загрузки новых курсов и
+    создание заявки (она может сработать по текущему курсу).
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(name='price-trigger-watcher', daemon=True)
+        self.app = app
+        self.interval = interval
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                with self.app.app_context():
+                    evaluate_triggers()
+            except Exception:
+                self.app.logger.exception("Failed to evaluate limit orders and price alerts")
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+def _wake():
+    watcher = current_app.extensions.get('price_trigger_watcher')
+    if watcher is not None:
+        watcher.wake()
+
+
+def _check_limit(model, user_id, status):
+    count = db.session.query(model.id).filter(model.user_id == user_id, model.status == status).count()
+    if count >= MAX_PENDING_PER_USER:
+        raise OrderError(f"At most {MAX_PENDING_PER_USER} {status} {model.__tablename__.replace('_', ' ')} allowed")
+
+
+def _parse_price(value, name):
+    try:
+        price = parse_amount(value)
+    except ValueError:
+        raise OrderError(f"Invalid {name}")
+    if price <= 0:
+        raise OrderError(f"{name.capitalize()} must be positive")
+    return price
+
+
+def _require_currency(currency_code):
+    try:
+        get_latest_currency_by_code(currency_code)
+    except ValidationError as e:
+        raise OrderError(e.messages[0], 404)
+
+
+def place_limit_order(user_id, side, currency_code, amount, limit_price):
+    """Создать лимитный ордер; средства не резервируются и проверяются при исполнении"""
+    if side not in SIDES:
+        raise OrderError(f"Order side must be one of: {', '.join(SIDES)}")
+    if not currency_code or currency_code == 'PLN':
+        raise OrderError("Invalid currency code")
+    amount = _parse_price(amount, 'amount')
+    limit_price = _parse_price(limit_price, 'limit price')
+    _require_currency(currency_code)
+    _check_limit(LimitOrder, user_id, 'pending')
+
+    order = LimitOrder(user_id=user_id, side=side, currency_code=currency_code, amount=amount,
+                       limit_price=limit_price)
+    db.session.add(order)
+    db.session.commit()
+    _wake()
+    return order
+
+
+def cancel_limit_order(user_id, order_id):
+    order = LimitOrder.query.filter_by(id=order_id, user_id=user_id).first()
+    if order is None:
+        raise OrderError("Limit order not found", 404)
+    # Условный UPDATE: ордер мог исполниться между чтением и отменой
+    cancelled = db.session.execute(
+        update(LimitOrder).where(LimitOrder.id == order_id, LimitOrder.status == 'pending')
+        .values(status='cancelled')
+    ).rowcount
+    db.session.commit()
+    if not cancelled:
+        raise OrderError(f"Limit order is already {db.session.get(LimitOrder, order_id).status}", 409)
+    trigger_index.discard_order(order)
+
+
+def create_price_alert(user_id, currency_code, direction, target, price_type='bid'):
+    """Создать оповещение: сработает, когда курс price_type станет >= (above) или <= (below) target"""
+    if direction not in DIRECTIONS:
+        raise OrderError(f"Direction must be one of: {', '.join(DIRECTIONS)}")
+    if price_type not in PRICE_TYPES:
+        raise OrderError(f"Price type must be one of: {', '.join(PRICE_TYPES)}")
+    if not currency_code:
+        raise OrderError("Invalid currency code")
+    target = _parse_price(target, 'target')
+    _require_currency(currency_code)
+    _check_limit(PriceAlert, user_id, 'active')
+
+    alert = PriceAlert(user_id=user_id, currency_code=currency_code, direction=direction, target=target,
+                       price_type=price_type)
+    db.session.add(alert)
+    db.session.commit()
+    _wake()
+    return alert
+
+
+def cancel_price_alert(user_id, alert_id):
+    alert = PriceAlert.query.filter_by(id=alert_id, user_id=user_id).first()
+    if alert is None:
+        raise OrderError("Price alert not found", 404)
+    cancelled = db.session.execute(
+        update(PriceAlert).where(PriceAlert.id == alert_id, PriceAlert.status == 'active')
+        .values(status='cancelled')
+    ).rowcount
+    db.session.commit()
+    if not cancelled:
+        raise OrderError(f"Price alert is already {db.session.get(PriceAlert, alert_id).status}", 409)
+    trigger_index.discard_alert(alert)
+
+
+def init_price_triggers(app):
+    """Запустить проверку лимитных ордеров и оповещений (только при PRICE_TRIGGERS=1)"""
+    app.config.setdefault('PRICE_TRIGGERS', os.environ.get('PRICE_TRIGGERS') == '1')
+    app.config.setdefault('PRICE_TRIGGER_CHECK_INTERVAL', 1.0)
+    if not app.config['PRICE_TRIGGERS']:
+        return None
+    watcher = PriceTriggerWatcher(app, app.config['PRICE_TRIGGER_CHECK_INTERVAL'])
+    watcher.start()
+    app.extensions['price_trigger_watcher'] = watcher
+    return watcher
@@ -1,41 +1,87 @@
 # application/routes/transaction_routes.py
-from decimal import Decimal
-
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.routing import ValidationError
+from werkzeug.exceptions import BadRequest
 
-from application.extension import db
+from application.serialization import RowSerializer, decimal_str, http_datetime, json_response
 from auth.jwt import token_required
-from currency.currency_service import get_latest_currency_by_code
-from transaction.models import Transaction
-from user.models import Wallet
-from user.wallet_service import WalletError
+from currency.routes import parse_date
+from transaction.history import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, transaction_page
+from transaction.models import LimitOrder, PriceAlert
+from transaction.order_service import OrderError, execute_batch, execute_order
+from transaction.price_triggers import (
+    cancel_limit_order, cancel_price_alert, create_price_alert, place_limit_order
+)
+from user.ledger import ledger_batch, ledger_order
 
 from scripts.trim_decimal import trim_decimal
 
 transaction_bp = Blueprint('transaction', __name__)
 
+# Decimal конвертируем в строку, timestamp — в формат HTTP-даты, как это делал jsonify
+transaction_serializer = RowSerializer([
+    ("id", "id", None),
+    ("currency_code", "currency_code", None),
+    ("amount", "amount", decimal_str),
+    ("transaction_type", "transaction_type", None),
+    ("timestamp", "timestamp", http_datetime),
+    ("price", "price", decimal_str),
+    ("final_pln_balance", "final_pln_balance", decimal_str),
+    ("final_currency_balance", "final_currency_balance", decimal_str),
+])
+
 @transaction_bp.route('/transactions', methods=['GET'])
 @token_required
 def get_transactions(user_id):
-    """Получить список всех транзакций пользователя"""
-
-    transactions = Transaction.query.filter_by(user_id=user_id).all()
-    transactions_list = [
-        {
-            "id": txn.id,
-            "currency_code": txn.currency_code,
-            "amount": str(txn.amount),  # Конвертируем Decimal в строку
-            "transaction_type": txn.transaction_type,
-            "timestamp": txn.timestamp,
-            "price": txn.price,
-            "final_pln_balance": str(txn.final_pln_balance),
-            "final_currency_balance": str(txn.final_currency_balance)
-        } for txn in transactions
-    ]
-
-    return jsonify(transactions_list), 200
+    """Получить транзакции пользователя (от новых к старым): все или страницу, если задан limit/cursor"""
+    # Без limit и cursor — вся история одним ответом, как до появления пагинации
+    limit = None
+    if 'limit' in request.args or 'cursor' in request.args:
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({"error": "Limit must be an integer"}), 400
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return jsonify({"error": f"Limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    try:
+        transactions, next_cursor = transaction_page(
+            user_id,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            currency_code=request.args.get('currency_code'),
+            transaction_type=request.args.get('type'),
+            start_date=parse_date(start_date) if start_date else None,
+            end_date=parse_date(end_date) if end_date else None
+        )
+    except BadRequest as e:
+        return jsonify({"error": e.description}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = json_response(transaction_serializer.dumps(transactions))
+    if next_cursor:
+        # Тело ответа — прежний список; следующая страница передается в заголовках
+        response.headers['X-Next-Cursor'] = next_cursor
+        next_url = url_for(request.endpoint, _external=False, **{**request.args.to_dict(), 'cursor': next_cursor})
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+def _execute_order(user_id, side, currency_code, amount):
+    # В режиме WALLET_LEDGER изменения пишутся в журнал с групповым commit (user/ledger.py)
+    if current_app.config.get('WALLET_LEDGER'):
+        return ledger_order(user_id, side, currency_code, amount)
+    return execute_order(user_id, side, currency_code, amount)
+
+
+def _execute_batch(user_id, orders):
+    if current_app.config.get('WALLET_LEDGER'):
+        return ledger_batch(user_id, orders)
+    return execute_batch(user_id, orders)
+
 
 @transaction_bp.route('/transaction/buy', methods=['POST'])
 @token_required
@@ -49,57 +95,17 @@ def buy_currency(user_id):
         return jsonify({"error": "Missing required fields"}), 400
 
     try:
-        # Получаем курс валюты
-        latest_currency = get_latest_currency_by_code(currency_code)
-
-        # Получаем кошелек в PLN (Польские злоты)
-        pln_wallet = Wallet.query.filter_by(user_id=user_id, currency_code="PLN").first()
-        if not pln_wallet:
-            return jsonify({"error": "PLN wallet not found"}), 404
-
-        # Получаем кошелек для выбранной валюты
-        currency_wallet = Wallet.query.filter_by(user_id=user_id, currency_code=currency_code).first()
-        if not currency_wallet:
-            # Если кошелек не существует, создаем его для валюты
-            currency_wallet = Wallet(user_id=user_id, currency_code=currency_code, balance=Decimal('0.00'))
-            db.session.add(currency_wallet)
-
-        print(latest_currency.ask)
-        # Используем курс валюты для вычислений
-        selling_price = Decimal(latest_currency.ask)  # Цена продажи валюты в PLN
-        total_cost = Decimal(amount) * selling_price  # Считаем стоимость покупки (в PLN)
-
-        if pln_wallet.balance < total_cost:
-            return jsonify({"error": "Insufficient PLN balance"}), 400
-
-        # Вычитаем PLN и увеличиваем валюту
-        pln_wallet.balance -= total_cost
-        currency_wallet.balance += Decimal(amount)
-
-        # Создаем транзакцию
-        transaction = Transaction(
-            user_id=user_id,
-            currency_code=currency_code,
-            amount=Decimal(amount),
-            transaction_type="buy",
-            price=Decimal(selling_price),  # Сколько тратили злотых за 1 валюту
-            final_pln_balance=pln_wallet.balance,
-            final_currency_balance=currency_wallet.balance
-        )
-        db.session.add(transaction)
-        db.session.commit()
-
-        return jsonify({
-            "message": f"Successfully bought {amount} {currency_code}",
-            "final_pln_balance": str(pln_wallet.balance),
-            "final_currency_balance": str(currency_wallet.balance),
-            "selling_price": str(selling_price)
-        }), 200
+        # Списание PLN, зачисление валюты и запись транзакции — одна короткая транзакция
+        order = _execute_order(user_id, 'buy', currency_code, amount)
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
 
-    except WalletError as e:
-        return jsonify({"error": str(e)}), 400
-    except ValidationError as e:
-        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "message": f"Successfully bought {amount} {currency_code}",
+        "final_pln_balance": str(order.final_pln_balance),
+        "final_currency_balance": str(order.final_currency_balance),
+        "selling_price": str(order.price)
+    }), 200
 
 
 @transaction_bp.route('/transaction/sell', methods=['POST'])
@@ -114,51 +120,145 @@ def sell_currency(user_id):
         return jsonify({"error": "Missing required fields"}), 400
 
     try:
-        # Получаем курс валюты
-        latest_currency = get_latest_currency_by_code(currency_code)
-
-        # Получаем кошелек в PLN (Польские злоты)
-        pln_wallet = Wallet.query.filter_by(user_id=user_id, currency_code="PLN").first()
-        if not pln_wallet:
-            return jsonify({"error": "PLN wallet not found"}), 404
-
-        # Получаем кошелек для выбранной валюты
-        currency_wallet = Wallet.query.filter_by(user_id=user_id, currency_code=currency_code).first()
-        if not currency_wallet:
-            return jsonify({"error": f"{currency_code} wallet not found"}), 404
-
-        # Используем курс валюты для вычислений
-        buying_price = Decimal(latest_currency.bid)  # Цена покупки валюты в PLN
-        total_income = Decimal(amount) * buying_price  # Считаем доход от продажи (в PLN)
-
-        if currency_wallet.balance < Decimal(amount):
-            return jsonify({"error": "Insufficient currency balance"}), 400
-
-        # Уменьшаем валюту и добавляем PLN
-        currency_wallet.balance -= Decimal(amount)
-        pln_wallet.balance += total_income
-
-        # Создаем транзакцию
-        transaction = Transaction(
-            user_id=user_id,
-            currency_code=currency_code,
-            amount=Decimal(amount),
-            transaction_type="sell",
-            price=Decimal(buying_price), # Сколько злотых получали за единицу валюты
-            final_pln_balance=pln_wallet.balance,
-            final_currency_balance=currency_wallet.balance
-        )
-        db.session.add(transaction)
-        db.session.commit()
+        order = _execute_order(user_id, 'sell', currency_code, amount)
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
 
-        return jsonify({
-            "message": f"Successfully sold {amount} {currency_code}",
-            "final_pln_balance": str(pln_wallet.balance),
-            "final_currency_balance": str(currency_wallet.balance),
-            "buying_price": str(buying_price)
-        }), 200
+    return jsonify({
+        "message": f"Successfully sold {amount} {currency_code}",
+        "final_pln_balance": str(order.final_pln_balance),
+        "final_currency_balance": str(order.final_currency_balance),
+        "buying_price": str(order.price)
+    }), 200
 
-    except WalletError as e:
-        return jsonify({"error": str(e)}), 400
-    except ValidationError as e:
-        return jsonify({"error": str(e)}), 400
\ No newline at end of file
+
+@transaction_bp.route('/transaction/batch', methods=['POST'])
+@token_required
+def batch_orders(user_id):
+    """Пакет покупок/продаж одной транзакцией: исполняются все ордера или ни один"""
+    data = request.get_json(silent=True) or {}
+
+    try:
+        orders = _execute_batch(user_id, data.get("orders"))
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return jsonify({
+        "message": f"Successfully executed {len(orders)} orders",
+        "orders": [{
+            "transaction_id": order.transaction_id,
+            "side": order.side,
+            "currency_code": order.currency_code,
+            "amount": str(order.amount),
+            "price": str(order.price),
+            "final_pln_balance": str(order.final_pln_balance),
+            "final_currency_balance": str(order.final_currency_balance)
+        } for order in orders]
+    }), 200
+
+
+def _limit_order_json(order):
+    return {
+        "id": order.id,
+        "side": order.side,
+        "currency_code": order.currency_code,
+        "amount": str(order.amount),
+        "limit_price": str(order.limit_price),
+        "status": order.status,
+        "created_at": order.created_at.isoformat(),
+        "executed_at": order.executed_at and order.executed_at.isoformat(),
+        "transaction_id": order.transaction_id,
+        "error": order.error
+    }
+
+
+def _price_alert_json(alert):
+    return {
+        "id": alert.id,
+        "currency_code": alert.currency_code,
+        "price_type": alert.price_type,
+        "direction": alert.direction,
+        "target": str(alert.target),
+        "status": alert.status,
+        "created_at": alert.created_at.isoformat(),
+        "triggered_at": alert.triggered_at and alert.triggered_at.isoformat(),
+        "triggered_price": alert.triggered_price and str(alert.triggered_price)
+    }
+
+
+@transaction_bp.route('/limit-orders', methods=['POST'])
+@token_required
+def create_limit_order(user_id):
+    """Лимитный ордер: исполнится сам, когда курс дойдет до limit_price"""
+    data = request.get_json(silent=True) or {}
+    if not data.get("side") or not data.get("currency_code") or not data.get("amount") \
+            or not data.get("limit_price"):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        order = place_limit_order(user_id, data["side"], data["currency_code"], data["amount"], data["limit_price"])
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return jsonify(_limit_order_json(order)), 201
+
+
+@transaction_bp.route('/limit-orders', methods=['GET'])
+@token_required
+def get_limit_orders(user_id):
+    """Лимитные ордера пользователя (от новых к старым), ?status= — фильтр по статусу"""
+    query = LimitOrder.query.filter(LimitOrder.user_id == user_id)
+    if request.args.get('status'):
+        query = query.filter(LimitOrder.status == request.args['status'])
+    orders = query.order_by(LimitOrder.id.desc()).limit(MAX_PAGE_SIZE).all()
+    return jsonify([_limit_order_json(order) for order in orders]), 200
+
+
+@transaction_bp.route('/limit-orders/<int:order_id>', methods=['DELETE'])
+@token_required
+def delete_limit_order(user_id, order_id):
+    """Отменить ожидающий лимитный ордер"""
+    try:
+        cancel_limit_order(user_id, order_id)
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"message": "Limit order cancelled"}), 200
+
+
+@transaction_bp.route('/alerts', methods=['POST'])
+@token_required
+def create_alert(user_id):
+    """Оповещение о курсе: сработает один раз, когда курс пересечет target"""
+    data = request.get_json(silent=True) or {}
+    if not data.get("currency_code") or not data.get("direction") or not data.get("target"):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        alert = create_price_alert(user_id, data["currency_code"], data["direction"], data["target"],
+                                   data.get("price_type", "bid"))
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return jsonify(_price_alert_json(alert)), 201
+
+
+@transaction_bp.route('/alerts', methods=['GET'])
+@token_required
+def get_alerts(user_id):
+    """Оповещения пользователя (от новых к старым), ?status=triggered — сработавшие"""
+    query = PriceAlert.query.filter(PriceAlert.user_id == user_id)
+    if request.args.get('status'):
+        query = query.filter(PriceAlert.status == request.args['status'])
+    alerts = query.order_by(PriceAlert.id.desc()).limit(MAX_PAGE_SIZE).all()
+    return jsonify([_price_alert_json(alert) for alert in alerts]), 200
+
+
+@transaction_bp.route('/alerts/<int:alert_id>', methods=['DELETE'])
+@token_required
+def delete_alert(user_id, alert_id):
+    """Отменить активное оповещение"""
+    try:
+        cancel_price_alert(user_id, alert_id)
+    except OrderError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"message": "Price alert cancelled"}), 200
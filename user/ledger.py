@@ -0,0 +1,385 @@
+"""Журнал изменений балансов с групповым commit (режим WALLET_LEDGER).
+
+Пополнения, снятия и ордера не меняют wallets.balance на месте: каждое
+изменение дописывается записью в wallet_ledger. Все записи пишет один
+поток LedgerWriter. Он собирает запросы, пришедшие за несколько
+миллисекунд (LEDGER_GROUP_COMMIT_WINDOW), и записывает их одной
+транзакцией: один fsync на всю группу вместо fsync на каждый запрос.
+Запрос получает ответ только после commit своей группы, поэтому
+подтвержденная операция так же надежна, как при отдельном commit.
+
+wallets.balance становится сверткой журнала. Она периодически догоняется
+(fold_ledger), а актуальный баланс — это свертка плюс несвернутый хвост
+(wallet_service.wallet_balance).
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, func, insert, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+from application.extension import db
+from application.money import parse_amount, round_amount
+from transaction.models import Transaction
+from transaction.order_service import (
+    BASE_CURRENCY, OrderError, OrderResult, _transaction_row, plan_batch, prepare_batch, prepare_order
+)
+from user.models import LedgerEntry, LedgerState, Wallet
+from user.wallet_service import LEDGER_STATE_ROW_ID, _BUMP_WALLET_VERSION, wallet_balance
+
+# Запросы, записываемые одной транзакцией, не больше
+LEDGER_MAX_BATCH = 256
+
+_READ_BALANCE = select(wallet_balance).where(
+    Wallet.user_id == bindparam('owner'), Wallet.currency_code == bindparam('code')
+)
+
+_CREATE_WALLET = sqlite_insert(Wallet).values(
+    user_id=bindparam('owner'), currency_code=bindparam('code'), balance=0
+).on_conflict_do_nothing()
+
+_INSERT_TRANSACTIONS = insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True)
+_INSERT_ENTRIES = insert(LedgerEntry)
+
+# Свертка на сыром SQL: работает с хранимыми значениями в любом режиме хранения денег
+_FOLD_WALLETS = text("""
+    UPDATE wallets SET balance = balance + (
+        SELECT SUM(delta) FROM wallet_ledger AS l
+        WHERE l.user_id = wallets.user_id AND l.currency_code = wallets.currency_code
+          AND l.id > :folded AND l.id <= :through
+    )
+    WHERE EXISTS (
+        SELECT 1 FROM wallet_ledger AS l
+        WHERE l.user_id = wallets.user_id AND l.currency_code = wallets.currency_code
+          AND l.id > :folded AND l.id <= :through
+    )
+""")
+
+_SAVE_STATE = sqlite_insert(LedgerState).values(
+    id=LEDGER_STATE_ROW_ID, folded_through=bindparam('through'), folded_at=bindparam('now')
+)
+_SAVE_STATE = _SAVE_STATE.on_conflict_do_update(
+    index_elements=[LedgerState.id],
+    set_={'folded_through': _SAVE_STATE.excluded.folded_through, 'folded_at': _SAVE_STATE.excluded.folded_at}
+)
+
+
+class _Batch:
+    """Изменения одной группы: балансы с учетом уже принятых операций, записи журнала и транзакции"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.timestamp = datetime.utcnow()
+        self.balances = {}  # (user_id, code) -> баланс или None (кошелька нет)
+        self.created = set()
+        self.entries = []
+        self.transactions = []
+        # Вызываются после записи группы, в той же транзакции (id транзакций уже известны)
+        self.after_flush = []
+
+    def balance(self, user_id, currency_code):
+        # user_id из токена — строка, из БД — число: ключ кошелька должен быть один
+        user_id = int(user_id)
+        key = (user_id, currency_code)
+        if key not in self.balances:
+            self.balances[key] = self.connection.execute(
+                _READ_BALANCE, {'owner': user_id, 'code': currency_code}
+            ).scalar()
+        return self.balances[key]
+
+    def apply(self, user_id, currency_code, delta, kind, transaction=None):
+        """Дописать изменение баланса; кошелек создается, если его нет"""
+        user_id = int(user_id)
+        key = (user_id, currency_code)
+        if self.balance(user_id, currency_code) is None:
+            self.created.add(key)
+            self.balances[key] = 0
+        self.balances[key] = round_amount(self.balances[key] + delta)
+        self.entries.append((user_id, currency_code, delta, kind, transaction))
+        return self.balances[key]
+
+    def flush(self):
+        if self.created:
+            self.connection.execute(_CREATE_WALLET, [
+                {'owner': user_id, 'code': code} for user_id, code in sorted(self.created)
+            ])
+        if self.transactions:
+            # sort_by_parameter_order: id в RETURNING идут в порядке строк self.transactions
+            transaction_ids = self.connection.execute(_INSERT_TRANSACTIONS, self.transactions).scalars()
+            for row, transaction_id in zip(self.transactions, transaction_ids):
+                row['id'] = transaction_id
+        if self.entries:
+            self.connection.execute(_INSERT_ENTRIES, [
+                {
+                    'user_id': user_id, 'currency_code': code, 'delta': delta, 'kind': kind,
+                    'transaction_id': transaction and transaction['id'], 'created_at': self.timestamp
+                }
+                for user_id, code, delta, kind, transaction in self.entries
+            ])
+            self.connection.execute(_BUMP_WALLET_VERSION, [
+                {'owner': user_id} for user_id in sorted({entry[0] for entry in self.entries})
+            ])
+        for callback in self.after_flush:
+            callback(self.connection)
+
+
+# Операции проверяют все условия до первого изменения группы:
+# отклоненная операция не оставляет следов в общей транзакции
+
+def _deposit(batch, user_id, currency_code, amount):
+    return batch.apply(user_id, currency_code, amount, 'deposit')
+
+
+def _withdraw(batch, user_id, currency_code, amount):
+    balance = batch.balance(user_id, currency_code)
+    if balance is None:
+        raise OrderError("Wallet not found", 404)
+    if balance < amount:
+        raise OrderError("Insufficient balance")
+    return batch.apply(user_id, currency_code, -amount, 'withdraw')
+
+
+def _orders(batch, user_id, legs, numbered):
+    codes = {BASE_CURRENCY} | {leg[1] for leg in legs}
+    balances = {code: batch.balance(user_id, code) for code in codes}
+    plan_batch(legs, {code: balance for code, balance in balances.items() if balance is not None}, numbered)
+
+    results = []
+    for side, currency_code, quantity, price, total in legs:
+        row = _transaction_row(user_id, side, currency_code, quantity, price, None, None, batch.timestamp)
+        if side == 'buy':
+            changes = ((BASE_CURRENCY, -total), (currency_code, quantity))
+        else:
+            changes = ((currency_code, -quantity), (BASE_CURRENCY, total))
+        for code, change in changes:
+            batch.apply(user_id, code, change, side, row)
+        row['final_pln_balance'] = batch.balance(user_id, BASE_CURRENCY)
+        row['final_currency_balance'] = batch.balance(user_id, currency_code)
+        batch.transactions.append(row)
+        results.append(row)
+    return results
+
+
+def _order_result(row):
+    # Сумму из запроса отдаем так же, как ее хранит Transaction.amount (как в execute_batch)
+    return OrderResult(row['id'], row['transaction_type'], row['currency_code'], round_amount(row['amount']),
+                       row['price'], row['final_pln_balance'], row['final_currency_balance'])
+
+
+class LedgerWriter(threading.Thread):
+    """Фоновый поток, который записывает операции группами, по одному commit на группу.
+
+    Запрос ставит операцию в очередь и ждет ее Future. Поток берет первую
+    операцию, ждет еще не дольше window секунд (или до max_batch операций)
+    и исполняет всю группу в одной транзакции BEGIN IMMEDIATE. Результат
+    каждой операции (или ее OrderError) отдается только после commit.
+    """
+
+    def __init__(self, app, window, max_batch, fold_interval, fold_entries):
+        super().__init__(name='ledger-writer', daemon=True)
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.fold_interval = fold_interval
+        self.fold_entries = fold_entries
+        self.commits = 0
+        self.operations = 0
+        self.folds = 0
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._unfolded = 0
+        self._folded_at = time.monotonic()
+
+    def submit(self, operation, *args):
+        """Поставить операцию в очередь и дождаться ее результата (после commit группы)"""
+        if not self.is_alive():
+            raise OrderError("Ledger writer is not running", 503)
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future.result()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                items = [self._queue.get(timeout=min(self.fold_interval, 0.5))]
+            except queue.Empty:
+                self._maybe_fold()
+                continue
+
+            deadline = time.monotonic() + self.window
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            self._commit(items)
+            self._maybe_fold()
+
+    def _commit(self, items):
+        try:
+            results = self._write(items)
+        except Exception as e:
+            if len(items) > 1:
+                # Группа не записалась целиком: пробуем операции по одной, чтобы сбой одной не задел остальные
+                for item in items:
+                    self._commit([item])
+                return
+            if isinstance(e, OperationalError):
+                # Обычно "database is locked": запись другого процесса не отпустила блокировку
+                e = OrderError("Database is busy, try again", 503)
+            else:
+                self.app.logger.exception("Ledger write failed")
+            results = [e]
+
+        for (_, _, future), result in zip(items, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _write(self, items):
+        with self.app.app_context(), db.engine.connect() as connection:
+            # Блокировка записи сразу: чтение балансов и запись группы не разделены чужим commit
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+            batch = _Batch(connection)
+            results = []
+            for operation, args, _ in items:
+                try:
+                    results.append(operation(batch, *args))
+                except OrderError as e:
+                    results.append(e)
+            batch.flush()
+            connection.commit()
+
+        self.commits += 1
+        self.operations += len(items)
+        self._unfolded += len(batch.entries)
+        return results
+
+    def _maybe_fold(self):
+        if not self._unfolded:
+            return
+        if self._unfolded < self.fold_entries and time.monotonic() - self._folded_at < self.fold_interval:
+            return
+        try:
+            with self.app.app_context():
+                fold_ledger()
+            self.folds += 1
+            self._unfolded = 0
+        except Exception:
+            # Не страшно: хвост журнала учитывается при чтении, свернем в следующий раз
+            self.app.logger.exception("Failed to fold wallet ledger")
+        self._folded_at = time.monotonic()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        return {'commits': self.commits, 'operations': self.operations, 'folds': self.folds}
+
+
+def _folded_through(connection):
+    return connection.execute(
+        select(LedgerState.folded_through).where(LedgerState.id == LEDGER_STATE_ROW_ID)
+    ).scalar() or 0
+
+
+def _fold(connection):
+    # Без commit: вызывающий уже держит блокировку записи
+    folded = _folded_through(connection)
+    through = connection.execute(select(func.max(LedgerEntry.id))).scalar() or 0
+    if through <= folded:
+        return 0
+
+    entries = connection.execute(
+        select(func.count()).select_from(LedgerEntry).where(LedgerEntry.id > folded)
+    ).scalar()
+    connection.execute(_FOLD_WALLETS, {'folded': folded, 'through': through})
+    connection.execute(_SAVE_STATE, {'through': through, 'now': datetime.utcnow()})
+    return entries
+
+
+def fold_ledger():
+    """Свернуть несвернутые записи журнала в wallets.balance; вернуть число записей"""
+    with db.engine.connect() as connection:
+        # Сначала обычное чтение: блокировку записи на всю БД берем, только если есть что сворачивать
+        pending = connection.execute(
+            select(LedgerEntry.id).where(LedgerEntry.id > _folded_through(connection)).limit(1)
+        ).first()
+        connection.rollback()
+        if pending is None:
+            return 0
+
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        entries = _fold(connection)
+        connection.commit()
+    return entries
+
+
+def _writer():
+    return current_app.extensions['ledger_writer']
+
+
+def run_batch(operation, *args):
+    """Исполнить operation(batch, *args) в группе LedgerWriter и вернуть ее результат после commit"""
+    return _writer().submit(operation, *args)
+
+
+def ledger_deposit(user_id, currency_code, amount):
+    """Пополнить кошелек (создается, если его нет) через журнал; вернуть новый баланс"""
+    return _writer().submit(_deposit, user_id, currency_code, parse_amount(amount))
+
+
+def ledger_withdraw(user_id, currency_code, amount):
+    """Снять средства через журнал; вернуть новый баланс"""
+    return _writer().submit(_withdraw, user_id, currency_code, parse_amount(amount))
+
+
+def ledger_order(user_id, side, currency_code, amount):
+    """Исполнить покупку/продажу через журнал (как execute_order)"""
+    legs = [(side, currency_code, *prepare_order(side, currency_code, amount))]
+    return _order_result(_writer().submit(_orders, user_id, legs, False)[0])
+
+
+def ledger_batch(user_id, orders):
+    """Исполнить пакет ордеров через журнал, все или ничего (как execute_batch)"""
+    rows = _writer().submit(_orders, user_id, prepare_batch(orders), True)
+    return [_order_result(row) for row in rows]
+
+
+def init_ledger(app):
+    """Запустить LedgerWriter, если включен режим WALLET_LEDGER.
+
+    Без него остаток журнала от прежнего запуска в этом режиме сворачивается
+    сразу: прямые UPDATE кошельков рассчитывают на актуальный wallets.balance.
+    Если остатка нет, запуск только читает журнал и не блокирует БД.
+    """
+    app.config.setdefault('WALLET_LEDGER', os.environ.get('WALLET_LEDGER') == '1')
+    app.config.setdefault('LEDGER_GROUP_COMMIT_WINDOW', 0.002)
+    app.config.setdefault('LEDGER_MAX_BATCH', LEDGER_MAX_BATCH)
+    app.config.setdefault('LEDGER_FOLD_INTERVAL', 5.0)
+    app.config.setdefault('LEDGER_FOLD_ENTRIES', 10000)
+
+    if not app.config['WALLET_LEDGER']:
+        with app.app_context():
+            if inspect(db.engine).has_table(LedgerEntry.__tablename__):
+                fold_ledger()
+        return None
+
+    writer = LedgerWriter(
+        app,
+        app.config['LEDGER_GROUP_COMMIT_WINDOW'],
+        app.config['LEDGER_MAX_BATCH'],
+        app.config['LEDGER_FOLD_INTERVAL'],
+        app.config['LEDGER_FOLD_ENTRIES']
+    )
+    writer.start()
+    app.extensions['ledger_writer'] = writer
+    return writer
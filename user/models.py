@@ -1,9 +1,9 @@
+from datetime import datetime
 from decimal import Decimal
 
 from passlib.hash import bcrypt
-from sqlalchemy import Numeric
-
 from application.extension import db
+from application.money import FixedPoint, parse_amount
 
 
 class User(db.Model):
@@ -50,15 +50,12 @@ class Wallet(db.Model):
     __tablename__ = "wallets"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
     currency_code = db.Column(db.String(9), primary_key=True)
-    balance = db.Column(Numeric(precision=20, scale=4), default=Decimal('0.00'), server_default='0.0000')
+    balance = db.Column(FixedPoint(precision=20, scale=4), default=Decimal('0.00'), server_default='0.0000')
     user = db.relationship('User', back_populates='wallet')
 
     def deposit(self, amount):
         """Пополнение кошелька"""
-        try:
-            amount = Decimal(amount)
-        except (ValueError, TypeError):
-            raise ValueError("Invalid amount format")
+        amount = parse_amount(amount)
 
         if amount <= 0:
             raise ValueError("Amount must be positive")
@@ -67,10 +64,7 @@ class Wallet(db.Model):
 
     def withdraw(self, amount):
         """Снятие средств"""
-        try:
-            amount = Decimal(amount)
-        except (ValueError, TypeError):
-            raise ValueError("Invalid amount format")
+        amount = parse_amount(amount)
 
         if amount <= 0:
             raise ValueError("Amount must be positive")
@@ -78,3 +72,35 @@ class Wallet(db.Model):
             raise ValueError("Insufficient balance")
 
         self.balance -= amount
+
+class WalletVersion(db.Model):
+    """Номер версии кошельков пользователя: увеличивается при каждом изменении балансов"""
+    __tablename__ = "wallet_versions"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class LedgerEntry(db.Model):
+    """Журнал изменений балансов (режим WALLET_LEDGER): записи только дописываются"""
+    __tablename__ = "wallet_ledger"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    currency_code = db.Column(db.String(9), nullable=False)
+    delta = db.Column(FixedPoint(20, 4), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # deposit, withdraw, buy, sell
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Несвернутый хвост журнала по кошельку: WHERE user_id = ? AND currency_code = ? AND id > ?
+        db.Index('idx_wallet_ledger_wallet', 'user_id', 'currency_code', 'id'),
+    )
+
+class LedgerState(db.Model):
+    """До какой записи журнала (включительно) изменения уже свернуты в wallets.balance (одна строка)"""
+    __tablename__ = "wallet_ledger_state"
+
+    id = db.Column(db.Integer, primary_key=True)
+    folded_through = db.Column(db.Integer, nullable=False, default=0)
+    folded_at = db.Column(db.DateTime, default=datetime.utcnow)
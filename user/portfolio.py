@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import BigInteger, Numeric, bindparam, func, select, type_coerce
+
+from application.extension import db
+from application.money import (
+    AMOUNT_SCALE, RATE_SCALE, from_units, integer_storage, multiply, round_amount
+)
+from application.serialization import dumps
+from currency.models import LatestCurrencyRate
+from currency.rate_cache import latest_rate_cache
+from transaction.models import Transaction
+from user.models import Wallet
+from user.wallet_service import read_wallet_version, wallet_balance
+
+BASE_CURRENCY = 'PLN'
+
+# Все кошельки пользователя с последним курсом своей валюты — один запрос
+_POSITIONS = select(
+    Wallet.currency_code,
+    wallet_balance,
+    LatestCurrencyRate.effective_date,
+    LatestCurrencyRate.bid,
+    LatestCurrencyRate.ask
+).outerjoin(
+    LatestCurrencyRate, LatestCurrencyRate.code == Wallet.currency_code
+).where(
+    Wallet.user_id == bindparam('owner')
+).order_by(Wallet.currency_code)
+
+
+def _cost_column():
+    # SUM(amount * price): в режиме 'integer' это целое число единиц
+    # 10**-(AMOUNT_SCALE + RATE_SCALE), читаем его без потери точности
+    product = func.sum(Transaction.amount * Transaction.price)
+    return type_coerce(product, BigInteger() if integer_storage() else Numeric(scale=AMOUNT_SCALE + RATE_SCALE))
+
+
+def _purchases(user_id):
+    """{code: (куплено всего, потрачено PLN)} по всем покупкам пользователя"""
+    rows = db.session.execute(
+        select(Transaction.currency_code, func.sum(Transaction.amount), _cost_column())
+        .where(Transaction.user_id == user_id, Transaction.transaction_type == 'buy')
+        .group_by(Transaction.currency_code)
+    ).all()
+
+    purchases = {}
+    for code, bought, cost in rows:
+        if integer_storage():
+            cost = from_units(cost, AMOUNT_SCALE + RATE_SCALE)
+        purchases[code] = (bought, cost)
+    return purchases
+
+
+def _value(amount):
+    return None if amount is None else str(round_amount(amount))
+
+
+def value_portfolio(user_id):
+    """Стоимость всех кошельков пользователя в PLN по bid и ask и нереализованный P&L.
+
+    Себестоимость — средневзвешенная цена всех покупок валюты, P&L — разница
+    между стоимостью остатка по bid (сколько дадут при продаже) и его себестоимостью.
+    """
+    rows = db.session.connection().execute(_POSITIONS, {'owner': user_id}).all()
+    purchases = _purchases(user_id)
+
+    positions = []
+    totals = {'value_bid': 0, 'value_ask': 0, 'cost_basis': 0, 'unrealized_pnl': 0}
+    for code, balance, rate_date, bid, ask in rows:
+        position = {
+            'currency_code': code,
+            'balance': str(balance),
+            'rate_date': None if rate_date is None else rate_date.isoformat(),
+            'bid': None if bid is None else str(bid),
+            'ask': None if ask is None else str(ask),
+            'value_bid': None,
+            'value_ask': None,
+            'average_price': None,
+            'cost_basis': None,
+            'unrealized_pnl': None,
+        }
+        positions.append(position)
+
+        if code == BASE_CURRENCY:
+            value_bid = value_ask = balance
+        elif bid is not None and ask is not None:
+            value_bid, value_ask = multiply(balance, bid), multiply(balance, ask)
+        else:
+            # Курса нет: в итоги такую позицию не включаем
+            continue
+        position['value_bid'], position['value_ask'] = _value(value_bid), _value(value_ask)
+        totals['value_bid'] += value_bid
+        totals['value_ask'] += value_ask
+
+        bought, cost = purchases.get(code, (None, None))
+        if bought:
+            average_price = cost / bought
+            cost_basis = multiply(balance, average_price)
+            position['average_price'] = str(round_amount(average_price, RATE_SCALE))
+            position['cost_basis'] = _value(cost_basis)
+            position['unrealized_pnl'] = _value(value_bid - cost_basis)
+            totals['cost_basis'] += cost_basis
+            totals['unrealized_pnl'] += value_bid - cost_basis
+
+    return {
+        'base_currency': BASE_CURRENCY,
+        'positions': positions,
+        **{f'total_{key}': _value(value) for key, value in totals.items()},
+    }
+
+
+class PortfolioCache:
+    """Готовый JSON оценки портфеля по пользователям.
+
+    Запись действительна, пока не изменились ни поколение курсов, ни версия
+    кошельков пользователя (wallet_versions), поэтому повторный запрос без
+    сделок и новых курсов стоит одного чтения версии по первичному ключу.
+    """
+
+    def __init__(self, max_users=10000):
+        self._lock = threading.Lock()
+        # user_id -> ((поколение курсов, версия кошельков), JSON bytes)
+        self._entries = OrderedDict()
+        self.max_users = max_users
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        key = (latest_rate_cache.generation, read_wallet_version(user_id))
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+
+        body = dumps(value_portfolio(user_id))
+        with self._lock:
+            self.misses += 1
+            self._entries[user_id] = (key, body)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'users': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+portfolio_cache = PortfolioCache()
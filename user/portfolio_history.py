@@ -0,0 +1,168 @@
+"""История стоимости портфеля по дням, восстановленная из журнала транзакций.
+
+Остатки берутся из final_pln_balance/final_currency_balance транзакций
+(на конец каждого дня, когда были сделки), курсы — из истории currency_rates.
+И остатки, и курсы продлеваются на дни без данных (forward-fill) через
+np.searchsorted по массивам дат, поэтому график за 5 лет считается
+за миллисекунды. Пополнения и снятия в журнал не пишутся: они попадают
+в историю с ближайшей следующей сделкой.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from application.extension import db
+from currency.analytics import rate_history_cache
+from transaction.models import Transaction
+from user.wallet_service import read_wallet_version
+
+BASE_CURRENCY = 'PLN'
+PRICES = ('bid', 'ask', 'mid')
+
+# Самый длинный запрашиваемый период, дней
+MAX_DAYS = 20 * 366
+
+
+def _last_per_day(days, values):
+    """Последнее значение каждого дня из упорядоченных по времени массивов"""
+    last = np.r_[days[1:] != days[:-1], True] if len(days) else np.array([], dtype=bool)
+    return days[last], values[last]
+
+
+def _daily_holdings(rows):
+    """Строки (timestamp, currency_code, final_pln_balance, final_currency_balance)
+    -> {code: (дни, остаток на конец дня)}"""
+    if not rows:
+        return {}
+    timestamps, codes, pln, balances = zip(*rows)
+    days = np.array(timestamps, dtype='datetime64[D]')
+    codes = np.array(codes)
+    pln = np.fromiter(pln, dtype=np.float64, count=len(rows))
+    balances = np.fromiter(balances, dtype=np.float64, count=len(rows))
+
+    holdings = {BASE_CURRENCY: _last_per_day(days, pln)}
+    for code in np.unique(codes):
+        mask = codes == code
+        holdings[str(code)] = _last_per_day(days[mask], balances[mask])
+    return holdings
+
+
+class HoldingsHistoryCache:
+    """Дневные остатки по валютам для каждого пользователя, дополняемые инкрементально.
+
+    Запись сверяется с версией кошельков пользователя: после новых сделок
+    дочитываются только транзакции с начала последнего известного дня
+    (этот день пересчитывается целиком, более ранние не трогаются).
+    """
+
+    def __init__(self, max_users=10000):
+        self._lock = threading.Lock()
+        # user_id -> (версия кошельков, {code: (дни, остатки)}); давно не запрошенные вытесняются
+        self._holdings = OrderedDict()
+        self.max_users = max_users
+        self.full_loads = 0
+        self.incremental_loads = 0
+
+    def get(self, user_id):
+        version = read_wallet_version(user_id)
+        cached = self._holdings.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._holdings.get(user_id)
+            if cached is None:
+                holdings = _daily_holdings(self._query(user_id))
+                self.full_loads += 1
+            elif cached[0] != version:
+                holdings = self._extend(user_id, cached[1])
+                self.incremental_loads += 1
+            else:
+                return cached[1]
+
+            self._holdings[user_id] = (version, holdings)
+            self._holdings.move_to_end(user_id)
+            while len(self._holdings) > self.max_users:
+                self._holdings.popitem(last=False)
+            return holdings
+
+    def clear(self):
+        with self._lock:
+            self._holdings = OrderedDict()
+
+    @staticmethod
+    def _query(user_id, since=None):
+        stmt = select(
+            Transaction.timestamp,
+            Transaction.currency_code,
+            Transaction.final_pln_balance,
+            Transaction.final_currency_balance
+        ).where(Transaction.user_id == user_id)
+        if since is not None:
+            stmt = stmt.where(Transaction.timestamp >= since)
+        # Поиск по idx_transactions_user_timestamp
+        return db.session.execute(stmt.order_by(Transaction.timestamp, Transaction.id)).all()
+
+    def _extend(self, user_id, holdings):
+        if not holdings:
+            return _daily_holdings(self._query(user_id))
+
+        last_day = holdings[BASE_CURRENCY][0][-1]
+        new = _daily_holdings(self._query(user_id, since=datetime.combine(last_day.astype(object), datetime.min.time())))
+
+        extended = {}
+        for code in holdings.keys() | new.keys():
+            days, balances = holdings.get(code, (np.array([], dtype='datetime64[D]'), np.array([])))
+            keep = days < last_day
+            new_days, new_balances = new.get(code, (np.array([], dtype='datetime64[D]'), np.array([])))
+            extended[code] = (np.concatenate([days[keep], new_days]), np.concatenate([balances[keep], new_balances]))
+        return extended
+
+
+holdings_history_cache = HoldingsHistoryCache()
+
+
+def _as_of(dates, values, days, fill):
+    """Значение на каждый день из days: последнее с датой <= дня (forward-fill), иначе fill"""
+    index = np.searchsorted(dates, days, side='right') - 1
+    if len(values) == 0:
+        return np.full(len(days), fill)
+    return np.where(index >= 0, values[np.maximum(index, 0)], fill)
+
+
+def portfolio_value_series(user_id, start_date=None, end_date=None, price='bid'):
+    """Стоимость портфеля в PLN на каждый календарный день из [start_date, end_date].
+
+    По умолчанию — с дня первой сделки по сегодня. Дни, когда валюта уже
+    была в портфеле, а курса для нее еще нет, дают None.
+    """
+    holdings = holdings_history_cache.get(user_id)
+    if not holdings:
+        return {'dates': [], 'value': []}
+
+    start = np.datetime64(start_date, 'D') if start_date else holdings[BASE_CURRENCY][0][0]
+    end = np.datetime64(end_date or datetime.utcnow().date(), 'D')
+    days = np.arange(start, end + 1, dtype='datetime64[D]')
+
+    total = np.zeros(len(days))
+    for code, (dates, balances) in holdings.items():
+        held = _as_of(dates, balances, days, 0.0)
+        if code == BASE_CURRENCY:
+            total += held
+            continue
+
+        rate_dates, bid, ask = rate_history_cache.get(code)
+        prices = {'bid': bid, 'ask': ask}.get(price)
+        if prices is None:
+            prices = (bid + ask) / 2
+        value = held * _as_of(rate_dates, prices, days, np.nan)
+        total += np.where(held == 0, 0.0, value)
+
+    rounded = np.round(total, 4)
+    return {
+        'dates': np.datetime_as_string(days).tolist(),
+        'value': [None if np.isnan(value) else value for value in rounded.tolist()],
+    }
@@ -1,14 +1,22 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from decimal import Decimal
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from werkzeug.exceptions import BadRequest
 
 from application.extension import db
+from application.serialization import dumps, json_response
 from auth.jwt import generate_jwt, decode_jwt, token_required
-from currency.models import CurrencyRate
+from currency.models import LatestCurrencyRate
+from currency.routes import parse_date
+from transaction.order_service import OrderError
+from user.ledger import ledger_deposit, ledger_withdraw
 from user.models import User, Wallet, UserFavoriteCurrency
+from user.portfolio import portfolio_cache
+from user.portfolio_history import BASE_CURRENCY, MAX_DAYS, PRICES, portfolio_value_series
 from user.schema import UserSchema, UserLoginSchema
+from user.wallet_service import bump_wallet_version, wallet_balance
 
 user_bp = Blueprint('user', __name__)
 user_schema = UserSchema()  # Создаем экземпляр схемы
@@ -40,9 +48,9 @@ def register():
     new_user.password = data['password']  # Используем setter для хеширования пароля
 
     db.session.add(new_user)
-    db.session.commit()
+    db.session.flush()  # id пользователя нужен кошельку
 
-    # Создание кошелька для нового пользователя
+    # Кошелек создается в той же транзакции: один commit на регистрацию
     new_wallet = Wallet(user_id=new_user.id, currency_code="PLN", balance=Decimal('0.00'))
     db.session.add(new_wallet)
     db.session.commit()
@@ -99,6 +107,16 @@ def deposit(user_id):
     if not isinstance(currency_code, str) or len(currency_code) < 3:
         return jsonify({"error": "Invalid currency code"}), 400
 
+    if current_app.config.get('WALLET_LEDGER'):
+        # Запись в журнал; ответ — после группового commit (user/ledger.py)
+        try:
+            ledger_deposit(user_id, currency_code, amount)
+        except OrderError as e:
+            return jsonify({"error": str(e)}), e.status
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"message": f"Successfully deposited {amount} {currency_code}"}), 200
+
     try:
         # Только PLN
         wallet = Wallet.query.filter_by(user_id=user_id, currency_code=currency_code).first()
@@ -107,6 +125,7 @@ def deposit(user_id):
             db.session.add(wallet)
 
         wallet.deposit(amount)
+        bump_wallet_version(user_id)
         db.session.commit()
 
         return jsonify({"message": f"Successfully deposited {amount} {currency_code}"}), 200
@@ -129,6 +148,14 @@ def withdraw(user_id):
     if not isinstance(currency_code, str) or len(currency_code) < 3:
         return jsonify({"error": "Invalid currency code"}), 400
 
+    if current_app.config.get('WALLET_LEDGER'):
+        try:
+            ledger_withdraw(user_id, currency_code, amount)
+        except OrderError as e:
+            return jsonify({"error": str(e)}), e.status
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"message": f"Successfully withdrew {amount} {currency_code}"}), 200
 
     try:
         wallet = Wallet.query.filter_by(user_id=user_id, currency_code=currency_code).first()
@@ -136,6 +163,7 @@ def withdraw(user_id):
             return jsonify({"error": "Wallet not found"}), 404
 
         wallet.withdraw(amount)
+        bump_wallet_version(user_id)
         db.session.commit()
 
         return jsonify({"message": f"Successfully withdrew {amount} {currency_code}"}), 200
@@ -148,7 +176,8 @@ def withdraw(user_id):
 def get_wallet(user_id):
     """Получить информацию о кошельке пользователя (все валюты)"""
 
-    wallets = Wallet.query.filter_by(user_id=user_id).all()
+    # wallet_balance учитывает еще не свернутые записи журнала (режим WALLET_LEDGER)
+    wallets = db.session.query(Wallet.currency_code, wallet_balance).filter(Wallet.user_id == user_id).all()
     if not wallets:
         return jsonify({"error": "Wallets not found"}), 404
 
@@ -158,9 +187,37 @@ def get_wallet(user_id):
     #     "balance": str(wallet.balance)  # Преобразуем Decimal в строку для точности
     # } for wallet in wallets]
 
-    wallet_data = {str(wallet.currency_code): str(wallet.balance) for wallet in wallets}
+    wallet_data = {str(currency_code): str(balance) for currency_code, balance in wallets}
+
+    return json_response(dumps(wallet_data))
 
-    return jsonify(wallet_data), 200
+@user_bp.route('/portfolio', methods=['GET'])
+@token_required
+def get_portfolio(user_id):
+    """Стоимость всех кошельков в PLN по последним курсам и нереализованный P&L"""
+    return json_response(portfolio_cache.get(user_id))
+
+@user_bp.route('/portfolio/history', methods=['GET'])
+@token_required
+def get_portfolio_history(user_id):
+    """Стоимость портфеля в PLN по дням (из журнала транзакций и истории курсов)"""
+    price = request.args.get('price', 'bid')
+    if price not in PRICES:
+        return jsonify({"error": f"Price must be one of: {', '.join(PRICES)}"}), 400
+
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        start_date = parse_date(start_date) if start_date else None
+        end_date = parse_date(end_date) if end_date else None
+    except BadRequest as e:
+        return jsonify({"error": e.description}), 400
+    if start_date and not 0 <= ((end_date or datetime.utcnow().date()) - start_date).days < MAX_DAYS:
+        return jsonify({"error": f"Date range must be ordered and shorter than {MAX_DAYS} days"}), 400
+
+    result = portfolio_value_series(user_id, start_date, end_date, price)
+    result.update({'base_currency': BASE_CURRENCY, 'price': price})
+    return json_response(dumps(result))
 
 @user_bp.route('/favorites', methods=['GET'])
 @token_required
@@ -181,7 +238,7 @@ def add_favorite_currency(user_id):
         return jsonify({'error': 'Currency code is required'}), 400
 
     user = User.query.get_or_404(user_id)
-    currency = CurrencyRate.query.filter_by(code=currency_code).first()
+    currency = db.session.get(LatestCurrencyRate, currency_code)
 
     if not currency:
         return jsonify({'error': 'Currency not found'}), 404
@@ -1,14 +1,53 @@
 # application/services/wallet_service.py
 
+from sqlalchemy import bindparam, func, select, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
 from application.extension import db
-from user.models import Wallet
-from decimal import Decimal
+from user.models import LedgerEntry, LedgerState, Wallet, WalletVersion
+from application.money import parse_amount
 
 
 class WalletError(Exception):
     pass
 
 
+LEDGER_STATE_ROW_ID = 1
+
+_folded_through = func.coalesce(
+    select(LedgerState.folded_through).where(LedgerState.id == LEDGER_STATE_ROW_ID).scalar_subquery(), 0
+)
+
+_ledger_tail = select(func.coalesce(func.sum(LedgerEntry.delta), 0)).where(
+    LedgerEntry.user_id == Wallet.user_id,
+    LedgerEntry.currency_code == Wallet.currency_code,
+    LedgerEntry.id > _folded_through
+).scalar_subquery()
+
+# Баланс кошелька для чтения: свертка wallets.balance плюс еще не свернутые записи
+# журнала (user.ledger). Без режима WALLET_LEDGER хвост пуст и это просто Wallet.balance
+wallet_balance = type_coerce(Wallet.balance + _ledger_tail, Wallet.balance.type).label('balance')
+
+
+_bump = sqlite_insert(WalletVersion).values(user_id=bindparam('owner'), version=1)
+_BUMP_WALLET_VERSION = _bump.on_conflict_do_update(
+    index_elements=[WalletVersion.user_id],
+    set_={'version': WalletVersion.version + 1}
+)
+
+_READ_WALLET_VERSION = select(WalletVersion.version).where(WalletVersion.user_id == bindparam('owner'))
+
+
+def bump_wallet_version(user_id):
+    """Отметить изменение кошельков пользователя (вызывать в той же транзакции, что и изменение)"""
+    db.session.connection().execute(_BUMP_WALLET_VERSION, {'owner': user_id})
+
+
+def read_wallet_version(user_id):
+    """Текущая версия кошельков пользователя (0, если они еще не менялись)"""
+    return db.session.connection().execute(_READ_WALLET_VERSION, {'owner': user_id}).scalar() or 0
+
+
 def deposit_funds(user_id, currency_code, amount):
     """Функция пополнения средств на кошельке"""
     if not amount or amount <= 0:
@@ -18,7 +57,8 @@ def deposit_funds(user_id, currency_code, amount):
     if not wallet:
         raise WalletError(f"Wallet with currency {currency_code} not found")
 
-    wallet.balance += Decimal(amount)  # Пополнение баланса
+    wallet.balance += parse_amount(amount)  # Пополнение баланса
+    bump_wallet_version(user_id)
     db.session.commit()
 
 
@@ -31,8 +71,10 @@ def withdraw_funds(user_id, currency_code, amount):
     if not wallet:
         raise WalletError(f"Wallet with currency {currency_code} not found")
 
-    if wallet.balance < Decimal(amount):
+    amount = parse_amount(amount)
+    if wallet.balance < amount:
         raise WalletError("Insufficient funds")
 
-    wallet.balance -= Decimal(amount)  # Снятие средств
+    wallet.balance -= amount  # Снятие средств
+    bump_wallet_version(user_id)
     db.session.commit()